@@ -6,3 +6,7 @@ class ApiConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        """Метод подключения обработчиков сигналов."""
+        from api import signals  # noqa: F401
@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+from foodgram.constants import INGREDIENT_CATALOG_DIR, INGREDIENT_CATALOG_KEEP
+from foodgram.models import Ingredient
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'ingredients.current.json'
+
+
+def get_catalog_directory():
+    """Функция получения папки снимков каталога в медиа."""
+    return os.path.join(settings.MEDIA_ROOT, INGREDIENT_CATALOG_DIR)
+
+
+def write_file(path, content):
+    """Функция атомарной записи файла."""
+    with tempfile.NamedTemporaryFile(
+        'wb', dir=os.path.dirname(path), delete=False, suffix='.tmp'
+    ) as file:
+        file.write(content)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+def write_ingredient_catalog():
+    """Функция записи снимка каталога ингредиентов.
+
+    Имя файла содержит хэш содержимого, поэтому снимок неизменяем и
+    может кэшироваться навсегда. Рядом пишутся сжатые gzip и brotli
+    копии для отдачи nginx без сжатия на лету, затем обновляется
+    манифест с текущей версией. Старые снимки, кроме предыдущего,
+    удаляются.
+    """
+    content = json.dumps(
+        list(Ingredient.objects.order_by('id').values(
+            'id', 'name', 'measurement_unit'
+        )),
+        ensure_ascii=False, separators=(',', ':')
+    ).encode()
+    version = hashlib.sha256(content).hexdigest()[:16]
+    directory = get_catalog_directory()
+    os.makedirs(directory, exist_ok=True)
+    name = f'ingredients.{version}.json'
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        write_file(path + '.gz', gzip.compress(content, 9, mtime=0))
+        if brotli is not None:
+            write_file(path + '.br', brotli.compress(content))
+        write_file(path, content)
+    else:
+        os.utime(path)
+    manifest = {
+        'version': version,
+        'url': f'{settings.MEDIA_URL}{INGREDIENT_CATALOG_DIR}/{name}',
+    }
+    write_file(
+        os.path.join(directory, MANIFEST_NAME), json.dumps(manifest).encode()
+    )
+    snapshots = sorted(
+        (entry for entry in os.scandir(directory)
+         if entry.name.endswith('.json') and entry.name != MANIFEST_NAME),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for entry in snapshots[INGREDIENT_CATALOG_KEEP:]:
+        for suffix in ('', '.gz', '.br'):
+            if os.path.exists(entry.path + suffix):
+                os.remove(entry.path + suffix)
+    return manifest
+
+
+def read_catalog_manifest():
+    """Функция чтения манифеста текущего снимка каталога."""
+    try:
+        with open(
+            os.path.join(get_catalog_directory(), MANIFEST_NAME),
+            encoding='utf-8'
+        ) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from foodgram.constants import (EVENTS_HEARTBEAT_INTERVAL, EVENTS_IDLE_TIMEOUT,
+                                EVENTS_MAX_CONNECTIONS, EVENTS_POLL_BATCH,
+                                EVENTS_POLL_INTERVAL, EVENTS_POLL_WINDOW,
+                                EVENTS_QUEUE_SIZE, EVENTS_RETRY_MS,
+                                EVENTS_SEND_TIMEOUT)
+from foodgram.models import Recipe, Subscription
+
+EVENTS_PATH = '/api/recipes/events/'
+
+logger = logging.getLogger(__name__)
+
+
+def database_sync_to_async(func):
+    """Функция обёртки запросов к базе для вызова из асинхронного кода.
+
+    Как и в обработке запроса Django, соединение закрывается, если оно
+    устарело или сломано, например после перезапуска PostgreSQL, иначе
+    одно соединение жило бы всё время работы процесса.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+def get_author_ids(token_key):
+    """Функция получения id авторов из подписок владельца токена."""
+    user_id = Token.objects.filter(key=token_key).values_list(
+        'user_id', flat=True
+    ).first()
+    if user_id is None:
+        return None
+    return set(Subscription.objects.filter(user_id=user_id).values_list(
+        'subscription_id', flat=True
+    ))
+
+
+def make_event(recipe_id, name, author_id, created):
+    """Функция получения события о рецепте."""
+    return {'id': recipe_id, 'name': name, 'author': author_id,
+            'created': created.isoformat()}
+
+
+def get_new_recipes(after_id, author_ids=None):
+    """Функция получения событий о рецептах новее after_id."""
+    recipes = Recipe.objects.filter(id__gt=after_id)
+    if author_ids is not None:
+        recipes = recipes.filter(author_id__in=author_ids)
+    return [
+        make_event(*row) for row in recipes.order_by('id').values_list(
+            'id', 'name', 'author_id', 'created'
+        )[:EVENTS_POLL_BATCH]
+    ]
+
+
+def get_recent_recipes(newest=None):
+    """Функция получения рецептов за EVENTS_POLL_WINDOW секунд до newest.
+
+    newest это дата самого нового известного рецепта, окно отсчитывается
+    от неё, а не от часов процесса. Без newest окно отсчитывается от
+    последнего рецепта в базе. Отдаёт пары (дата создания, событие).
+    """
+    if newest is None:
+        newest = Recipe.objects.order_by('-created').values_list(
+            'created', flat=True
+        ).first() or timezone.now()
+    return [
+        (row[3], make_event(*row))
+        for row in Recipe.objects.filter(
+            created__gte=newest - timedelta(seconds=EVENTS_POLL_WINDOW)
+        ).order_by('id').values_list('id', 'name', 'author_id', 'created')
+    ]
+
+
+class Subscriber:
+    """Подключение к потоку событий с ограниченной очередью.
+
+    Если клиент не успевает читать и очередь переполнилась, новые
+    события не копятся: клиент получает событие reset и отключается,
+    после чего перечитывает ленту обычным запросом.
+    """
+
+    def __init__(self, author_ids):
+        self.author_ids = author_ids
+        self.queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        """Метод постановки события в очередь подключения."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBroker:
+    """Брокер событий о новых рецептах внутри процесса.
+
+    Подключения хранятся по id авторов, поэтому событие раздаётся только
+    подписчикам автора. Источник событий здесь локальная замена внешнего
+    брокера: одна задача процесса раз в EVENTS_POLL_INTERVAL читает новые
+    рецепты одним запросом по дате создания, сколько бы ни было
+    подключений.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.connections = 0
+        self.poller = None
+
+    def subscribe(self, subscriber):
+        """Метод регистрации подключения."""
+        for author_id in subscriber.author_ids:
+            self.subscribers.setdefault(author_id, set()).add(subscriber)
+        self.connections += 1
+        if self.poller is None:
+            self.poller = asyncio.ensure_future(self.poll())
+
+    def unsubscribe(self, subscriber):
+        """Метод удаления подключения."""
+        for author_id in subscriber.author_ids:
+            subscribers = self.subscribers.get(author_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(author_id, None)
+        self.connections -= 1
+        if not self.connections and self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+    def publish(self, event):
+        """Метод раздачи события подписчикам автора рецепта."""
+        for subscriber in self.subscribers.get(event['author'], ()):
+            subscriber.offer(event)
+
+    async def poll(self):
+        """Метод чтения новых рецептов, пока есть подключения.
+
+        Рецепт с меньшим id может зафиксироваться позже рецепта с большим,
+        поэтому каждый раз перечитываются рецепты за окно
+        EVENTS_POLL_WINDOW и раздаются ещё не разосланные. Ошибка чтения
+        пишется в лог и не останавливает задачу.
+        """
+        seen = None
+        try:
+            while True:
+                try:
+                    seen = await self.publish_recent(seen)
+                except Exception:
+                    logger.exception('Не удалось прочитать новые рецепты.')
+                await asyncio.sleep(EVENTS_POLL_INTERVAL)
+        finally:
+            if self.poller is asyncio.current_task():
+                self.poller = None
+
+    async def publish_recent(self, seen):
+        """Метод раздачи рецептов окна, которых нет в seen.
+
+        seen это {id: дата создания} уже известных рецептов окна, без него
+        рецепты окна только запоминаются. Возвращает новое seen.
+        """
+        newest = max(seen.values()) if seen else None
+        recipes = await database_sync_to_async(get_recent_recipes)(newest)
+        if seen is None:
+            return {event['id']: created for created, event in recipes}
+        for created, event in recipes:
+            if event['id'] not in seen:
+                seen[event['id']] = created
+                self.publish(event)
+        if not seen:
+            return seen
+        window_start = max(seen.values()) - timedelta(
+            seconds=EVENTS_POLL_WINDOW
+        )
+        return {
+            recipe_id: created for recipe_id, created in seen.items()
+            if created >= window_start
+        }
+
+
+broker = EventBroker()
+
+
+def get_token_key(scope):
+    """Функция получения токена из заголовка или параметра token.
+
+    EventSource в браузере не умеет передавать заголовки, поэтому токен
+    можно указать в строке запроса.
+    """
+    headers = dict(scope['headers'])
+    authorization = headers.get(b'authorization', b'').decode('latin-1')
+    if authorization.startswith('Token '):
+        return authorization[len('Token '):].strip()
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return query.get('token', [None])[0]
+
+
+def get_last_event_id(scope):
+    """Функция получения id последнего полученного клиентом события."""
+    value = dict(scope['headers']).get(b'last-event-id', b'')
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def format_event(event):
+    """Функция форматирования события рецепта для text/event-stream."""
+    return (
+        f'id: {event["id"]}\nevent: recipe\n'
+        f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
+    )
+
+
+async def send_response(send, status, detail, headers=()):
+    """Функция отправки короткого ответа с ошибкой."""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), *headers],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps({'detail': detail}, ensure_ascii=False).encode(),
+    })
+
+
+async def send_text(send, text):
+    """Функция отправки части потока с ограничением по времени.
+
+    Сервер ASGI не завершает send, пока клиент не разберёт буфер, поэтому
+    медленный клиент отключается по EVENTS_SEND_TIMEOUT.
+    """
+    await asyncio.wait_for(send({
+        'type': 'http.response.body',
+        'body': text.encode(),
+        'more_body': True,
+    }), EVENTS_SEND_TIMEOUT)
+
+
+async def wait_disconnect(receive):
+    """Функция ожидания отключения клиента."""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(subscriber, last_event_id, receive, send):
+    """Функция отправки событий подключению до отключения или простоя.
+
+    Раз в EVENTS_HEARTBEAT_INTERVAL отправляется комментарий, чтобы
+    прокси не закрывал соединение. Без событий дольше
+    EVENTS_IDLE_TIMEOUT поток закрывается, клиент переподключится
+    с Last-Event-ID и не потеряет события.
+    """
+    loop = asyncio.get_running_loop()
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    idle_since = loop.time()
+    replayed = set()
+    try:
+        await send_text(send, f'retry: {EVENTS_RETRY_MS}\n\n')
+        if last_event_id is not None:
+            for event in await database_sync_to_async(get_new_recipes)(
+                last_event_id, subscriber.author_ids
+            ):
+                await send_text(send, format_event(event))
+                replayed.add(event['id'])
+        while not disconnected.done():
+            if subscriber.overflowed:
+                await send_text(send, 'event: reset\ndata: {}\n\n')
+                break
+            received = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                (received, disconnected),
+                timeout=EVENTS_HEARTBEAT_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if received in done:
+                event = received.result()
+                if event['id'] not in replayed:
+                    await send_text(send, format_event(event))
+                    idle_since = loop.time()
+                continue
+            received.cancel()
+            if disconnected.done():
+                break
+            if loop.time() - idle_since >= EVENTS_IDLE_TIMEOUT:
+                break
+            await send_text(send, ': ping\n\n')
+    except asyncio.TimeoutError:
+        return
+    finally:
+        disconnected.cancel()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def recipe_events(scope, receive, send):
+    """Приложение ASGI потока событий о новых рецептах подписок."""
+    token_key = get_token_key(scope)
+    author_ids = None
+    if token_key:
+        author_ids = await database_sync_to_async(get_author_ids)(
+            token_key
+        )
+    if author_ids is None:
+        return await send_response(
+            send, 401, 'Учетные данные не были предоставлены.'
+        )
+    if broker.connections >= EVENTS_MAX_CONNECTIONS:
+        return await send_response(
+            send, 503, 'Слишком много подключений.',
+            ((b'retry-after', str(EVENTS_RETRY_MS // 1000).encode()),)
+        )
+    subscriber = Subscriber(author_ids)
+    broker.subscribe(subscriber)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await stream_events(
+            subscriber, get_last_event_id(scope), receive, send
+        )
+    finally:
+        broker.unsubscribe(subscriber)
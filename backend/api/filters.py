@@ -1,24 +1,69 @@
-from django_filters import AllValuesMultipleFilter
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (Case, Count, F, FloatField, Func, IntegerField,
+                              OuterRef, Q, Subquery, Value, When)
+from django.db.models.functions import Cast, Coalesce, Ln
 from django_filters import rest_framework as filters
-from rest_framework.filters import SearchFilter
 
-from foodgram.models import Recipe
+from foodgram.constants import RECIPE_ORDERINGS
+from foodgram.models import IngredientRecipe, Recipe, Tag
 
 
-class IngredientFilter(SearchFilter):
-    """Настройки фильтра Ингредиентов."""
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Фильтр по списку чисел через запятую."""
 
-    search_param = 'name'
+
+class IntersectionCount(Func):
+    """Число общих элементов двух массивов int (расширение intarray)."""
+
+    template = 'icount(%(expressions)s)'
+    arg_joiner = ' & '
+    output_field = IntegerField()
+
+
+class ArrayCount(Func):
+    """Число элементов массива int (расширение intarray)."""
+
+    function = 'icount'
+    output_field = IntegerField()
+
+
+def count_ingredients(**lookups):
+    """Функция подзапроса числа ингредиентов рецепта."""
+    return Coalesce(Subquery(
+        IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk'), **lookups
+        ).order_by().values('recipe').annotate(
+            count=Count('id')
+        ).values('count')
+    ), 0)
 
 
 class RecipeFilter(filters.FilterSet):
     """Настройки фильтра Рецептов."""
 
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+    )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(
+        method='filter_exclude_ingredients'
+    )
+    min_match = filters.NumberFilter(
+        method='filter_min_match', min_value=0, max_value=1
+    )
+    ordering = filters.ChoiceFilter(
+        choices=RECIPE_ORDERINGS, method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
@@ -36,6 +81,7 @@ class RecipeFilter(filters.FilterSet):
 
         if value:
             return queryset.filter(favorite__user=self.request.user)
+        return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Метод фильтрации, в списке покупок ли рецепт."""
@@ -44,3 +90,97 @@ class RecipeFilter(filters.FilterSet):
 
         if value:
             return queryset.filter(shopping_cart__user=self.request.user)
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Метод полнотекстового поиска по названию и описанию.
+
+        Рецепты сортируются по релевантности, при SEARCH_POPULARITY_WEIGHT
+        больше нуля релевантность умножается на логарифм числа добавлений
+        в избранное. Без PostgreSQL ищутся подстроки всех слов запроса.
+        """
+        if connection.vendor == 'postgresql':
+            query = SearchQuery(
+                value, config='russian', search_type='websearch'
+            )
+            queryset = queryset.filter(search_vector=query)
+            rank = SearchRank(F('search_vector'), query)
+        else:
+            words = value.split()
+            for word in words:
+                queryset = queryset.filter(
+                    Q(name__icontains=word) | Q(text__icontains=word)
+                )
+            rank = sum(
+                (Case(
+                    When(name__icontains=word, then=Value(1.0)),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                ) for word in words),
+                Value(1.0)
+            )
+        weight = settings.SEARCH_POPULARITY_WEIGHT
+        if weight:
+            rank = rank * (Value(1.0) + Value(weight) * Ln(
+                Value(1.0) + Cast('favorites_count', FloatField())
+            ))
+        return queryset.annotate(search_rank=rank).order_by(
+            '-search_rank', '-created', '-id'
+        )
+
+    def filter_ingredients(self, queryset, name, value):
+        """Метод поиска рецептов по имеющимся продуктам.
+
+        Рецепты сортируются по доле своих ингредиентов, которые есть среди
+        переданных, min_match задаёт нижнюю границу этой доли. В
+        PostgreSQL используется GIN индекс массивов id ингредиентов.
+        """
+        pantry = sorted({int(ingredient_id) for ingredient_id in value})
+        if not pantry:
+            return queryset
+        if connection.vendor == 'postgresql':
+            ingredient_ids = F('ingredient_index__ingredient_ids')
+            queryset = queryset.filter(
+                ingredient_index__ingredient_ids__overlap=pantry
+            ).annotate(
+                pantry_matches=IntersectionCount(
+                    ingredient_ids,
+                    Value(pantry, output_field=ArrayField(IntegerField()))
+                ),
+                ingredients_count=ArrayCount(ingredient_ids),
+            )
+        else:
+            queryset = queryset.annotate(
+                pantry_matches=count_ingredients(ingredient__in=pantry),
+                ingredients_count=count_ingredients(),
+            ).filter(pantry_matches__gt=0)
+        queryset = queryset.annotate(pantry_coverage=Cast(
+            'pantry_matches', FloatField()
+        ) / F('ingredients_count'))
+        min_match = self.form.cleaned_data.get('min_match')
+        if min_match:
+            queryset = queryset.filter(pantry_coverage__gte=min_match)
+        return queryset.order_by(
+            '-pantry_coverage', '-pantry_matches', '-created', '-id'
+        )
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        """Метод исключения рецептов с нежелательными продуктами."""
+        excluded = sorted({int(ingredient_id) for ingredient_id in value})
+        if not excluded:
+            return queryset
+        if connection.vendor == 'postgresql':
+            return queryset.exclude(
+                ingredient_index__ingredient_ids__overlap=excluded
+            )
+        return queryset.exclude(ingredient_recipe__ingredient__in=excluded)
+
+    def filter_min_match(self, queryset, name, value):
+        """Метод-заглушка: доля совпадений учитывается в filter_ingredients."""
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        """Метод сортировки по рейтингу, посчитанному rank_recipes."""
+        return queryset.filter(ranking__isnull=False).order_by(
+            f'-ranking__{value}_score', '-id'
+        )
@@ -0,0 +1,270 @@
+import os
+import re
+import tempfile
+import threading
+import uuid
+from bisect import bisect_left
+from heapq import nsmallest
+from itertools import islice
+from math import ceil
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+from foodgram.constants import (INGREDIENT_INDEX_CHECK_INTERVAL,
+                                INGREDIENT_POPULARITY_TTL,
+                                INGREDIENT_SEARCH_CANDIDATES,
+                                INGREDIENT_TRIGRAM_THRESHOLD)
+from foodgram.models import Ingredient
+
+WORD_RE = re.compile(r'\w+')
+
+
+def get_trigrams(text):
+    """Функция получения триграмм строки так же, как в pg_trgm.
+
+    Каждое слово дополняется двумя пробелами в начале и одним в конце.
+    """
+    trigrams = set()
+    for word in WORD_RE.findall(text.lower()):
+        word = f'  {word} '
+        trigrams.update(
+            word[index:index + 3] for index in range(len(word) - 2)
+        )
+    return trigrams
+
+
+class IngredientPrefixIndex:
+    """Индекс ингредиентов в памяти процесса для поиска по префиксу.
+
+    Названия в нижнем регистре хранятся в отсортированном кортеже и
+    ищутся через bisect. Индекс строится при первом запросе и
+    перестраивается, когда меняется версия в общем для контейнеров файле. Для
+    ранжированного поиска хранятся также списки позиций названий по
+    триграммам и популярность ингредиентов в рецептах, посчитанная
+    rank_recipes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = ((), ())
+        self.trigrams = {}
+        self.popularity = ()
+        self.version = None
+        self.checked = None
+        self.popularity_checked = None
+
+    @property
+    def version_file(self):
+        """Путь к файлу версии каталога ингредиентов.
+
+        Файл должен быть общим для всех контейнеров приложения, поэтому
+        по умолчанию он лежит в общей папке медиа.
+        """
+        return settings.INGREDIENT_INDEX_VERSION_FILE or os.path.join(
+            settings.MEDIA_ROOT, 'ingredients.version'
+        )
+
+    def read_version(self):
+        """Метод чтения текущей версии каталога ингредиентов."""
+        try:
+            with open(self.version_file, encoding='utf-8') as file:
+                return file.read()
+        except OSError:
+            return ''
+
+    def bump_version(self):
+        """Метод смены версии каталога после изменения ингредиентов."""
+        directory = os.path.dirname(self.version_file)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            'w', dir=directory, delete=False, encoding='utf-8'
+        ) as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(file.name, self.version_file)
+        self.checked = None
+
+    def build(self, version):
+        """Метод построения индекса по всем ингредиентам."""
+        rows = sorted(
+            (name.lower(), ingredient_id, name, measurement_unit)
+            for ingredient_id, name, measurement_unit
+            in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        postings = {}
+        for position, row in enumerate(rows):
+            for trigram in get_trigrams(row[0]):
+                postings.setdefault(trigram, []).append(position)
+        self.data = tuple(row[0] for row in rows), tuple(
+            {'id': ingredient_id, 'name': name,
+             'measurement_unit': measurement_unit}
+            for _, ingredient_id, name, measurement_unit in rows
+        )
+        self.trigrams = postings
+        self.build_popularity()
+        self.version = version
+
+    def build_popularity(self):
+        """Метод чтения популярности ингредиентов, её считает rank_recipes."""
+        counts = dict(Ingredient.objects.values_list('id', 'popularity'))
+        self.popularity = tuple(
+            counts.get(row['id'], 0) for row in self.data[1]
+        )
+        self.popularity_checked = monotonic()
+
+    def refresh(self):
+        """Метод перестроения индекса, если сменилась версия."""
+        now = monotonic()
+        if (
+            self.checked is not None
+            and now - self.checked < INGREDIENT_INDEX_CHECK_INTERVAL
+        ):
+            return
+        version = self.read_version()
+        with self.lock:
+            if self.version != version:
+                self.build(version)
+            elif now - self.popularity_checked >= INGREDIENT_POPULARITY_TTL:
+                self.build_popularity()
+            self.checked = now
+
+    def get_prefix_positions(self, prefix, limit):
+        """Метод получения позиций первых limit названий с началом prefix."""
+        keys = self.data[0]
+        start = bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and end - start < limit:
+            if not keys[end].startswith(prefix):
+                break
+            end += 1
+        return range(start, end)
+
+    def search(self, prefix, limit):
+        """Метод поиска ингредиентов по началу названия."""
+        self.refresh()
+        rows = self.data[1]
+        return [
+            rows[position] for position
+            in self.get_prefix_positions(prefix.strip().lower(), limit)
+        ]
+
+    def get_candidates(self, query_trigrams):
+        """Метод выбора кандидатов для поиска по подстроке и триграммам.
+
+        Похожее название делит с запросом не меньше доли
+        INGREDIENT_TRIGRAM_THRESHOLD его триграмм, поэтому встречается
+        хотя бы в одном из самых редких списков триграмм, кроме этого
+        числа самых частых. Название с подстрокой запроса есть в списке
+        любой его триграммы без пробелов. Списки обходятся от самых
+        редких, всего берётся не больше INGREDIENT_SEARCH_CANDIDATES
+        позиций.
+        """
+        postings = self.trigrams
+        lists = sorted(
+            (postings.get(trigram, ()) for trigram in query_trigrams), key=len
+        )
+        required = ceil(INGREDIENT_TRIGRAM_THRESHOLD * len(lists))
+        lists = lists[:len(lists) - max(required, 1) + 1]
+        inner = [
+            postings.get(trigram, ()) for trigram in query_trigrams
+            if ' ' not in trigram
+        ]
+        if inner:
+            lists.insert(0, min(inner, key=len))
+        candidates = set()
+        for positions in lists:
+            candidates.update(islice(
+                positions, INGREDIENT_SEARCH_CANDIDATES - len(candidates)
+            ))
+            if len(candidates) >= INGREDIENT_SEARCH_CANDIDATES:
+                break
+        return candidates
+
+    def ranked_search(self, query, limit):
+        """Метод ранжированного поиска ингредиентов с опечатками.
+
+        Сначала идут совпадения по началу названия, затем по подстроке,
+        затем похожие по триграммам. Внутри группы выше ингредиенты,
+        которые чаще встречаются в рецептах. Запросы короче трёх символов
+        ищутся только по началу названия. Каждая группа просматривает не
+        больше INGREDIENT_SEARCH_CANDIDATES позиций, поэтому время поиска
+        не зависит от размера каталога.
+        """
+        self.refresh()
+        keys, rows = self.data
+        popularity = self.popularity
+        query = query.strip().lower()
+        if not query:
+            return self.search(query, limit)
+        ranks = dict.fromkeys(
+            self.get_prefix_positions(query, INGREDIENT_SEARCH_CANDIDATES),
+            (0, 0)
+        )
+        query_trigrams = get_trigrams(query)
+        if len(query) >= 3 and query_trigrams:
+            for position in self.get_candidates(query_trigrams):
+                if position in ranks:
+                    continue
+                if query in keys[position]:
+                    ranks[position] = (1, 0)
+                    continue
+                trigrams = get_trigrams(keys[position])
+                shared = len(query_trigrams & trigrams)
+                similarity = shared / (
+                    len(query_trigrams) + len(trigrams) - shared
+                )
+                if similarity >= INGREDIENT_TRIGRAM_THRESHOLD:
+                    ranks[position] = (2, -similarity)
+        found = nsmallest(
+            limit, ranks,
+            key=lambda position: (
+                *ranks[position], -popularity[position], position
+            )
+        )
+        return [rows[position] for position in found]
+
+
+def search_ingredients_db(query, limit):
+    """Функция ранжированного поиска ингредиентов в PostgreSQL.
+
+    Подстрока и похожесть ищутся по GIN индексу триграмм на UPPER(name),
+    при равенстве выше ингредиенты с большей посчитанной популярностью.
+    """
+    query = query.strip().upper()
+    ingredients = Ingredient.objects.annotate(upper_name=Upper('name'))
+    if query:
+        ingredients = ingredients.filter(
+            Q(upper_name__contains=query)
+            | Q(upper_name__trigram_similar=query)
+        )
+    return list(ingredients.annotate(
+        rank=Case(
+            When(upper_name__startswith=query, then=Value(0)),
+            When(upper_name__contains=query, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+        similarity=Case(
+            When(upper_name__contains=query, then=Value(0.0)),
+            default=TrigramSimilarity('upper_name', query),
+            output_field=FloatField(),
+        ),
+    ).order_by(
+        'rank', '-similarity', '-popularity', 'name', 'id'
+    ).values('id', 'name', 'measurement_unit')[:limit])
+
+
+def search_ingredients_ranked(query, limit):
+    """Функция ранжированного поиска: в PostgreSQL или в памяти."""
+    if connection.vendor == 'postgresql':
+        return search_ingredients_db(query, limit)
+    return ingredient_index.ranked_search(query, limit)
+
+
+ingredient_index = IngredientPrefixIndex()
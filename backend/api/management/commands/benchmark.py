@@ -0,0 +1,352 @@
+import json
+import math
+import platform
+from datetime import datetime, timezone
+from itertools import combinations
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+
+from api.urls import router_v1
+from foodgram.constants import (BENCHMARK_BATCH_SIZE, BENCHMARK_ITERATIONS,
+                                BENCHMARK_THRESHOLD, BENCHMARK_WARMUP)
+from foodgram.models import (Ingredient, Profile, Recipe, ShoppingCart,
+                             Subscription, Tag)
+
+SKIPPED_ROUTES = {
+    'users-activation': 'отправляет письма',
+    'users-resend-activation': 'отправляет письма',
+    'users-reset-password': 'отправляет письма',
+    'users-reset-password-confirm': 'меняет пароль',
+    'users-reset-username': 'отправляет письма',
+    'users-reset-username-confirm': 'меняет почту',
+    'users-set-password': 'меняет пароль',
+    'users-set-username': 'меняет почту',
+    'users-add-delete-avatar': 'записывает файлы',
+    'recipes-export-recipes': 'выгружает весь каталог',
+    'recipes-import-recipes': 'записывает файлы',
+}
+
+
+def percentile(values, percent):
+    """Функция вычисления перцентиля с линейной интерполяцией."""
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (
+        position - lower
+    )
+
+
+class Command(BaseCommand):
+    help = 'Замер задержек и числа SQL запросов эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=BENCHMARK_ITERATIONS
+        )
+        parser.add_argument('--warmup', type=int, default=BENCHMARK_WARMUP)
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON.'
+        )
+        parser.add_argument(
+            '--compare', help='Файл с результатами для сравнения.'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=BENCHMARK_THRESHOLD,
+            help='Допустимый рост p95 задержки, например 0.2 это 20%%.'
+        )
+        parser.add_argument(
+            '--filter', default='',
+            help='Запускать только сценарии, содержащие эту строку.'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('Число итераций должно быть больше нуля.')
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            cases = self.get_cases()
+            self.check_routes(cases)
+            for name, client, requests, _ in cases:
+                if options['filter'] not in name:
+                    continue
+                results[name] = self.measure(
+                    client, requests, options['iterations'], options['warmup']
+                )
+                self.stdout.write(
+                    f'{name}: p50 {results[name]["p50_ms"]:.2f} мс, '
+                    f'p95 {results[name]["p95_ms"]:.2f} мс, '
+                    f'p99 {results[name]["p99_ms"]:.2f} мс, '
+                    f'запросов {results[name]["queries"]}, '
+                    f'SQL {results[name]["sql_ms"]:.2f} мс'
+                )
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'recipes': Recipe.objects.count(),
+                'users': Profile.objects.count(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def get_cases(self):
+        """Метод подготовки сценариев по данным текущей базы.
+
+        Сценарий это (название, клиент, запросы, имена маршрутов).
+        Запрос это (метод, адрес) или (метод, адрес, тело JSON).
+        """
+        recipe = Recipe.objects.order_by('-id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        tags = list(Tag.objects.order_by('id')[:2])
+        if not recipe or not ingredient or not tags:
+            raise CommandError(
+                'Нет данных, сначала выполните loadcsv и generate_data.'
+            )
+        reader = Profile.objects.annotate(
+            carts_count=Count('shopping_cart')
+        ).order_by('-carts_count', 'id').first()
+        token, _ = Token.objects.get_or_create(user=reader)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        guest_client = Client()
+        toggle_recipe = Recipe.objects.exclude(
+            favorite__user=reader
+        ).exclude(shopping_cart__user=reader).order_by('id').first()
+        toggle_author = Profile.objects.exclude(id=reader.id).exclude(
+            subscription__user=reader
+        ).order_by('id').first()
+        short_link = client.get(
+            f'/api/recipes/{recipe.id}/get-link/'
+        ).json()['short-link']
+
+        filters = {
+            'tags': '&'.join(f'tags={tag.slug}' for tag in tags),
+            'author': f'author={recipe.author_id}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+        }
+        cases = [
+            ('api-root', client, [('get', '/api/')], ['api-root']),
+            ('tags-list', client, [('get', '/api/tags/')], ['tags-list']),
+            ('tags-detail', client, [('get', f'/api/tags/{tags[0].id}/')],
+             ['tags-detail']),
+            ('ingredients-list', client, [('get', '/api/ingredients/')],
+             ['ingredients-list']),
+            ('ingredients-search', client,
+             [('get', f'/api/ingredients/?name={ingredient.name[:2]}')],
+             ['ingredients-list']),
+            ('ingredients-catalog', client,
+             [('get', '/api/ingredients/catalog/')], ['ingredients-catalog']),
+            ('ingredients-detail', client,
+             [('get', f'/api/ingredients/{ingredient.id}/')],
+             ['ingredients-detail']),
+            ('recipes-list guest', guest_client, [('get', '/api/recipes/')],
+             ['recipes-list']),
+        ]
+        for size in range(len(filters) + 1):
+            for names in combinations(filters, size):
+                query = '&'.join(filters[name] for name in names)
+                cases.append((
+                    'recipes-list ' + ('+'.join(names) or 'all'), client,
+                    [('get', f'/api/recipes/?{query}')], ['recipes-list']
+                ))
+        last_page = max(Recipe.objects.count() // 6, 1)
+        cases += [
+            ('recipes-list deep page', client,
+             [('get', f'/api/recipes/?page={last_page}')], ['recipes-list']),
+            ('recipes-list popular', client,
+             [('get', '/api/recipes/?ordering=popular')], ['recipes-list']),
+            ('recipes-list trending', client,
+             [('get', '/api/recipes/?ordering=trending')], ['recipes-list']),
+            ('recipes-list cursor', client,
+             [('get', '/api/recipes/?cursor=')], ['recipes-list']),
+            ('recipes-feed', client,
+             [('get', '/api/recipes/feed/')], ['recipes-feed']),
+            ('recipes-detail', client,
+             [('get', f'/api/recipes/{recipe.id}/')], ['recipes-detail']),
+            ('recipes-similar', client,
+             [('get', f'/api/recipes/{recipe.id}/similar/')],
+             ['recipes-similar']),
+            ('recipes-get-link', client,
+             [('get', f'/api/recipes/{recipe.id}/get-link/')],
+             ['recipes-get-link']),
+            ('short-link redirect', guest_client,
+             [('get', short_link.replace('http://testserver', ''))], []),
+            ('recipes-shopping-cart-summary', client,
+             [('get', '/api/recipes/shopping_cart_summary/')],
+             ['recipes-shopping-cart-summary']),
+        ]
+        for file_format in ('txt', 'csv', 'json'):
+            cases.append((
+                f'recipes-download-shopping-cart {file_format}', client,
+                [('get', '/api/recipes/download_shopping_cart/'
+                         f'?format={file_format}')],
+                ['recipes-download-shopping-cart']
+            ))
+        if toggle_recipe:
+            for url_path, url_name in (
+                ('favorite', 'recipes-add-delete-favorite'),
+                ('shopping_cart', 'recipes-add-delete-shopping-cart'),
+            ):
+                url = f'/api/recipes/{toggle_recipe.id}/{url_path}/'
+                cases.append((
+                    f'{url_name} toggle', client,
+                    [('post', url), ('delete', url)], [url_name]
+                ))
+        batch_recipe_ids = list(Recipe.objects.exclude(
+            favorite__user=reader
+        ).exclude(shopping_cart__user=reader).order_by('id').values_list(
+            'id', flat=True
+        )[:BENCHMARK_BATCH_SIZE])
+        if batch_recipe_ids:
+            for url_path, url_name in (
+                ('favorite', 'recipes-batch-favorite'),
+                ('shopping_cart', 'recipes-batch-shopping-cart'),
+            ):
+                url = f'/api/recipes/{url_path}/batch/'
+                cases.append((
+                    f'{url_name} toggle', client,
+                    [('post', url, {'add': batch_recipe_ids}),
+                     ('post', url, {'remove': batch_recipe_ids})],
+                    [url_name]
+                ))
+        cart_owner = Profile.objects.exclude(id=reader.id).filter(
+            shopping_cart=None
+        ).order_by('id').first()
+        if batch_recipe_ids and cart_owner:
+            token, _ = Token.objects.get_or_create(user=cart_owner)
+            cases.append((
+                'recipes-clear-shopping-cart',
+                Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+                [('post', '/api/recipes/shopping_cart/batch/',
+                  {'add': batch_recipe_ids}),
+                 ('delete', '/api/recipes/shopping_cart/clear/')],
+                ['recipes-clear-shopping-cart']
+            ))
+        cases += [
+            ('users-list', client, [('get', '/api/users/')], ['users-list']),
+            ('users-detail', client,
+             [('get', f'/api/users/{recipe.author_id}/')], ['users-detail']),
+            ('users-me', client, [('get', '/api/users/me/')],
+             ['users-me', 'users-get-current-user-info']),
+            ('users-get-subscriptions', client,
+             [('get', '/api/users/subscriptions/?recipes_limit=3')],
+             ['users-get-subscriptions']),
+        ]
+        if toggle_author:
+            url = f'/api/users/{toggle_author.id}/subscribe/'
+            cases.append((
+                'users-set-subscription toggle', client,
+                [('post', url), ('delete', url)], ['users-set-subscription']
+            ))
+        batch_author_ids = list(Profile.objects.exclude(id=reader.id).exclude(
+            subscription__user=reader
+        ).order_by('id').values_list('id', flat=True)[:BENCHMARK_BATCH_SIZE])
+        if batch_author_ids:
+            url = '/api/users/subscribe/batch/'
+            cases.append((
+                'users-batch-subscriptions toggle', client,
+                [('post', url, {'add': batch_author_ids}),
+                 ('post', url, {'remove': batch_author_ids})],
+                ['users-batch-subscriptions']
+            ))
+        if not Subscription.objects.filter(user=reader).exists():
+            self.stderr.write('У пользователя нет подписок.')
+        if not ShoppingCart.objects.filter(user=reader).exists():
+            self.stderr.write('У пользователя пустая корзина.')
+        return cases
+
+    def check_routes(self, cases):
+        """Метод проверки, что каждый маршрут router_v1 замеряется."""
+        covered = {
+            route for _, _, _, routes in cases for route in routes
+        }
+        routes = {url.name for url in router_v1.urls}
+        for route in sorted(routes - covered - SKIPPED_ROUTES.keys()):
+            self.stderr.write(f'Маршрут {route} не покрыт замерами.')
+        for route, reason in SKIPPED_ROUTES.items():
+            self.stdout.write(f'Маршрут {route} пропущен: {reason}.')
+
+    def measure(self, client, requests, iterations, warmup):
+        """Метод замера сценария."""
+        for _ in range(warmup):
+            for request in requests:
+                self.read(self.send(client, *request))
+        latencies, queries, sql_times = [], [], []
+        statuses = set()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = perf_counter()
+                for request in requests:
+                    response = self.send(client, *request)
+                    self.read(response)
+                    statuses.add(response.status_code)
+                latencies.append((perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            sql_times.append(sum(
+                float(query['time']) for query in context.captured_queries
+            ) * 1000)
+        return {
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'queries': max(queries),
+            'sql_ms': sum(sql_times) / len(sql_times),
+            'statuses': sorted(statuses),
+        }
+
+    def send(self, client, method, url, data=None):
+        """Метод отправки запроса, тело передаётся как JSON."""
+        if data is None:
+            return getattr(client, method)(url)
+        return getattr(client, method)(
+            url, data, content_type='application/json'
+        )
+
+    def read(self, response):
+        """Метод чтения ответа целиком, включая потоковые."""
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def compare(self, results, path, threshold):
+        """Метод сравнения результатов с сохранёнными ранее."""
+        with open(path, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            previous = baseline[name]
+            if result['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(
+                    f'{name}: p95 {previous["p95_ms"]:.2f} -> '
+                    f'{result["p95_ms"]:.2f} мс'
+                )
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f'{name}: запросов {previous["queries"]} -> '
+                    f'{result["queries"]}'
+                )
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError(f'Найдено регрессий: {len(regressions)}')
+        self.stdout.write('Регрессий не найдено')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.catalog import brotli, write_ingredient_catalog
+
+
+class Command(BaseCommand):
+    help = 'Запись сжатого снимка каталога ингредиентов в медиа'
+
+    def handle(self, *args, **options):
+        manifest = write_ingredient_catalog()
+        if brotli is None:
+            self.stderr.write('Модуль brotli не установлен, .br не записан.')
+        self.stdout.write(
+            f'Снимок каталога {manifest["version"]}: {manifest["url"]}'
+        )
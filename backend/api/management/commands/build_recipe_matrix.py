@@ -0,0 +1,18 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from api.similar import build_recipe_matrix
+
+
+class Command(BaseCommand):
+    help = 'Сборка матрицы рецептов для поиска похожих рецептов'
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        recipes_count, features_count = build_recipe_matrix()
+        self.stdout.write(
+            f'Матрица собрана: рецептов {recipes_count}, '
+            f'связей {features_count}, '
+            f'время {monotonic() - started:.2f} с'
+        )
@@ -0,0 +1,280 @@
+import atexit
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+from time import monotonic
+
+from django.conf import settings
+
+from foodgram.constants import (METRICS_FLUSH_INTERVAL,
+                                METRICS_LATENCY_BUCKETS,
+                                METRICS_QUERIES_BUCKETS, METRICS_SIZE_BUCKETS)
+
+METRICS_FILE_RE = re.compile(r'metrics-(\d+)\.json')
+METRICS_FINISHED_FILE = 'metrics-finished.json'
+METRICS_LOCK_FILE = 'metrics.lock'
+
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Количество запросов.'
+    ),
+    'foodgram_http_errors_total': (
+        'counter', 'Количество ответов с ошибкой сервера.'
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса.'
+    ),
+    'foodgram_http_response_size_bytes': (
+        'histogram', 'Размер ответа.'
+    ),
+    'foodgram_db_queries': (
+        'histogram', 'Количество SQL запросов за запрос.'
+    ),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Суммарное время SQL запросов.'
+    ),
+}
+
+
+def escape_label(value):
+    """Функция экранирования значения метки Prometheus."""
+    return (
+        str(value).replace('\\', '\\\\')
+        .replace('\n', '\\n').replace('"', '\\"')
+    )
+
+
+def format_labels(labels):
+    """Функция форматирования меток Prometheus."""
+    return ','.join(
+        f'{name}="{escape_label(value)}"'
+        for name, value in sorted(labels.items())
+    )
+
+
+def merge_metrics(total, data):
+    """Функция прибавления метрик data к сумме total."""
+    for name, metric in data['counters'].items():
+        counters = total['counters'].setdefault(name, {})
+        for key, value in metric.items():
+            counters[key] = counters.get(key, 0) + value
+    for name, metric in data['histograms'].items():
+        histograms = total['histograms'].setdefault(name, {})
+        for key, histogram in metric.items():
+            if key not in histograms:
+                histograms[key] = histogram
+                continue
+            histograms[key]['sum'] += histogram['sum']
+            histograms[key]['counts'] = [
+                first + second for first, second in zip(
+                    histograms[key]['counts'], histogram['counts']
+                )
+            ]
+    return total
+
+
+def read_metrics(path):
+    """Функция чтения файла метрик, None если его нет или он повреждён."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def process_exists(pid):
+    """Функция проверки, что процесс с pid ещё работает."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """Хранилище метрик процесса.
+
+    Метрики копятся в памяти и сбрасываются в файл процесса в общей
+    папке периодически и при завершении процесса, эндпоинт метрик
+    суммирует файлы всех воркеров. Метрики завершившихся воркеров при
+    сборе переносятся в общий файл METRICS_FINISHED_FILE, как в
+    multiprocess режиме prometheus_client, поэтому счётчики не
+    уменьшаются после перезапуска воркера. Папка не должна быть общей
+    для разных контейнеров: номера процессов в них независимы.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed = monotonic()
+
+    @property
+    def directory(self):
+        """Папка файлов метрик всех процессов."""
+        return getattr(settings, 'METRICS_DIR', None) or os.path.join(
+            tempfile.gettempdir(), 'foodgram_metrics'
+        )
+
+    def inc(self, name, labels, value=1):
+        """Метод увеличения счётчика."""
+        key = format_labels(labels)
+        with self.lock:
+            metric = self.counters.setdefault(name, {})
+            metric[key] = metric.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        """Метод добавления наблюдения в гистограмму."""
+        key = format_labels(labels)
+        with self.lock:
+            metric = self.histograms.setdefault(name, {})
+            histogram = metric.setdefault(key, {
+                'buckets': list(buckets),
+                'counts': [0] * (len(buckets) + 1),
+                'sum': 0,
+            })
+            index = next(
+                (index for index, bound in enumerate(histogram['buckets'])
+                 if value <= bound),
+                len(histogram['buckets'])
+            )
+            histogram['counts'][index] += 1
+            histogram['sum'] += value
+
+    def maybe_flush(self):
+        """Метод сброса метрик в файл, если прошёл интервал."""
+        if monotonic() - self.flushed >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def write(self, file_name, data):
+        """Метод атомарной записи JSON строки data в файл папки метрик."""
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            'w', dir=self.directory, delete=False, suffix='.tmp'
+        ) as file:
+            file.write(data)
+        os.replace(file.name, os.path.join(self.directory, file_name))
+
+    def flush(self):
+        """Метод атомарной записи метрик процесса в файл."""
+        with self.lock:
+            data = json.dumps({
+                'counters': self.counters,
+                'histograms': self.histograms,
+            })
+            self.flushed = monotonic()
+        self.write(f'metrics-{os.getpid()}.json', data)
+
+    def close(self):
+        """Метод сброса накопленных метрик при завершении процесса."""
+        if self.counters or self.histograms:
+            self.flush()
+
+    def fold_finished(self):
+        """Метод переноса метрик завершившихся процессов в общий файл.
+
+        Перенос идёт под блокировкой файла, чтобы воркеры, одновременно
+        собирающие метрики, не прибавили один файл дважды.
+        """
+        lock_path = os.path.join(self.directory, METRICS_LOCK_FILE)
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            finished = []
+            for file_name in sorted(os.listdir(self.directory)):
+                match = METRICS_FILE_RE.fullmatch(file_name)
+                if match and not process_exists(int(match.group(1))):
+                    finished.append(os.path.join(self.directory, file_name))
+            if not finished:
+                return
+            total = read_metrics(
+                os.path.join(self.directory, METRICS_FINISHED_FILE)
+            ) or {'counters': {}, 'histograms': {}}
+            for path in finished:
+                data = read_metrics(path)
+                if data is not None:
+                    merge_metrics(total, data)
+            self.write(METRICS_FINISHED_FILE, json.dumps(total))
+            for path in finished:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def collect(self):
+        """Метод суммирования метрик всех процессов."""
+        self.flush()
+        self.fold_finished()
+        total = {'counters': {}, 'histograms': {}}
+        for file_name in sorted(os.listdir(self.directory)):
+            if (
+                METRICS_FILE_RE.fullmatch(file_name) is None
+                and file_name != METRICS_FINISHED_FILE
+            ):
+                continue
+            data = read_metrics(os.path.join(self.directory, file_name))
+            if data is not None:
+                merge_metrics(total, data)
+        return total['counters'], total['histograms']
+
+    def render(self):
+        """Метод вывода метрик в текстовом формате Prometheus."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            lines += [
+                f'# HELP {name} {description}',
+                f'# TYPE {name} {metric_type}',
+            ]
+            for key, value in sorted(counters.get(name, {}).items()):
+                lines.append(f'{name}{{{key}}} {value}')
+            for key, histogram in sorted(histograms.get(name, {}).items()):
+                separator = ',' if key else ''
+                cumulative = 0
+                bounds = histogram['buckets'] + ['+Inf']
+                for bound, count in zip(bounds, histogram['counts']):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{{key}{separator}le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines += [
+                    f'{name}_sum{{{key}}} {histogram["sum"]}',
+                    f'{name}_count{{{key}}} {cumulative}',
+                ]
+        return '\n'.join(lines) + '\n'
+
+    def record_request(self, route, method, status_code, duration, size,
+                       queries, queries_duration):
+        """Метод записи метрик обработанного запроса."""
+        labels = {'route': route, 'method': method}
+        self.inc(
+            'foodgram_http_requests_total', {**labels, 'status': status_code}
+        )
+        if status_code >= 500:
+            self.inc('foodgram_http_errors_total', labels)
+        self.observe(
+            'foodgram_http_request_duration_seconds', labels, duration,
+            METRICS_LATENCY_BUCKETS
+        )
+        if size is not None:
+            self.observe(
+                'foodgram_http_response_size_bytes', labels, size,
+                METRICS_SIZE_BUCKETS
+            )
+        self.observe(
+            'foodgram_db_queries', labels, queries, METRICS_QUERIES_BUCKETS
+        )
+        self.inc(
+            'foodgram_db_query_duration_seconds_total', labels,
+            queries_duration
+        )
+        self.maybe_flush()
+
+
+metrics = MetricsStore()
+atexit.register(metrics.close)
@@ -0,0 +1,100 @@
+import logging
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Исключение превышения бюджета SQL запросов действия вьюсета."""
+
+
+def get_query_budget(view_class, action):
+    """Функция получения бюджета запросов действия вьюсета."""
+    return getattr(view_class, 'query_budget', {}).get(action)
+
+
+class QueryBudgetMiddleware:
+    """Проверка числа SQL запросов действий вьюсетов в режиме отладки.
+
+    Бюджет задаётся атрибутом query_budget вьюсета {действие: запросов}.
+    При превышении пишется предупреждение в лог, а при
+    QUERY_BUDGET_RAISE выбрасывается QueryBudgetExceeded.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response(request)
+        if not hasattr(request, 'query_budget'):
+            return response
+        name, budget = request.query_budget
+        queries = len(context.captured_queries)
+        if queries > budget:
+            message = (
+                f'{name}: {queries} SQL запросов при бюджете {budget} '
+                f'({request.method} {request.get_full_path()})'
+            )
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Метод определения бюджета вызываемого действия вьюсета."""
+        view_class = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        budget = get_query_budget(view_class, action)
+        if budget is not None:
+            request.query_budget = (f'{view_class.__name__}.{action}', budget)
+
+
+class MetricsMiddleware:
+    """Сбор метрик запросов: задержки, размера ответа и SQL запросов."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = {'count': 0, 'duration': 0}
+
+        def count_queries(execute, sql, params, many, context):
+            started = perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries['count'] += 1
+                queries['duration'] += perf_counter() - started
+
+        started = perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        duration = perf_counter() - started
+        if response.streaming:
+            size = None
+        else:
+            size = len(response.content)
+        match = request.resolver_match
+        metrics.record_request(
+            route=match.view_name if match else 'unresolved',
+            method=request.method,
+            status_code=response.status_code,
+            duration=duration,
+            size=size,
+            queries=queries['count'],
+            queries_duration=queries['duration'],
+        )
+        return response
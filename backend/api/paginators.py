@@ -1,8 +1,19 @@
-from rest_framework.pagination import (LimitOffsetPagination,
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (BasePagination, LimitOffsetPagination,
                                        PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from foodgram.constants import (MAX_PAGE_SIZE_IN_REQUEST, MAX_PAGE_SIZE,
-                                DEFAULT_PAGE_SIZE)
+                                DEFAULT_PAGE_SIZE, MAX_CURSOR_PAGE_SIZE,
+                                FEED_FANOUT_MAX_FOLLOWERS)
+from foodgram.models import Profile, Recipe, TimelineEntry
 
 
 class LimitNumberPaginator(PageNumberPagination):
@@ -16,3 +27,164 @@ class LimitSubscriptionsPaginator(LimitOffsetPagination):
     page_size = MAX_PAGE_SIZE_IN_REQUEST
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE
+
+
+class RecipeCursorPaginator(BasePagination):
+    """Пагинатор ленты Рецептов по ключу (created, id).
+
+    Позиция следующей страницы кодируется в непрозрачный курсор,
+    поэтому запрос не считает COUNT(*) и не использует OFFSET. Курсор
+    задаёт только порядок новизны, поэтому кверисет с другой сортировкой,
+    например по релевантности поиска или по рейтингу, отклоняется.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = DEFAULT_PAGE_SIZE
+    max_page_size = MAX_CURSOR_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+    ordering_message = (
+        'Курсор нельзя сочетать с сортировкой по поиску, продуктам '
+        'или рейтингу, для неё используйте page.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Метод получения страницы рецептов после позиции курсора."""
+        if queryset.query.order_by:
+            raise ValidationError(
+                {self.cursor_query_param: [self.ordering_message]}
+            )
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+        results = self.get_rows(queryset, position, reverse, page_size + 1)
+        has_more = len(results) > page_size
+        self.page = results[:page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def order_by_position(self, queryset, position, reverse,
+                          created='created', pk='id'):
+        """Метод сортировки и отбора строк после позиции курсора."""
+        if reverse:
+            queryset = queryset.order_by(created, pk)
+        else:
+            queryset = queryset.order_by(f'-{created}', f'-{pk}')
+        if position is None:
+            return queryset
+        lookup = 'gt' if reverse else 'lt'
+        return queryset.filter(
+            Q(**{f'{created}__{lookup}': position[0]})
+            | Q(**{created: position[0], f'{pk}__{lookup}': position[1]})
+        )
+
+    def get_rows(self, queryset, position, reverse, limit):
+        """Метод получения рецептов после позиции в порядке обхода."""
+        return list(self.order_by_position(
+            queryset, position, reverse
+        )[:limit])
+
+    def get_page_size(self, request):
+        """Метод получения размера страницы из параметров запроса."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        """Метод декодирования курсора в направление и позицию."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            created = parse_datetime(data['c'])
+            pk = int(data['i'])
+            reverse = bool(data.get('r'))
+        except (BinasciiError, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, (created, pk)
+
+    def encode_cursor(self, recipe, reverse):
+        """Метод кодирования позиции рецепта в ссылку с курсором."""
+        data = {'c': recipe.created.isoformat(), 'i': recipe.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(data).encode('ascii')
+        ).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded
+        )
+
+    def get_next_link(self):
+        """Метод получения ссылки на следующую страницу."""
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        """Метод получения ссылки на предыдущую страницу."""
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        """Метод формирования ответа со ссылками курсоров."""
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        """Метод описания схемы ответа пагинатора."""
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class FeedCursorPaginator(RecipeCursorPaginator):
+    """Пагинатор ленты подписок по ключу (created, id).
+
+    Страница собирается из ленты пользователя и из последних рецептов
+    популярных авторов, которые в ленты не раскладываются. Оба источника
+    читаются по индексу не больше чем на страницу вперёд, поэтому число
+    и стоимость запросов не зависят от числа подписок.
+    """
+
+    def get_rows(self, queryset, position, reverse, limit):
+        """Метод слияния ленты и рецептов популярных авторов."""
+        user = self.request.user
+        keys = list(self.order_by_position(
+            TimelineEntry.objects.filter(user=user), position, reverse,
+            pk='recipe_id'
+        ).values_list('created', 'recipe_id')[:limit])
+        keys += self.order_by_position(
+            Recipe.objects.filter(author__in=Profile.objects.filter(
+                subscription__user=user,
+                followers_count__gt=FEED_FANOUT_MAX_FOLLOWERS
+            )), position, reverse
+        ).values_list('created', 'id')[:limit]
+        keys = sorted(set(keys), reverse=not reverse)[:limit]
+        recipes = queryset.in_bulk([pk for _, pk in keys])
+        return [recipes[pk] for _, pk in keys if pk in recipes]
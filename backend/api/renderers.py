@@ -0,0 +1,86 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """Буфер, возвращающий записанную в него строку."""
+
+    def write(self, value):
+        """Метод записи строки."""
+        return value
+
+
+class ShoppingCartRenderer(ABC, BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Строки списка покупок это кортежи (название, единица, количество).
+    Метод stream отдаёт файл по частям для StreamingHttpResponse.
+    """
+
+    charset = 'utf-8'
+
+    @abstractmethod
+    def stream(self, rows):
+        """Метод построчной выгрузки списка покупок."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Метод рендера ответа целиком, например, ошибки."""
+        if isinstance(data, dict):
+            return '\n'.join(str(value) for value in data.values())
+        return ''.join(self.stream(data))
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    """Рендерер списка покупок в текстовый файл."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        """Метод построчной выгрузки списка покупок в текст."""
+        for name, measurement_unit, amount in rows:
+            title = f'{name} ({measurement_unit})'.capitalize()
+            yield f'{title} - {amount}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    """Рендерер списка покупок в CSV."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'measurement_unit', 'amount')
+
+    def stream(self, rows):
+        """Метод построчной выгрузки списка покупок в CSV."""
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    """Рендерер списка покупок в JSON."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Метод рендера ответа целиком, например, ошибки."""
+        if isinstance(data, dict):
+            return json.dumps(data, ensure_ascii=False)
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def stream(self, rows):
+        """Метод построчной выгрузки списка покупок в массив JSON."""
+        separator = '['
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps({
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            }, ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
@@ -1,13 +1,21 @@
 import base64
 
 from django.core.files.base import ContentFile
-from rest_framework import serializers
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework import serializers, status
+from rest_framework.relations import MANY_RELATION_KWARGS
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueTogetherValidator
 
-from foodgram.constants import (MAX_AMOUNT_VALUE, MAX_COOKING_TIME_SCORE,
-                                MIN_AMOUNT_VALUE, MIN_COOKING_TIME_SCORE)
+from api.utils import get_latest_recipes
+from foodgram.constants import (MAX_AMOUNT_VALUE, MAX_BATCH_SIZE,
+                                MAX_COOKING_TIME_SCORE, MIN_AMOUNT_VALUE,
+                                MIN_COOKING_TIME_SCORE)
+from foodgram.counters import change_counters_many
 from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                             ShoppingCart, Subscription, Tag, Profile)
+                             ShoppingCart, ShoppingListItem, Subscription, Tag,
+                             TagRecipe, TimelineEntry, Profile)
 
 
 class Base64ImageField(serializers.ImageField):
@@ -61,6 +69,8 @@ class UserListSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         """Метод, подписан ли пользователь."""
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return self.context['request'].user.is_authenticated and (
             self.context['request'].user.subscriber.filter(
                 subscription=obj.id).exists()
@@ -102,7 +112,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         """Метаданные сериализатора Ингредиентов."""
 
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -134,10 +144,80 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
 
+class PrefetchedManyRelatedField(serializers.ManyRelatedField):
+    """Поле списка первичных ключей, загружаемых одним запросом IN."""
+
+    def to_internal_value(self, data):
+        """Метод загрузки всех объектов списка перед проверкой."""
+        if isinstance(data, list):
+            self.child_relation.prefetch(data)
+        return super().to_internal_value(data)
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Поле первичного ключа с объектами, загруженными заранее.
+
+    Родительское поле списка передаёт в prefetch все значения, и
+    объекты читаются одним запросом IN вместо запроса на каждый ключ.
+    Ошибки те же, что у PrimaryKeyRelatedField.
+    """
+
+    objects = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        """Метод создания поля списка с загрузкой одним запросом."""
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return PrefetchedManyRelatedField(**list_kwargs)
+
+    def get_pk(self, data):
+        """Метод приведения значения к первичному ключу модели."""
+        if isinstance(data, bool):
+            raise TypeError
+        return self.get_queryset().model._meta.pk.get_prep_value(data)
+
+    def prefetch(self, values):
+        """Метод загрузки объектов по всем корректным значениям."""
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.get_pk(value))
+            except (TypeError, ValueError):
+                continue
+        self.objects = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        """Метод получения объекта из загруженных заранее."""
+        if self.objects is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_pk(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.objects:
+            self.fail('does_not_exist', pk_value=data)
+        return self.objects[pk]
+
+
+class IngredientAmountListSerializer(serializers.ListSerializer):
+    """Сериалайзер списка ингредиентов с загрузкой одним запросом."""
+
+    def to_internal_value(self, data):
+        """Метод загрузки всех ингредиентов списка перед проверкой."""
+        if isinstance(data, list):
+            self.child.fields['id'].prefetch(
+                item.get('id') for item in data if isinstance(item, dict)
+            )
+        return super().to_internal_value(data)
+
+
 class CreateIgredientRecipeSerializer(serializers.ModelSerializer):
     """Сериалайзер Ингредиентов и Количества."""
 
-    id = serializers.PrimaryKeyRelatedField(
+    id = PrefetchedPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(), source='ingredient'
     )
     amount = serializers.IntegerField()
@@ -147,6 +227,7 @@ class CreateIgredientRecipeSerializer(serializers.ModelSerializer):
 
         model = IngredientRecipe
         fields = ('id', 'amount')
+        list_serializer_class = IngredientAmountListSerializer
 
     def validate_amount(self, value):
         """Метод валидации поля ингредиентов."""
@@ -161,7 +242,7 @@ class CreateIgredientRecipeSerializer(serializers.ModelSerializer):
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериалайзер создания Рецепта."""
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = PrefetchedPrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all(), required=True
     )
     ingredients = CreateIgredientRecipeSerializer(
@@ -214,14 +295,8 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Выберите ингредиенты.'
             )
-        ingredients = list(value)
-        unique_ingredients = []
-
-        for ingredient in ingredients:
-            if ingredient not in unique_ingredients:
-                unique_ingredients.append(ingredient)
-
-        if len(ingredients) != len(unique_ingredients):
+        unique_ingredients = {element['ingredient'].id for element in value}
+        if len(value) != len(unique_ingredients):
             raise serializers.ValidationError(
                 'Нельзя выбрать один ингредиент два раза.'
             )
@@ -262,27 +337,108 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Метод применения разницы ингредиентов рецепта.
+
+        Удаляются и вставляются только убранные и добавленные ингредиенты,
+        у оставшихся обновляется количество, если оно изменилось. Строки
+        пишутся пакетно без сигналов, поэтому списки покупок всех, у кого
+        рецепт в корзине, обновляются здесь одним вызовом на всю разницу.
+        """
+        old_rows = {
+            row.ingredient_id: row
+            for row in recipe.ingredient_recipe.all()
+        }
+        new_amounts = {
+            element['ingredient'].id: element['amount']
+            for element in ingredients
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in old_rows.items()
+        }
+        changes = {
+            (recipe.id, ingredient_id): (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        IngredientRecipe.objects.delete_rows([
+            old_rows[ingredient_id].id
+            for ingredient_id in old_rows.keys() - new_amounts.keys()
+        ])
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = old_rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_update_ingredients(recipe, [
+            element for element in ingredients
+            if element['ingredient'].id not in old_rows
+        ])
+        ShoppingListItem.objects.change_ingredients(changes)
+
+    def update_tags(self, recipe, tags):
+        """Метод применения разницы тэгов рецепта."""
+        old_tag_ids = set(recipe.tag_recipe.values_list('tag_id', flat=True))
+        new_tag_ids = {tag.id for tag in tags}
+        if old_tag_ids - new_tag_ids:
+            recipe.tag_recipe.filter(
+                tag_id__in=old_tag_ids - new_tag_ids
+            ).delete()
+        if new_tag_ids - old_tag_ids:
+            TagRecipe.objects.bulk_create(
+                TagRecipe(recipe=recipe, tag_id=tag_id)
+                for tag_id in new_tag_ids - old_tag_ids
+            )
+
     def update(self, recipe, validated_data):
         """Метод обновления рецепта."""
         ingredients = validated_data.pop('ingredient_recipe')
         tags = validated_data.pop('tags')
         super().update(recipe, validated_data)
-        recipe.ingredient_recipe.all().delete()
-        self.create_update_ingredients(recipe, ingredients)
-        recipe.tag_recipe.all().delete()
-        recipe.tags.set(tags)
-        recipe.save()
+        self.update_ingredients(recipe, ingredients)
+        self.update_tags(recipe, tags)
         return recipe
 
     def to_representation(self, instance):
         """Метод представления рецепта."""
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+            'tags'
+        )
         serializer = RecipeSerializer(
             instance, context={'request': self.context['request']}
         )
         return serializer.data
 
 
-class AddRecipeSerializer(serializers.ModelSerializer):
+class UniqueRelationMixin:
+    """Примесь сериалайзеров связей с UniqueTogetherValidator."""
+
+    @classmethod
+    def get_unique_error(cls):
+        """Метод получения ошибки повторного создания связи.
+
+        Текст тот же, что у UniqueTogetherValidator из Meta.validators.
+        """
+        validator, = cls.Meta.validators
+        return serializers.ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: [validator.message.format(
+                field_names=', '.join(validator.fields)
+            )]
+        }, code='unique')
+
+
+class AddRecipeSerializer(UniqueRelationMixin, serializers.ModelSerializer):
     """Общий Сериалайзер добавления Рецепта."""
 
     recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
@@ -332,6 +488,22 @@ class ShoppingCartSerializer(AddRecipeSerializer):
         ]
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Сериалайзер сводного Списка покупок."""
+
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        """Метаданные сериализатора сводного Списка покупок."""
+
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """Сериалайзер сокращённых данных рецепта."""
 
@@ -347,7 +519,8 @@ class RecipeMinifiedSerializer(serializers.ModelSerializer):
         )
 
 
-class SubscriptionCreateSerializer(serializers.ModelSerializer):
+class SubscriptionCreateSerializer(UniqueRelationMixin,
+                                   serializers.ModelSerializer):
     """Сериалайзер создания подписак пользователя."""
 
     user = serializers.PrimaryKeyRelatedField(
@@ -388,6 +561,166 @@ class SubscriptionCreateSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
+class RelationBatchSerializer(serializers.Serializer):
+    """Общий Сериалайзер пакетного добавления удаления связей.
+
+    Каждый добавляемый id проверяется по правилам relation_serializer,
+    ответ содержит результат по каждому id. Пакет записывается в одной
+    транзакции пакетными INSERT и DELETE.
+    """
+
+    relation_serializer = None
+    missing_message = None
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=MAX_BATCH_SIZE, default=list
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=MAX_BATCH_SIZE, default=list
+    )
+
+    def validate(self, data):
+        """Метод валидации пакета без повторов и пересечений."""
+        add, remove = (
+            list(dict.fromkeys(data[key])) for key in ('add', 'remove')
+        )
+        if not set(add).isdisjoint(remove):
+            raise serializers.ValidationError(
+                'Нельзя одновременно добавить и удалить один id.'
+            )
+        return {'add': add, 'remove': remove}
+
+    def check_targets(self, target_ids):
+        """Метод проверки добавляемых id, возвращает {id: ошибки}."""
+        relation = self.relation_serializer(context=self.context)
+        field_name = relation.Meta.model.objects.target_field
+        field = relation.fields[field_name]
+        validate = getattr(relation, f'validate_{field_name}', None)
+        targets = field.get_queryset().only('id').in_bulk(target_ids)
+        errors = {}
+        for target_id in target_ids:
+            try:
+                if target_id not in targets:
+                    field.fail('does_not_exist', pk_value=target_id)
+                if validate is not None:
+                    validate(targets[target_id])
+            except serializers.ValidationError as error:
+                errors[target_id] = {field_name: error.detail}
+        return errors
+
+    def added(self, user, target_ids):
+        """Метод обработки добавленных связей."""
+
+    def removed(self, user, target_ids):
+        """Метод обработки удалённых связей."""
+
+    @transaction.atomic
+    def apply(self, user, add_ids, remove_ids=None):
+        """Метод записи пакета, без remove_ids удаляются все связи."""
+        manager = self.relation_serializer.Meta.model.objects
+        errors = self.check_targets(add_ids)
+        created = manager.add_many(user, [
+            target_id for target_id in add_ids if target_id not in errors
+        ])
+        deleted = manager.remove_many(user, remove_ids)
+        change_counters_many(created, 1)
+        change_counters_many(deleted, -1)
+        attname = f'{manager.target_field}_id'
+        created_ids = [getattr(instance, attname) for instance in created]
+        deleted_ids = [getattr(instance, attname) for instance in deleted]
+        if created_ids:
+            self.added(user, created_ids)
+        if deleted_ids:
+            self.removed(user, deleted_ids)
+        unique_error = self.relation_serializer.get_unique_error().detail
+        results = [
+            {'id': target_id, 'status': status.HTTP_201_CREATED}
+            if target_id in created_ids else
+            {'id': target_id, 'status': status.HTTP_400_BAD_REQUEST,
+             'errors': errors.get(target_id, unique_error)}
+            for target_id in add_ids
+        ]
+        results += [
+            {'id': target_id, 'status': status.HTTP_204_NO_CONTENT}
+            if target_id in deleted_ids else
+            {'id': target_id, 'status': status.HTTP_400_BAD_REQUEST,
+             'errors': self.missing_message}
+            for target_id in (
+                deleted_ids if remove_ids is None else remove_ids
+            )
+        ]
+        return {'results': results}
+
+    def create(self, validated_data):
+        """Метод записи пакета текущего пользователя."""
+        return self.apply(
+            self.context['request'].user,
+            validated_data['add'], validated_data['remove']
+        )
+
+    def to_representation(self, instance):
+        """Метод представления результатов пакета."""
+        return instance
+
+
+class FavoriteBatchSerializer(RelationBatchSerializer):
+    """Сериалайзер пакета Избранного."""
+
+    relation_serializer = FavoriteCreateSerializer
+    missing_message = 'Нет такого рецепта в избранном'
+
+
+class ShoppingCartBatchSerializer(RelationBatchSerializer):
+    """Сериалайзер пакета Списка покупок."""
+
+    relation_serializer = ShoppingCartSerializer
+    missing_message = 'Нет такого рецепта в корзине'
+
+    def added(self, user, target_ids):
+        """Метод добавления ингредиентов рецептов в список покупок."""
+        ShoppingListItem.objects.add_recipes(user, target_ids)
+
+    def removed(self, user, target_ids):
+        """Метод вычитания ингредиентов рецептов из списка покупок."""
+        ShoppingListItem.objects.remove_recipes(user, target_ids)
+
+
+class SubscriptionBatchSerializer(RelationBatchSerializer):
+    """Сериалайзер пакета подписок пользователя."""
+
+    relation_serializer = SubscriptionCreateSerializer
+    missing_message = 'Не существует такой подписки'
+
+    def added(self, user, target_ids):
+        """Метод добавления рецептов авторов в ленту подписчика."""
+        TimelineEntry.objects.add_authors(user.id, target_ids)
+
+    def removed(self, user, target_ids):
+        """Метод удаления рецептов авторов из ленты подписчика."""
+        TimelineEntry.objects.remove_authors(user.id, target_ids)
+        TimelineEntry.objects.add_former_celebrities(target_ids)
+
+
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """Сериалайзер списка подписок пользователя.
+
+    Рецепты всех авторов страницы загружаются одним запросом.
+    """
+
+    def to_representation(self, data):
+        """Метод представления списка подписок."""
+        authors = list(data)
+        latest_recipes = get_latest_recipes(
+            [author.id for author in authors],
+            self.child.get_recipes_limit()
+        )
+        for author in authors:
+            author.latest_recipes = latest_recipes.get(author.id, [])
+        return super().to_representation(authors)
+
+
 class SubscriptionSerializer(UserListSerializer):
     """Сериалайзер подписак пользователя."""
 
@@ -401,25 +734,34 @@ class SubscriptionSerializer(UserListSerializer):
         fields = UserListSerializer.Meta.fields + (
             'recipes', 'recipes_count'
         )
+        list_serializer_class = SubscriptionListSerializer
+
+    def get_recipes_limit(self):
+        """Метод получения ограничения числа рецептов из запроса."""
+        recipes_limit = self.context['request'].query_params.get(
+            'recipes_limit'
+        )
+        if recipes_limit is None:
+            return None
+        try:
+            return int(recipes_limit)
+        except ValueError:
+            raise serializers.ValidationError(
+                f'{recipes_limit} не является числом. '
+                'Введите число рецептов.')
 
     def get_recipes_count(self, obj):
         """Метод подсчёта количесва рецептов."""
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
         """Метод отображения сокращённой информации рецепта."""
-        recipes = obj.recipes.all()
-        if self.context['request'].query_params:
-            if 'recipes_limit' in self.context['request'].query_params:
-                recipes_limit = self.context['request'].query_params.get(
-                    'recipes_limit'
-                )
-                try:
-                    int(recipes_limit)
-                    recipes = recipes[:int(recipes_limit)]
-                except ValueError:
-                    raise serializers.ValidationError(
-                        f'{recipes_limit} не является числом. '
-                        'Введите число рецептов.')
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.get_recipes_limit()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         serializer = RecipeMinifiedSerializer(recipes, many=True)
         return serializer.data
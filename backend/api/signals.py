@@ -0,0 +1,162 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from api.catalog import write_ingredient_catalog
+from api.ingredient_index import ingredient_index
+from foodgram.counters import COUNTERS, change_counters
+from foodgram.models import (Ingredient, IngredientRecipe, Recipe,
+                             RecipeRanking, ShoppingCart, ShoppingListItem,
+                             Subscription, TimelineEntry)
+from foodgram.signals import ingredients_loaded
+
+
+def on_commit_once(func):
+    """Функция вызова func после фиксации транзакции один раз.
+
+    Если func уже ждёт фиксации текущей транзакции, повторно она не
+    ставится. При откате Django очищает ожидающие функции, поэтому
+    следующая транзакция поставит её заново.
+    """
+    connection = transaction.get_connection()
+    if any(callback is func for *_, callback in connection.run_on_commit):
+        return
+    transaction.on_commit(func)
+
+
+def ingredients_committed():
+    """Функция смены версии и записи снимка каталога после фиксации."""
+    ingredient_index.bump_version()
+    write_ingredient_catalog()
+
+
+@receiver(ingredients_loaded)
+def ingredients_bulk_loaded(**kwargs):
+    """Функция смены версии и записи снимка каталога после загрузки."""
+    on_commit_once(ingredients_committed)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    """Функция смены версии каталога при изменении ингредиента.
+
+    Версия меняется сразу для текущего процесса и ещё раз после
+    фиксации транзакции, чтобы другие воркеры не прочитали старые данные.
+    Снимок каталога для nginx пишется после фиксации один раз на
+    транзакцию, сколько бы ингредиентов в ней ни изменилось.
+    """
+    ingredient_index.bump_version()
+    on_commit_once(ingredients_committed)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, raw=False, **kwargs):
+    """Функция создания пустого рейтинга нового рецепта."""
+    if created and not raw:
+        RecipeRanking.objects.create(recipe=instance)
+
+
+def counted_instance_saved(instance, created, raw=False, **kwargs):
+    """Функция увеличения счётчиков при создании связи."""
+    if created and not raw:
+        change_counters(instance, 1)
+
+
+def counted_instance_deleted(instance, **kwargs):
+    """Функция уменьшения счётчиков при удалении связи.
+
+    Вызывается и при каскадном удалении, например рецепта из избранного.
+    """
+    change_counters(instance, -1)
+
+
+# Счётчики подписок меняет обработчик подписок, который затем читает
+# новое число подписчиков автора.
+for counted_model in {model for model, _, _ in COUNTERS} - {Subscription}:
+    post_save.connect(counted_instance_saved, sender=counted_model)
+    post_delete.connect(counted_instance_deleted, sender=counted_model)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_saved(instance, created, raw=False, **kwargs):
+    """Функция добавления рецепта корзины в список покупок."""
+    if created and not raw:
+        ShoppingListItem.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(instance, **kwargs):
+    """Функция вычитания рецепта корзины из списка покупок.
+
+    При каскадном удалении рецепта его ингредиенты и корзины удаляются
+    в любом порядке, и рецепт вычитается один раз: сигналом той связи,
+    которая удалена первой, пока вторая ещё в базе.
+    """
+    ShoppingListItem.objects.remove_recipe(
+        instance.user_id, instance.recipe_id
+    )
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def ingredient_recipe_saving(instance, raw=False, **kwargs):
+    """Функция запоминания прежнего ингредиента рецепта перед изменением."""
+    instance.previous = None
+    if not raw and not instance._state.adding:
+        instance.previous = IngredientRecipe.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def ingredient_recipe_saved(instance, raw=False, **kwargs):
+    """Функция применения изменения ингредиента рецепта к спискам."""
+    if raw:
+        return
+    changes = {(instance.recipe_id, instance.ingredient_id): instance.amount}
+    previous = getattr(instance, 'previous', None)
+    if previous is not None:
+        recipe_id, ingredient_id, amount = previous
+        key = (recipe_id, ingredient_id)
+        changes[key] = changes.get(key, 0) - amount
+    ShoppingListItem.objects.change_ingredients(changes)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def ingredient_recipe_deleted(instance, **kwargs):
+    """Функция вычитания удалённого ингредиента рецепта из списков."""
+    ShoppingListItem.objects.change_ingredients(
+        {(instance.recipe_id, instance.ingredient_id): -instance.amount}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, raw=False, **kwargs):
+    """Функция раскладки нового рецепта в ленты подписчиков."""
+    if created and not raw:
+        TimelineEntry.objects.fan_out(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(instance, created, raw=False, **kwargs):
+    """Функция обновления счётчиков и ленты нового подписчика."""
+    if created and not raw:
+        change_counters(instance, 1)
+        TimelineEntry.objects.add_author(
+            instance.user_id, instance.subscription_id
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(instance, **kwargs):
+    """Функция обновления счётчиков и лент после отписки.
+
+    Счётчик подписчиков уменьшается здесь же, до проверки, не стал ли
+    автор обычным, поэтому порядок обработчиков не важен.
+    """
+    change_counters(instance, -1)
+    TimelineEntry.objects.remove_author(
+        instance.user_id, instance.subscription_id
+    )
+    TimelineEntry.objects.add_former_celebrities([instance.subscription_id])
@@ -0,0 +1,250 @@
+import os
+import shutil
+import tempfile
+import threading
+from itertools import chain
+from time import monotonic, time
+
+import numpy as np
+from django.conf import settings
+
+from foodgram.constants import (RECIPE_MATRIX_CHECK_INTERVAL,
+                                RECIPE_MATRIX_KEEP, SIMILAR_MAX_POSTINGS)
+from foodgram.models import (Ingredient, IngredientRecipe, Recipe, Tag,
+                             TagRecipe)
+
+POINTER_NAME = 'current'
+ARRAYS = (
+    'recipe_ids', 'ingredient_ids', 'tag_ids', 'row_indptr', 'row_indices',
+    'col_indptr', 'col_indices',
+)
+
+
+def get_matrix_directory():
+    """Функция получения папки файлов матрицы рецептов."""
+    return getattr(settings, 'RECIPE_MATRIX_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'foodgram_recipe_matrix'
+    )
+
+
+def read_pairs(queryset, field):
+    """Функция чтения пар (рецепт, признак) в массив numpy."""
+    pairs = np.fromiter(
+        chain.from_iterable(
+            queryset.values_list('recipe_id', field).order_by().iterator()
+        ),
+        dtype=np.int64
+    )
+    return pairs.reshape(-1, 2)
+
+
+def compress(major, minor, size):
+    """Функция построения сжатого разреженного формата (indptr, indices).
+
+    Это тот же формат, что у scipy.sparse csr_matrix/csc_matrix.
+    """
+    order = np.lexsort((minor, major))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(major, minlength=size), out=indptr[1:])
+    return indptr, minor[order].astype(np.int32)
+
+
+def build_recipe_matrix():
+    """Функция построения разреженной матрицы рецепт × признак.
+
+    Признаки это ингредиенты и тэги рецепта. Матрица хранится в двух
+    видах: по строкам для признаков рецепта и по столбцам как обратный
+    индекс признак → рецепты. Массивы пишутся в .npy в новую папку,
+    затем файл current атомарно переключается на неё.
+    """
+    recipe_ids = np.array(
+        Recipe.objects.order_by('id').values_list('id', flat=True),
+        dtype=np.int64
+    )
+    ingredient_ids = np.array(
+        Ingredient.objects.order_by('id').values_list('id', flat=True),
+        dtype=np.int64
+    )
+    tag_ids = np.array(
+        Tag.objects.order_by('id').values_list('id', flat=True),
+        dtype=np.int64
+    )
+    ingredient_pairs = read_pairs(IngredientRecipe.objects, 'ingredient_id')
+    tag_pairs = read_pairs(TagRecipe.objects, 'tag_id')
+    rows = np.searchsorted(
+        recipe_ids, np.concatenate((ingredient_pairs[:, 0], tag_pairs[:, 0]))
+    )
+    cols = np.concatenate((
+        np.searchsorted(ingredient_ids, ingredient_pairs[:, 1]),
+        len(ingredient_ids) + np.searchsorted(tag_ids, tag_pairs[:, 1]),
+    ))
+    features_count = len(ingredient_ids) + len(tag_ids)
+    pairs = np.unique(rows * features_count + cols)
+    rows, cols = pairs // features_count, pairs % features_count
+    row_indptr, row_indices = compress(rows, cols, len(recipe_ids))
+    col_indptr, col_indices = compress(cols, rows, features_count)
+    arrays = {
+        'recipe_ids': recipe_ids,
+        'ingredient_ids': ingredient_ids,
+        'tag_ids': tag_ids,
+        'row_indptr': row_indptr,
+        'row_indices': row_indices,
+        'col_indptr': col_indptr,
+        'col_indices': col_indices,
+    }
+    directory = get_matrix_directory()
+    os.makedirs(directory, exist_ok=True)
+    name = f'matrix-{time():.6f}'
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(path, f'{array_name}.npy'), array)
+    with tempfile.NamedTemporaryFile(
+        'w', dir=directory, delete=False, suffix='.tmp'
+    ) as file:
+        file.write(name)
+    os.replace(file.name, os.path.join(directory, POINTER_NAME))
+    builds = sorted(
+        entry.name for entry in os.scandir(directory)
+        if entry.is_dir() and entry.name.startswith('matrix-')
+    )
+    for old_name in builds[:-RECIPE_MATRIX_KEEP]:
+        shutil.rmtree(os.path.join(directory, old_name), ignore_errors=True)
+    return len(recipe_ids), len(pairs)
+
+
+class RecipeMatrix:
+    """Матрица рецептов процесса, отображённая в память с диска.
+
+    Файлы открываются через mmap, поэтому воркеры gunicorn делят одни
+    страницы памяти. Новая сборка подхватывается, когда меняется
+    файл current.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrays = None
+        self.version = None
+        self.checked = None
+
+    def read_version(self):
+        """Метод чтения имени текущей сборки матрицы."""
+        try:
+            with open(
+                os.path.join(get_matrix_directory(), POINTER_NAME),
+                encoding='utf-8'
+            ) as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def refresh(self):
+        """Метод загрузки новой сборки матрицы, если она появилась."""
+        now = monotonic()
+        if (
+            self.checked is not None
+            and now - self.checked < RECIPE_MATRIX_CHECK_INTERVAL
+        ):
+            return self.arrays
+        version = self.read_version()
+        with self.lock:
+            if version != self.version:
+                path = os.path.join(get_matrix_directory(), version or '')
+                try:
+                    self.arrays = version and {
+                        name: np.load(
+                            os.path.join(path, f'{name}.npy'), mmap_mode='r'
+                        )
+                        for name in ARRAYS
+                    }
+                except OSError:
+                    self.arrays = None
+                self.version = version
+            self.checked = now
+        return self.arrays
+
+    def get_features(self, recipe):
+        """Метод получения признаков рецепта: из матрицы или из базы.
+
+        Возвращает столбцы известных матрице признаков и общее число
+        признаков рецепта.
+        """
+        arrays = self.arrays
+        row = np.searchsorted(arrays['recipe_ids'], recipe.id)
+        if (
+            row < len(arrays['recipe_ids'])
+            and arrays['recipe_ids'][row] == recipe.id
+        ):
+            features = arrays['row_indices'][
+                arrays['row_indptr'][row]:arrays['row_indptr'][row + 1]
+            ]
+            return features, len(features)
+        ingredient_ids = np.array(
+            recipe.ingredient_recipe.values_list('ingredient_id', flat=True),
+            dtype=np.int64
+        )
+        tag_ids = np.array(
+            recipe.tags.values_list('id', flat=True), dtype=np.int64
+        )
+        features = []
+        for offset, known, ids in (
+            (0, arrays['ingredient_ids'], ingredient_ids),
+            (len(arrays['ingredient_ids']), arrays['tag_ids'], tag_ids),
+        ):
+            columns = np.searchsorted(known, ids)
+            found = columns < len(known)
+            found[found] = known[columns[found]] == ids[found]
+            features.append(offset + columns[found])
+        return np.concatenate(features), len(ingredient_ids) + len(tag_ids)
+
+    def similar(self, recipe, limit):
+        """Метод поиска id рецептов, похожих по коэффициенту Жаккара.
+
+        Кандидаты берутся из столбцов ингредиентов рецепта, начиная с
+        самых редких, пока в них не больше SIMILAR_MAX_POSTINGS записей:
+        частые ингредиенты вроде соли и тэги кандидатов не дают. Общие
+        признаки кандидатов считаются по их строкам, поэтому число
+        кандидатов и время поиска ограничены и не растут с каталогом.
+        """
+        if self.refresh() is None:
+            return []
+        arrays = self.arrays
+        features, size = self.get_features(recipe)
+        col_indptr = arrays['col_indptr']
+        columns = features[features < len(arrays['ingredient_ids'])]
+        if not len(columns):
+            return []
+        postings = col_indptr[columns + 1] - col_indptr[columns]
+        order = np.argsort(postings, kind='stable')
+        columns = columns[order][:max(1, np.searchsorted(
+            np.cumsum(postings[order]), SIMILAR_MAX_POSTINGS, side='right'
+        ))]
+        rows = np.unique(np.concatenate([
+            arrays['col_indices'][col_indptr[column]:min(
+                col_indptr[column + 1],
+                col_indptr[column] + SIMILAR_MAX_POSTINGS
+            )]
+            for column in columns
+        ]))
+        recipe_ids = arrays['recipe_ids'][rows]
+        rows, recipe_ids = (
+            rows[recipe_ids != recipe.id], recipe_ids[recipe_ids != recipe.id]
+        )
+        if not len(rows):
+            return []
+        row_indptr = arrays['row_indptr']
+        starts = row_indptr[rows]
+        sizes = row_indptr[rows + 1] - starts
+        offsets = np.cumsum(sizes) - sizes
+        positions = np.arange(sizes.sum()) + np.repeat(
+            starts - offsets, sizes
+        )
+        overlap = np.add.reduceat(
+            np.isin(arrays['row_indices'][positions], features), offsets
+        )
+        scores = overlap / (size + sizes - overlap)
+        order = np.lexsort((recipe_ids, -scores))[:limit]
+        return [int(recipe_id) for recipe_id in recipe_ids[order]]
+
+
+recipe_matrix = RecipeMatrix()
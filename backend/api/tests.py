@@ -1,6 +1,62 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import addModuleCleanup, mock, skipUnless
 
-from django.test import Client, TestCase
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.authtoken.models import Token
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from api.catalog import write_ingredient_catalog
+from api.events import EVENTS_PATH, Subscriber, broker
+from api.ingredient_index import ingredient_index
+from api.metrics import metrics
+from api.middleware import QueryBudgetExceeded
+from api.signals import ingredients_committed
+from api.similar import recipe_matrix
+from api.views import (IngredientViewSet, ProfileViewSet, RecipeViewSet,
+                       TagViewSet)
+from foodgram.constants import EVENTS_QUEUE_SIZE
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Profile,
+                             Recipe, RecipeIngredientIndex, RecipeRanking,
+                             ShoppingCart, ShoppingListItem, Subscription, Tag,
+                             TagRecipe, TimelineEntry)
+from foodgram_backend.asgi import application
+
+
+def setUpModule():
+    """Медиа тестов, в том числе файл версии ингредиентов, во временной
+    папке."""
+    media = tempfile.TemporaryDirectory()
+    addModuleCleanup(media.cleanup)
+    settings = override_settings(MEDIA_ROOT=media.name)
+    settings.enable()
+    addModuleCleanup(settings.disable)
+
+
+def get_base64_image():
+    image = BytesIO()
+    PILImage.new('RGB', (1, 1)).save(image, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        image.getvalue()
+    ).decode()
 
 
 class RecipesAPITestCase(TestCase):
@@ -11,3 +67,1870 @@ class RecipesAPITestCase(TestCase):
         """Проверка доступности списка рецептов."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class FoodgramAPITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Profile.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(5)
+        ]
+        cls.authors = [
+            Profile.objects.create_user(
+                username=f'author{index}',
+                email=f'author{index}@example.com',
+                password='pass'
+            )
+            for index in range(4)
+        ]
+        Subscription.objects.create(user=cls.user, subscription=cls.authors[0])
+        for index in range(20):
+            cls.create_recipe(cls.authors[index % len(cls.authors)], index)
+
+    @classmethod
+    def create_recipe(cls, author, index):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f'Рецепт {index}',
+            text='Описание',
+            cooking_time=10,
+            image='recipes/images/test.png',
+        )
+        recipe.tags.set(cls.tags[:2])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in cls.ingredients[:3]
+        )
+        return recipe
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+
+class RecipesQueriesTestCase(FoodgramAPITestCase):
+    def test_recipes_list_queries_do_not_depend_on_page_size(self):
+        """Число запросов списка рецептов не зависит от размера страницы."""
+        clients_queries = (
+            (self.guest_client, 5),
+            (self.authorized_client, 6),
+        )
+        for client, queries in clients_queries:
+            for limit in (2, 20):
+                with self.subTest(queries=queries, limit=limit):
+                    with self.assertNumQueries(queries):
+                        response = client.get(f'/api/recipes/?limit={limit}')
+                    self.assertEqual(response.status_code, HTTPStatus.OK)
+                    self.assertEqual(len(response.json()['results']), limit)
+
+    def test_recipe_detail_queries(self):
+        """Число запросов страницы рецепта постоянно."""
+        recipe = Recipe.objects.first()
+        with self.assertNumQueries(5):
+            response = self.authorized_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_recipe_author_is_subscribed(self):
+        """Флаг подписки на автора рецепта вычисляется аннотацией."""
+        response = self.authorized_client.get('/api/recipes/?limit=20')
+        for recipe in response.json()['results']:
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] == self.authors[0].id
+            )
+
+    def test_recipes_cursor_pagination(self):
+        """Лента по курсору проходит все рецепты без повторов."""
+        author = self.authors[1]
+        expected = list(
+            Recipe.objects.filter(author=author)
+            .order_by('-created', '-id').values_list('id', flat=True)
+        )
+        url = f'/api/recipes/?cursor=&limit=2&author={author.id}'
+        received = []
+        while url:
+            response = self.authorized_client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('count', response.json())
+            received += [recipe['id'] for recipe in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(received, expected)
+
+        previous = self.authorized_client.get(
+            response.json()['previous']
+        ).json()
+        self.assertEqual(
+            [recipe['id'] for recipe in previous['results']], expected[-3:-1]
+        )
+
+    def test_recipes_invalid_cursor(self):
+        """Неверный курсор возвращает 404."""
+        response = self.guest_client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_recipes_cursor_with_ordering(self):
+        """Курсор с другой сортировкой отклоняется, а не теряет её."""
+        for query in ('search=Рецепт', 'ingredients=1', 'ordering=popular'):
+            with self.subTest(query=query):
+                response = self.guest_client.get(
+                    f'/api/recipes/?cursor=&{query}'
+                )
+                self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+                self.assertIn('cursor', response.json())
+
+
+class RecipeSearchTestCase(FoodgramAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.borscht = cls.create_recipe(cls.authors[0], 'борщ')
+        cls.borscht.text = 'Суп со свеклой'
+        cls.borscht.save()
+        cls.soup = cls.create_recipe(cls.authors[1], 'суп')
+        cls.soup.text = 'Почти как борщ, но без свеклы'
+        cls.soup.save()
+
+    def search(self, query):
+        response = self.authorized_client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_search_ranks_name_matches_first(self):
+        """Совпадения в названии выше совпадений в описании."""
+        self.assertEqual(
+            self.search('search=борщ'), [self.borscht.id, self.soup.id]
+        )
+        self.assertEqual(self.search('search=свекл борщ'), [
+            self.borscht.id, self.soup.id
+        ])
+        self.assertEqual(self.search('search=нетакого'), [])
+
+    def test_search_composes_with_filters(self):
+        """Поиск сочетается с фильтрами и пагинацией."""
+        self.assertEqual(
+            self.search(f'search=борщ&author={self.authors[1].id}'),
+            [self.soup.id]
+        )
+        response = self.authorized_client.get(
+            '/api/recipes/?search=Описание&limit=5'
+        )
+        self.assertEqual(response.json()['count'], 20)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    @override_settings(SEARCH_POPULARITY_WEIGHT=1.0)
+    def test_search_popularity_weight(self):
+        """Популярность поднимает рецепт при равной релевантности."""
+        self.assertEqual(
+            self.search('search=свекл'), [self.soup.id, self.borscht.id]
+        )
+        Favorite.objects.create(user=self.user, recipe=self.borscht)
+        self.assertEqual(
+            self.search('search=свекл'), [self.borscht.id, self.soup.id]
+        )
+
+
+class PantrySearchTestCase(FoodgramAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.pantry_recipes = []
+        for index, ingredients in enumerate((
+            cls.ingredients[3:5],
+            cls.ingredients[2:5],
+            cls.ingredients[1:5],
+        )):
+            recipe = cls.create_recipe(cls.authors[0], f'кладовая {index}')
+            recipe.ingredient_recipe.all().delete()
+            for ingredient in ingredients:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+            cls.pantry_recipes.append(recipe)
+
+    def pantry_search(self, query):
+        response = self.authorized_client.get(
+            f'/api/recipes/?limit=50&{query}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_pantry_search_ranked_by_coverage(self):
+        """Рецепты сортируются по доле имеющихся ингредиентов."""
+        pantry = ','.join(
+            str(ingredient.id) for ingredient in self.ingredients[3:5]
+        )
+        first, second, third = self.pantry_recipes
+        self.assertEqual(
+            self.pantry_search(f'ingredients={pantry}'),
+            [first.id, second.id, third.id]
+        )
+        self.assertEqual(
+            self.pantry_search(f'ingredients={pantry}&min_match=0.6'),
+            [first.id, second.id]
+        )
+        self.assertEqual(
+            self.pantry_search(
+                f'ingredients={pantry}'
+                f'&exclude_ingredients={self.ingredients[2].id}'
+            ),
+            [first.id]
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL')
+    def test_index_follows_moved_ingredient(self):
+        """Перенос строки в другой рецепт обновляет индекс обоих."""
+        first = self.pantry_recipes[0]
+        target = self.create_recipe(self.authors[0], 'перенос')
+        target.ingredient_recipe.all().delete()
+        IngredientRecipe.objects.filter(
+            recipe=first, ingredient=self.ingredients[3]
+        ).update(recipe=target)
+        self.assertEqual(
+            RecipeIngredientIndex.objects.get(recipe=first).ingredient_ids,
+            [self.ingredients[4].id]
+        )
+        self.assertEqual(
+            RecipeIngredientIndex.objects.get(recipe=target).ingredient_ids,
+            [self.ingredients[3].id]
+        )
+
+    def test_pantry_search_invalid_params(self):
+        """Неверные параметры поиска по продуктам дают 400."""
+        for query in ('ingredients=a', 'min_match=2'):
+            with self.subTest(query=query):
+                response = self.authorized_client.get(
+                    f'/api/recipes/?{query}'
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST
+                )
+
+
+class SimilarRecipesTestCase(FoodgramAPITestCase):
+    @classmethod
+    def create_similar_recipe(cls, index, ingredients):
+        recipe = cls.create_recipe(cls.authors[1], f'похожий {index}')
+        recipe.ingredient_recipe.all().delete()
+        for ingredient in ingredients:
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+        recipe.tags.set(cls.tags[2:])
+        return recipe
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(RECIPE_MATRIX_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        recipe_matrix.checked = None
+
+    def similar(self, recipe, limit=3):
+        response = self.guest_client.get(
+            f'/api/recipes/{recipe.id}/similar/?limit={limit}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [item['id'] for item in response.json()]
+
+    def test_similar_recipes(self):
+        """Похожие рецепты сортируются по коэффициенту Жаккара.
+
+        Рецепты только с частыми ингредиентами в кандидаты не попадают,
+        когда редких хватает на SIMILAR_MAX_POSTINGS.
+        """
+        first = self.create_similar_recipe(0, self.ingredients[2:5])
+        second = self.create_similar_recipe(1, self.ingredients[3:5])
+        self.assertEqual(self.similar(first), [])
+        call_command('build_recipe_matrix', stdout=StringIO())
+        recipe_matrix.checked = None
+        base_recipes = list(
+            Recipe.objects.exclude(id__in=(first.id, second.id))
+            .order_by('id').values_list('id', flat=True)
+        )
+        self.assertEqual(
+            self.similar(first), [second.id, *base_recipes[:2]]
+        )
+        with mock.patch('api.similar.SIMILAR_MAX_POSTINGS', 4):
+            self.assertEqual(self.similar(first), [second.id])
+            self.assertEqual(self.similar(second), [first.id])
+
+    def test_new_and_deleted_recipes(self):
+        """Новый рецепт ищется по базе, удалённые пропускаются."""
+        first = self.create_similar_recipe(0, self.ingredients[2:5])
+        second = self.create_similar_recipe(1, self.ingredients[3:5])
+        call_command('build_recipe_matrix', stdout=StringIO())
+        recipe_matrix.checked = None
+        new = self.create_similar_recipe(2, self.ingredients[3:5])
+        self.assertEqual(self.similar(new), [second.id, first.id])
+        second.delete()
+        self.assertEqual(self.similar(new), [first.id])
+
+
+class RecipeRankingTestCase(FoodgramAPITestCase):
+    def test_popular_and_trending_ordering(self):
+        """Старые добавления влияют на популярность, но не на тренд."""
+        old_recipe, new_recipe, cart_recipe = Recipe.objects.order_by('id')[:3]
+        for author in self.authors:
+            Favorite.objects.create(user=author, recipe=old_recipe)
+        Favorite.objects.filter(recipe=old_recipe).update(
+            created=timezone.now() - timedelta(days=30)
+        )
+        Favorite.objects.create(user=self.user, recipe=new_recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=cart_recipe)
+        call_command('rank_recipes', stdout=StringIO())
+        scores = dict(
+            (recipe_id, (round(popular, 3), round(trending, 3)))
+            for recipe_id, popular, trending
+            in RecipeRanking.objects.values_list(
+                'recipe_id', 'popular_score', 'trending_score'
+            )
+        )
+        self.assertEqual(scores[old_recipe.id], (len(self.authors), 0))
+        self.assertEqual(scores[new_recipe.id], (1, 1))
+        self.assertEqual(scores[cart_recipe.id], (0.5, 0.5))
+        for ordering, expected in (
+            ('popular', [old_recipe.id, new_recipe.id, cart_recipe.id]),
+            ('trending', [new_recipe.id, cart_recipe.id]),
+        ):
+            with self.subTest(ordering=ordering):
+                response = self.guest_client.get(
+                    f'/api/recipes/?ordering={ordering}&limit=3'
+                )
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.json()['results']][
+                        :len(expected)
+                    ],
+                    expected
+                )
+        self.assertEqual(
+            self.guest_client.get('/api/recipes/?ordering=name').status_code,
+            HTTPStatus.BAD_REQUEST
+        )
+
+    def test_new_recipe_has_ranking(self):
+        """У нового рецепта сразу есть нулевой рейтинг."""
+        recipe = self.create_recipe(self.user, 'новый')
+        self.assertEqual(recipe.ranking.popular_score, 0)
+        self.assertEqual(
+            RecipeRanking.objects.count(), Recipe.objects.count()
+        )
+
+
+class CountersTestCase(FoodgramAPITestCase):
+    def test_counters_follow_relations(self):
+        """Счётчики меняются вместе со связями, в том числе каскадно."""
+        recipe = Recipe.objects.exclude(author=self.authors[0]).first()
+        author = recipe.author
+        recipes_count = author.recipes.count()
+        self.authorized_client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.authorized_client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/'
+        )
+        self.authorized_client.post(f'/api/users/{author.id}/subscribe/')
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count), (1, 1)
+        )
+        self.assertEqual(
+            (author.recipes_count, author.followers_count),
+            (recipes_count, 1)
+        )
+        self.assertEqual(
+            (self.user.favorites_count, self.user.following_count), (1, 2)
+        )
+        response = self.authorized_client.get('/api/users/subscriptions/')
+        self.assertIn(
+            (author.id, recipes_count),
+            [(subscription['id'], subscription['recipes_count'])
+             for subscription in response.json()['results']]
+        )
+        recipe.delete()
+        author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(author.recipes_count, recipes_count - 1)
+        self.assertEqual(self.user.favorites_count, 0)
+
+    def test_recount_counters(self):
+        """Команда находит и исправляет неверные счётчики."""
+        recipe = Recipe.objects.first()
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Recipe.objects.filter(id=recipe.id).update(favorites_count=5)
+        Profile.objects.update(recipes_count=0)
+        with self.assertRaises(CommandError):
+            call_command('recount_counters', verify=True, stdout=StringIO())
+        call_command('recount_counters', stdout=StringIO())
+        call_command('recount_counters', verify=True, stdout=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(
+            Profile.objects.get(id=recipe.author_id).recipes_count,
+            recipe.author.recipes.count()
+        )
+
+
+class RecipeToggleTestCase(FoodgramAPITestCase):
+    def test_repeated_toggles(self):
+        """Повторные добавление и удаление дают 400, а не ошибку базы."""
+        recipe = Recipe.objects.first()
+        for url, model, missing in (
+            (f'/api/recipes/{recipe.id}/favorite/', Favorite,
+             'Нет такого рецепта в избранном'),
+            (f'/api/recipes/{recipe.id}/shopping_cart/', ShoppingCart,
+             'Нет такого рецепта в корзине'),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.authorized_client.post(url).status_code,
+                    HTTPStatus.CREATED
+                )
+                with CaptureQueriesContext(connection) as context:
+                    response = self.authorized_client.post(url)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST
+                )
+                self.assertEqual(response.json(), {'non_field_errors': [
+                    'Поля user, recipe должны производить массив с '
+                    'уникальными значениями.'
+                ]})
+                table = model._meta.db_table
+                self.assertEqual(
+                    [query['sql'].split()[0]
+                     for query in context.captured_queries
+                     if f'"{table}"' in query['sql']],
+                    ['INSERT']
+                )
+                self.assertEqual(
+                    self.authorized_client.delete(url).status_code,
+                    HTTPStatus.NO_CONTENT
+                )
+                response = self.authorized_client.delete(url)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST
+                )
+                self.assertEqual(response.json(), missing)
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count), (0, 0)
+        )
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.user))
+        self.assertEqual(
+            self.authorized_client.delete(
+                '/api/recipes/0/favorite/'
+            ).status_code,
+            HTTPStatus.NOT_FOUND
+        )
+
+
+class BatchTestCase(FoodgramAPITestCase):
+    def batch(self, url, data, method='post'):
+        response = getattr(self.authorized_client, method)(
+            url, data, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return {
+            result['id']: result['status']
+            for result in response.json()['results']
+        }
+
+    def test_batch_matches_single_requests(self):
+        """Пакет даёт те же связи, счётчики и список покупок."""
+        recipes = list(Recipe.objects.exclude(author=self.user)[:6])
+        ids = [recipe.id for recipe in recipes]
+        for recipe in recipes[:2]:
+            self.authorized_client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(
+            self.batch('/api/recipes/favorite/batch/', {
+                'add': ids[1:4] + [999999], 'remove': ids[:1] + ids[5:]
+            }),
+            {ids[1]: HTTPStatus.BAD_REQUEST, ids[2]: HTTPStatus.CREATED,
+             ids[3]: HTTPStatus.CREATED, 999999: HTTPStatus.BAD_REQUEST,
+             ids[0]: HTTPStatus.NO_CONTENT, ids[5]: HTTPStatus.BAD_REQUEST}
+        )
+        self.assertEqual(
+            set(self.user.favorite.values_list('recipe_id', flat=True)),
+            set(ids[1:4])
+        )
+        self.batch('/api/recipes/shopping_cart/batch/', {'add': ids})
+        self.authorized_client.delete(
+            f'/api/recipes/{ids[0]}/shopping_cart/'
+        )
+        expected = list(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount').order_by('ingredient_id'))
+        ShoppingListItem.objects.filter(user=self.user).delete()
+        ShoppingCart.objects.filter(user=self.user).delete()
+        for recipe_id in ids[1:]:
+            self.authorized_client.post(
+                f'/api/recipes/{recipe_id}/shopping_cart/'
+            )
+        self.assertEqual(list(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount').order_by('ingredient_id')),
+            expected)
+        self.assertEqual(
+            self.batch('/api/recipes/shopping_cart/clear/', {}, 'delete'),
+            dict.fromkeys(ids[1:], HTTPStatus.NO_CONTENT)
+        )
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.user))
+        call_command('recount_counters', verify=True, stdout=StringIO())
+
+    def test_batch_subscriptions(self):
+        """Пакет подписок проверяет каждого автора и обновляет ленту."""
+        author_ids = [author.id for author in self.authors]
+        self.assertEqual(
+            self.batch('/api/users/subscribe/batch/', {
+                'add': author_ids + [self.user.id]
+            }),
+            {author_ids[0]: HTTPStatus.BAD_REQUEST,
+             **dict.fromkeys(author_ids[1:], HTTPStatus.CREATED),
+             self.user.id: HTTPStatus.BAD_REQUEST}
+        )
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, recipe__author_id=author_ids[1]
+        ).exists())
+        self.assertEqual(
+            self.batch('/api/users/subscribe/batch/', {
+                'remove': author_ids[1:]
+            }),
+            dict.fromkeys(author_ids[1:], HTTPStatus.NO_CONTENT)
+        )
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.user, recipe__author_id=author_ids[1]
+        ).exists())
+        call_command('recount_counters', verify=True, stdout=StringIO())
+        response = self.authorized_client.post(
+            '/api/users/subscribe/batch/',
+            {'add': author_ids, 'remove': author_ids[:1]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeTransferTestCase(FoodgramAPITestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(media.name, 'recipes', 'images'))
+        PILImage.new('RGB', (1, 1)).save(
+            os.path.join(media.name, 'recipes', 'images', 'test.png')
+        )
+
+    def export(self, directory):
+        call_command('export_recipes', directory, stdout=StringIO())
+        with open(
+            os.path.join(directory, 'recipes.jsonl'), encoding='utf-8'
+        ) as file:
+            return [json.loads(line) for line in file]
+
+    def without_images(self, records):
+        return [
+            {key: value for key, value in record.items() if key != 'image'}
+            for record in records
+        ]
+
+    def test_export_import_round_trip(self):
+        """Выгруженные рецепты загружаются обратно без потерь."""
+        with tempfile.TemporaryDirectory() as directory:
+            records = self.export(directory)
+            self.assertEqual(len(records), Recipe.objects.count())
+            self.assertEqual(
+                os.listdir(os.path.join(directory, 'images')), ['test.png']
+            )
+            Recipe.objects.all().delete()
+            call_command(
+                'import_recipes', directory, batch_size=7, workers=1,
+                stdout=StringIO(), stderr=StringIO()
+            )
+            self.assertFalse(os.path.exists(
+                os.path.join(directory, 'recipes.jsonl.checkpoint')
+            ))
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(
+                self.without_images(self.export(directory)),
+                self.without_images(records)
+            )
+        self.assertEqual(
+            RecipeRanking.objects.count(), Recipe.objects.count()
+        )
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.user
+            ).values_list('recipe_id', flat=True)),
+            set(self.authors[0].recipes.values_list('id', flat=True))
+        )
+        call_command('recount_counters', verify=True, stdout=StringIO())
+
+    def test_import_resumes_after_checkpoint(self):
+        """Загрузка продолжается после сохранённой строки и сообщает
+        об ошибках, не прерываясь."""
+        with tempfile.TemporaryDirectory() as directory:
+            records = self.export(directory)[:4]
+            records[3]['ingredients'][0]['name'] = 'Неизвестный'
+            with open(
+                os.path.join(directory, 'recipes.jsonl'), 'w',
+                encoding='utf-8'
+            ) as file:
+                file.writelines(
+                    [json.dumps(record) + '\n' for record in records]
+                    + ['{oops\n']
+                )
+            with open(os.path.join(
+                directory, 'recipes.jsonl.checkpoint'
+            ), 'w') as file:
+                file.write('2')
+            stderr = StringIO()
+            with CaptureQueriesContext(connection) as context:
+                call_command(
+                    'import_recipes', directory, workers=0,
+                    stdout=StringIO(), stderr=stderr
+                )
+        self.assertEqual(Recipe.objects.count(), 21)
+        self.assertIn('Строка 4: Не найдены: ингредиент Неизвестный.',
+                      stderr.getvalue())
+        self.assertIn('Строка 5: Некорректный JSON', stderr.getvalue())
+        self.assertEqual(
+            len([query for query in context.captured_queries
+                 if query['sql'].startswith(
+                     'INSERT INTO "foodgram_ingredientrecipe"'
+                 )]),
+            1
+        )
+
+    def test_endpoints_are_admin_only_and_stream(self):
+        """Выгрузка и загрузка через API доступны только администратору."""
+        self.assertEqual(
+            self.authorized_client.get('/api/recipes/export/').status_code,
+            HTTPStatus.FORBIDDEN
+        )
+        Profile.objects.filter(id=self.user.id).update(is_staff=True)
+        response = self.authorized_client.get('/api/recipes/export/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), Recipe.objects.count())
+        record = json.loads(lines[0])
+        self.assertEqual(
+            record['image_url'],
+            'http://testserver/media/recipes/images/test.png'
+        )
+        image = BytesIO()
+        PILImage.new('RGB', (2, 2)).save(image, 'PNG')
+        image.seek(0)
+        image.name = 'test.png'
+        recipes = BytesIO(
+            (lines[0] + '\n' + lines[1].replace(
+                'images/test.png', 'images/missing.png'
+            ) + '\n').encode()
+        )
+        recipes.name = 'recipes.jsonl'
+        response = self.authorized_client.post(
+            '/api/recipes/import/?start=0',
+            {'recipes': recipes, 'images': [image]}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        progress = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(progress['line'], 2)
+        self.assertEqual(progress['created'], 1)
+        self.assertEqual(
+            progress['errors'],
+            [{'line': 2, 'error': 'Нет файла изображения images/missing.png.'}]
+        )
+
+    def test_endpoint_rejects_large_upload(self):
+        """Большие загрузки через API отклоняются."""
+        Profile.objects.filter(id=self.user.id).update(is_staff=True)
+        recipes = BytesIO(b'{}\n' * 3)
+        recipes.name = 'recipes.jsonl'
+        with mock.patch('api.views.TRANSFER_UPLOAD_MAX_RECORDS', 2):
+            response = self.authorized_client.post(
+                '/api/recipes/import/', {'recipes': recipes}
+            )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(Recipe.objects.count(), 20)
+
+
+class FeedTestCase(FoodgramAPITestCase):
+    def feed(self, url='/api/recipes/feed/?limit=3'):
+        received = []
+        while url:
+            response = self.authorized_client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            received += [recipe['id'] for recipe in response.json()['results']]
+            url = response.json()['next']
+        return received
+
+    def expected(self):
+        return list(Recipe.objects.filter(
+            author__subscription__user=self.user
+        ).order_by('-created', '-id').values_list('id', flat=True))
+
+    def test_feed_follows_subscriptions(self):
+        """Лента пополняется при публикации, подписке и отписке."""
+        self.assertEqual(self.feed(), self.expected())
+        self.authorized_client.post(
+            f'/api/users/{self.authors[1].id}/subscribe/'
+        )
+        recipe = self.create_recipe(self.authors[1], 'новый')
+        self.create_recipe(self.authors[2], 'чужой')
+        self.assertEqual(self.feed()[0], recipe.id)
+        self.assertEqual(self.feed(), self.expected())
+        self.authorized_client.delete(
+            f'/api/users/{self.authors[1].id}/subscribe/'
+        )
+        self.assertEqual(self.feed(), self.expected())
+        self.assertEqual(
+            self.guest_client.get('/api/recipes/feed/').status_code,
+            HTTPStatus.UNAUTHORIZED
+        )
+
+    def test_feed_merges_celebrity_authors(self):
+        """Рецепты популярных авторов подмешиваются при чтении ленты."""
+        Subscription.objects.create(
+            user=self.user, subscription=self.authors[1]
+        )
+        with mock.patch('foodgram.models.FEED_FANOUT_MAX_FOLLOWERS', 0), \
+                mock.patch('api.paginators.FEED_FANOUT_MAX_FOLLOWERS', 0):
+            recipe = self.create_recipe(self.authors[1], 'популярный')
+            self.assertFalse(recipe.timeline_entries.exists())
+            self.assertEqual(self.feed(), self.expected())
+            with self.assertNumQueries(7):
+                self.authorized_client.get('/api/recipes/feed/?limit=20')
+
+    def test_feed_uses_followers_counter(self):
+        """Раскладка и чтение ленты решают о популярности по счётчику."""
+        for user in (self.user, *self.authors[2:]):
+            Subscription.objects.create(
+                user=user, subscription=self.authors[1]
+            )
+        Profile.objects.filter(pk=self.authors[1].pk).update(followers_count=1)
+        with mock.patch('foodgram.models.FEED_FANOUT_MAX_FOLLOWERS', 1), \
+                mock.patch('api.paginators.FEED_FANOUT_MAX_FOLLOWERS', 1):
+            recipe = self.create_recipe(self.authors[1], 'по счётчику')
+            self.assertTrue(
+                recipe.timeline_entries.filter(user=self.user).exists()
+            )
+            self.assertEqual(self.feed(), self.expected())
+
+    def test_feed_backfills_former_celebrity(self):
+        """Рецепты бывшего популярного автора раскладываются в ленты."""
+        for author in self.authors[2:]:
+            Subscription.objects.create(
+                user=author, subscription=self.authors[1]
+            )
+        self.authorized_client.post(
+            f'/api/users/{self.authors[1].id}/subscribe/'
+        )
+        with mock.patch('foodgram.models.FEED_FANOUT_MAX_FOLLOWERS', 1), \
+                mock.patch('api.paginators.FEED_FANOUT_MAX_FOLLOWERS', 1):
+            recipe = self.create_recipe(self.authors[1], 'популярный')
+            self.assertFalse(recipe.timeline_entries.exists())
+            clients = [
+                Client(HTTP_AUTHORIZATION=(
+                    f'Token {Token.objects.create(user=author).key}'
+                ))
+                for author in self.authors[2:]
+            ]
+            response = clients[0].delete(
+                f'/api/users/{self.authors[1].id}/subscribe/'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+            self.assertFalse(recipe.timeline_entries.exists())
+            response = clients[1].post(
+                '/api/users/subscribe/batch/',
+                data={'remove': [self.authors[1].id]},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertTrue(
+                recipe.timeline_entries.filter(user=self.user).exists()
+            )
+            self.assertEqual(self.feed(), self.expected())
+
+
+class RecipeUpdateTestCase(FoodgramAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(self.user, 'свой')
+
+    def patch(self, ingredients, tags):
+        return self.authorized_client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            data={
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+                'tags': [tag.id for tag in tags],
+                'name': 'Рецепт свой',
+                'text': 'Описание',
+                'cooking_time': 10,
+            },
+            content_type='application/json'
+        )
+
+    def test_update_writes_only_changed_rows(self):
+        """Изменение одного ингредиента пишет одну строку."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.patch(
+                [(self.ingredients[0], 25), (self.ingredients[1], 10),
+                 (self.ingredients[2], 10)],
+                self.tags[:2]
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        writes = [
+            query['sql'].split()[0] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and ('foodgram_ingredientrecipe' in query['sql']
+                 or 'foodgram_tagrecipe' in query['sql'])
+        ]
+        self.assertEqual(writes, ['UPDATE'])
+        self.assertEqual(len(context), 15)
+        self.assertEqual(
+            dict(self.recipe.ingredient_recipe.values_list(
+                'ingredient', 'amount'
+            )),
+            {self.ingredients[0].id: 25, self.ingredients[1].id: 10,
+             self.ingredients[2].id: 10}
+        )
+
+    def test_update_adds_and_removes_rows(self):
+        """Добавленные и убранные ингредиенты и тэги применяются."""
+        old_ids = set(self.recipe.ingredient_recipe.filter(
+            ingredient=self.ingredients[1]
+        ).values_list('id', flat=True))
+        response = self.patch(
+            [(self.ingredients[1], 10), (self.ingredients[3], 7)],
+            self.tags[1:]
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            dict(self.recipe.ingredient_recipe.values_list(
+                'ingredient', 'amount'
+            )),
+            {self.ingredients[1].id: 10, self.ingredients[3].id: 7}
+        )
+        self.assertTrue(old_ids <= set(
+            self.recipe.ingredient_recipe.values_list('id', flat=True)
+        ))
+        self.assertEqual(
+            set(self.recipe.tags.all()), set(self.tags[1:])
+        )
+
+
+class RecipeCreateTestCase(FoodgramAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ingredients += [
+            Ingredient.objects.create(
+                name=f'Ещё ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(10)
+        ]
+        cls.image = get_base64_image()
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def post(self, ingredients, tags):
+        return self.authorized_client.post(
+            '/api/recipes/',
+            data={
+                'ingredients': ingredients,
+                'tags': tags,
+                'image': self.image,
+                'name': 'Новый рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+            },
+            content_type='application/json'
+        )
+
+    def test_create_queries_do_not_depend_on_ingredients(self):
+        """Число запросов создания не зависит от числа ингредиентов."""
+        queries = []
+        for count in (1, len(self.ingredients)):
+            with CaptureQueriesContext(connection) as context:
+                response = self.post(
+                    [{'id': ingredient.id, 'amount': 5}
+                     for ingredient in self.ingredients[:count]],
+                    [tag.id for tag in self.tags]
+                )
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+            self.assertEqual(len(response.json()['ingredients']), count)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_create_validation_errors(self):
+        """Ошибки неверных ключей и повторов прежние."""
+        ingredient, tag = self.ingredients[0], self.tags[0]
+        response = self.post(
+            [{'id': ingredient.id, 'amount': 5}, {'id': 999, 'amount': 5},
+             {'id': 'abc', 'amount': 5}],
+            [tag.id, 999]
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        does_not_exist = str(
+            PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+        )
+        incorrect_type = str(
+            PrimaryKeyRelatedField.default_error_messages['incorrect_type']
+        )
+        self.assertEqual(response.json(), {
+            'ingredients': [
+                {},
+                {'id': [does_not_exist.format(pk_value=999)]},
+                {'id': [incorrect_type.format(data_type='str')]},
+            ],
+            'tags': [does_not_exist.format(pk_value=999)],
+        })
+        response = self.post(
+            [{'id': ingredient.id, 'amount': 5},
+             {'id': ingredient.id, 'amount': 7}],
+            [tag.id]
+        )
+        self.assertEqual(response.json(), {
+            'ingredients': ['Нельзя выбрать один ингредиент два раза.']
+        })
+
+
+class ShoppingCartTestCase(FoodgramAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipes = list(Recipe.objects.all()[:3])
+        for recipe in self.recipes:
+            response = self.authorized_client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+
+
+class ShoppingCartDownloadTestCase(ShoppingCartTestCase):
+    def download(self, file_format):
+        response = self.authorized_client.get(
+            f'/api/recipes/download_shopping_cart/?format={file_format}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_download_txt(self):
+        """Количество ингредиентов в списке покупок суммируется."""
+        self.assertEqual(
+            self.download('txt'),
+            'Ингредиент 0 (г) - 30\n'
+            'Ингредиент 1 (г) - 30\n'
+            'Ингредиент 2 (г) - 30\n'
+        )
+
+    def test_download_csv(self):
+        """Список покупок выгружается в CSV."""
+        self.assertEqual(
+            self.download('csv').splitlines(),
+            [
+                'name,measurement_unit,amount',
+                'Ингредиент 0,г,30',
+                'Ингредиент 1,г,30',
+                'Ингредиент 2,г,30',
+            ]
+        )
+
+    def test_download_json(self):
+        """Список покупок выгружается в JSON."""
+        self.assertEqual(
+            json.loads(self.download('json'))[0],
+            {'name': 'Ингредиент 0', 'measurement_unit': 'г', 'amount': 30}
+        )
+
+    def test_download_anonymous(self):
+        """Аноним не может скачать список покупок."""
+        response = self.guest_client.get(
+            '/api/recipes/download_shopping_cart/?format=csv'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class ShoppingListTestCase(ShoppingCartTestCase):
+    def get_summary(self):
+        response = self.authorized_client.get(
+            '/api/recipes/shopping_cart_summary/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return {
+            item['id']: item['amount']
+            for item in response.json()['ingredients']
+        }
+
+    def test_remove_recipe_from_cart(self):
+        """Удаление рецепта из корзины вычитает его ингредиенты."""
+        for recipe in self.recipes[:2]:
+            self.authorized_client.delete(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+        self.assertEqual(
+            self.get_summary(),
+            {ingredient.id: 10 for ingredient in self.ingredients[:3]}
+        )
+
+    def test_update_recipe_in_cart(self):
+        """Изменение ингредиентов рецепта обновляет списки покупок."""
+        recipe = self.recipes[0]
+        recipe.author = self.user
+        recipe.save()
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/',
+            data={
+                'ingredients': [
+                    {'id': self.ingredients[0].id, 'amount': 25},
+                    {'id': self.ingredients[4].id, 'amount': 5},
+                ],
+                'tags': [self.tags[0].id],
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+            },
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_summary(), {
+            self.ingredients[0].id: 45,
+            self.ingredients[1].id: 20,
+            self.ingredients[2].id: 20,
+            self.ingredients[4].id: 5,
+        })
+
+    def test_update_recipe_in_carts_totals(self):
+        """Изменение рецепта из корзин меняет строки списков всех
+        пользователей."""
+        recipe = self.recipes[0]
+        recipe.author = self.user
+        recipe.save()
+        ShoppingCart.objects.create(user=self.authors[1], recipe=recipe)
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/',
+            data={
+                'ingredients': [
+                    {'id': self.ingredients[0].id, 'amount': 3},
+                    {'id': self.ingredients[2].id, 'amount': 10},
+                    {'id': self.ingredients[3].id, 'amount': 7},
+                ],
+                'tags': [self.tags[0].id],
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+            },
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        totals = dict(
+            ((user_id, ingredient_id), amount)
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        )
+        self.assertEqual(totals, {
+            (self.user.id, self.ingredients[0].id): 23,
+            (self.user.id, self.ingredients[1].id): 20,
+            (self.user.id, self.ingredients[2].id): 30,
+            (self.user.id, self.ingredients[3].id): 7,
+            (self.authors[1].id, self.ingredients[0].id): 3,
+            (self.authors[1].id, self.ingredients[2].id): 10,
+            (self.authors[1].id, self.ingredients[3].id): 7,
+        })
+        call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+
+    def test_delete_recipe_in_cart(self):
+        """Удаление рецепта убирает его из списков покупок."""
+        recipe = self.recipes[0]
+        recipe.author = self.user
+        recipe.save()
+        self.authorized_client.delete(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(
+            self.get_summary(),
+            {ingredient.id: 20 for ingredient in self.ingredients[:3]}
+        )
+
+    def test_changes_outside_api(self):
+        """Списки покупок верны после изменений в обход API: в админке
+        и при каскадном удалении."""
+        ShoppingCart.objects.create(
+            user=self.user, recipe=Recipe.objects.exclude(
+                id__in=[recipe.id for recipe in self.recipes]
+            ).first()
+        )
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipes[1], ingredient=self.ingredients[0]
+        )
+        row.ingredient = self.ingredients[3]
+        row.amount = 15
+        row.save()
+        IngredientRecipe.objects.get(
+            recipe=self.recipes[2], ingredient=self.ingredients[1]
+        ).delete()
+        self.assertEqual(self.get_summary(), {
+            self.ingredients[0].id: 30,
+            self.ingredients[1].id: 30,
+            self.ingredients[2].id: 40,
+            self.ingredients[3].id: 15,
+        })
+        self.recipes[0].author.delete()
+        call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get_summary(), {})
+
+    def test_rebuild_shopping_lists(self):
+        """Команда пересчёта находит и исправляет расхождения."""
+        call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+        ShoppingListItem.objects.filter(user=self.user).delete()
+        with self.assertRaises(CommandError):
+            call_command(
+                'rebuild_shopping_lists', '--verify', stdout=StringIO()
+            )
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(
+            self.get_summary(),
+            {ingredient.id: 30 for ingredient in self.ingredients[:3]}
+        )
+
+
+class SubscriptionsTestCase(FoodgramAPITestCase):
+    def test_subscriptions_queries_do_not_depend_on_authors(self):
+        """Число запросов страницы подписок не зависит от числа авторов."""
+        url = '/api/users/subscriptions/?recipes_limit=2'
+        with self.assertNumQueries(4):
+            response = self.authorized_client.get(url)
+        self.assertEqual(response.json()['count'], 1)
+        for author in self.authors[1:]:
+            Subscription.objects.create(user=self.user, subscription=author)
+        with self.assertNumQueries(4):
+            response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['count'], len(self.authors))
+
+        for subscription in response.json()['results']:
+            author_recipes = Recipe.objects.filter(
+                author_id=subscription['id']
+            ).order_by('-created', '-id')
+            self.assertTrue(subscription['is_subscribed'])
+            self.assertEqual(
+                subscription['recipes_count'], author_recipes.count()
+            )
+            self.assertEqual(
+                [recipe['id'] for recipe in subscription['recipes']],
+                [recipe.id for recipe in author_recipes[:2]]
+            )
+
+    def test_subscriptions_without_recipes_limit(self):
+        """Без recipes_limit отображаются все рецепты автора."""
+        response = self.authorized_client.get('/api/users/subscriptions/')
+        subscription = response.json()['results'][0]
+        self.assertEqual(
+            set(subscription),
+            {'id', 'username', 'email', 'first_name', 'last_name',
+             'is_subscribed', 'avatar', 'recipes', 'recipes_count'}
+        )
+        self.assertEqual(
+            len(subscription['recipes']), subscription['recipes_count']
+        )
+
+    def test_subscriptions_invalid_recipes_limit(self):
+        """Нечисловой recipes_limit возвращает ошибку."""
+        response = self.authorized_client.get(
+            '/api/users/subscriptions/?recipes_limit=abc'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class LoadCSVCommandTestCase(TestCase):
+    ingredients_csv = (
+        'name,measurement_unit\n'
+        'соль,г\n'
+        '\n'
+        ' сахар , г\n'
+        'соль,г\n'
+        'молоко,мл\n'
+    )
+    ingredients_json = json.dumps([
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 'сахар [белый], "рафинад"', 'measurement_unit': 'г'},
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 'молоко', 'measurement_unit': 'мл'},
+    ], ensure_ascii=False, indent=1)
+    tags_csv = 'Завтрак,breakfast\nОбед,lunch\nЗавтрак,breakfast\n'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = self.settings(MEDIA_ROOT=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, ingredients, *args):
+        call_command(
+            'loadcsv', *args, ingredients=ingredients,
+            tags=self.write('tags.csv', self.tags_csv), batch_size=2,
+            stdout=StringIO()
+        )
+
+    def assertLoadedTwice(self, ingredients, *args):
+        """Проверка, что повторная загрузка не добавляет дубликатов."""
+        for _ in range(2):
+            self.load(ingredients, *args)
+            self.assertEqual(Ingredient.objects.count(), 3)
+            self.assertEqual(Tag.objects.count(), 2)
+
+    def test_load_csv_twice(self):
+        """CSV загружается пачками без дубликатов и пустых строк."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertLoadedTwice(
+                self.write('ingredients.csv', self.ingredients_csv)
+            )
+        self.assertEqual(
+            self.client.get('/api/ingredients/catalog/').status_code,
+            HTTPStatus.OK
+        )
+        self.assertTrue(
+            Ingredient.objects.filter(name='сахар', measurement_unit='г')
+        )
+
+    @mock.patch('foodgram.management.commands.loadcsv.LOAD_READ_SIZE', 7)
+    def test_load_json_twice(self):
+        """JSON читается частями, объекты на границах частей целы."""
+        self.assertLoadedTwice(
+            self.write('ingredients.json', self.ingredients_json)
+        )
+        self.assertTrue(
+            Ingredient.objects.filter(name='сахар [белый], "рафинад"')
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL')
+    def test_load_copy_twice(self):
+        """Загрузка через COPY тоже пропускает существующие строки."""
+        self.assertLoadedTwice(
+            self.write('ingredients.csv', self.ingredients_csv), '--copy'
+        )
+
+    def test_copy_requires_postgresql(self):
+        """Без PostgreSQL загрузка через COPY недоступна."""
+        if connection.vendor == 'postgresql':
+            self.skipTest('проверяется без PostgreSQL')
+        with self.assertRaises(CommandError):
+            self.load(
+                self.write('ingredients.csv', self.ingredients_csv), '--copy'
+            )
+
+
+class GenerateDataCommandTestCase(FoodgramAPITestCase):
+    generated = (
+        (Recipe, 'author', ('id', 'author_id', 'cooking_time')),
+        (IngredientRecipe, 'recipe__author',
+         ('recipe_id', 'ingredient_id', 'amount')),
+        (TagRecipe, 'recipe__author', ('recipe_id', 'tag_id')),
+        (Favorite, 'user', ('user_id', 'recipe_id')),
+        (ShoppingCart, 'user', ('user_id', 'recipe_id')),
+        (Subscription, 'user', ('user_id', 'subscription_id')),
+        (ShoppingListItem, 'user', ('user_id', 'ingredient_id', 'amount')),
+        (TimelineEntry, 'user', ('user_id', 'recipe_id')),
+    )
+
+    def generate(self, seed):
+        call_command(
+            'generate_data', users=30, recipes=60, favorites=5, carts=3,
+            subscriptions=4, seed=seed, batch_size=16, stdout=StringIO()
+        )
+        return {
+            model.__name__: sorted(model.objects.filter(**{
+                f'{owner}__username__startswith': 'synthetic_'
+            }).values_list(*fields))
+            for model, owner, fields in self.generated
+        }
+
+    def remove_generated(self):
+        Profile.objects.filter(username__startswith='synthetic_').delete()
+
+    def test_same_seed_same_data(self):
+        """Одинаковый seed даёт одинаковые данные, другой seed другие."""
+        first = self.generate(seed=1)
+        self.assertEqual(len(first['Recipe']), 60)
+        self.assertTrue(all(first.values()))
+        self.remove_generated()
+        self.assertEqual(self.generate(seed=1), first)
+        self.remove_generated()
+        self.assertNotEqual(self.generate(seed=2), first)
+
+    def test_generated_data_consistent(self):
+        """После генерации счётчики, списки и рейтинги согласованы."""
+        self.generate(seed=0)
+        call_command('recount_counters', verify=True, stdout=StringIO())
+        call_command(
+            'rebuild_shopping_lists', verify=True, stdout=StringIO()
+        )
+        self.assertFalse(Recipe.objects.filter(ranking__isnull=True))
+        self.assertFalse(TimelineEntry.objects.exclude(
+            recipe__author__subscription__user=F('user')
+        ))
+
+
+class BenchmarkCommandTestCase(FoodgramAPITestCase):
+    def test_benchmark_reports_regressions(self):
+        """Бенчмарк сохраняет результаты и находит регрессии."""
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command(
+                'benchmark', iterations=1, warmup=0, output=output,
+                stdout=StringIO(), stderr=StringIO()
+            )
+            with open(output, encoding='utf-8') as file:
+                report = json.load(file)
+            self.assertIn('recipes-list all', report['results'])
+            for result in report['results'].values():
+                self.assertNotIn(
+                    HTTPStatus.INTERNAL_SERVER_ERROR, result['statuses']
+                )
+                result['queries'] = 0
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(report, file)
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark', iterations=1, warmup=0, compare=output,
+                    filter='tags-list', stdout=StringIO(), stderr=StringIO()
+                )
+
+
+class QueryBudgetTestCase(FoodgramAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.checked_actions = set()
+
+    def assertWithinQueryBudget(self, viewset, action, method, url,
+                                **kwargs):
+        """Проверка, что действие укладывается в бюджет запросов."""
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.authorized_client, method)(url, **kwargs)
+        self.assertLess(response.status_code, HTTPStatus.BAD_REQUEST, url)
+        self.assertLessEqual(
+            len(context.captured_queries), viewset.query_budget[action],
+            f'{viewset.__name__}.{action}: {method.upper()} {url}'
+        )
+        self.checked_actions.add((viewset, action))
+        return response
+
+    def test_actions_within_query_budget(self):
+        """Действия вьюсетов укладываются в бюджет запросов."""
+        recipe = Recipe.objects.first()
+        own_recipe = self.create_recipe(self.user, 'собственный')
+        author = self.authors[1]
+        tag = self.tags[0]
+        ingredient = self.ingredients[0]
+        for author_to_follow in self.authors[1:]:
+            Subscription.objects.create(
+                user=self.user, subscription=author_to_follow
+            )
+        checks = (
+            (TagViewSet, 'list', 'get', '/api/tags/'),
+            (TagViewSet, 'retrieve', 'get', f'/api/tags/{tag.id}/'),
+            (IngredientViewSet, 'list', 'get', '/api/ingredients/?name=Инг'),
+            (IngredientViewSet, 'retrieve', 'get',
+             f'/api/ingredients/{ingredient.id}/'),
+            (IngredientViewSet, 'catalog', 'get', '/api/ingredients/catalog/'),
+            (RecipeViewSet, 'list', 'get',
+             f'/api/recipes/?limit=50&tags={tag.slug}&author={author.id}'),
+            (RecipeViewSet, 'list', 'get',
+             '/api/recipes/?limit=50&is_favorited=0&is_in_shopping_cart=0'),
+            (RecipeViewSet, 'list', 'get', '/api/recipes/?cursor=&limit=50'),
+            (RecipeViewSet, 'feed', 'get', '/api/recipes/feed/?limit=50'),
+            (RecipeViewSet, 'retrieve', 'get', f'/api/recipes/{recipe.id}/'),
+            (RecipeViewSet, 'similar', 'get',
+             f'/api/recipes/{own_recipe.id}/similar/'),
+            (RecipeViewSet, 'get_link', 'get',
+             f'/api/recipes/{recipe.id}/get-link/'),
+            (RecipeViewSet, 'add_delete_favorite', 'post',
+             f'/api/recipes/{recipe.id}/favorite/'),
+            (RecipeViewSet, 'add_delete_favorite', 'delete',
+             f'/api/recipes/{recipe.id}/favorite/'),
+            (RecipeViewSet, 'add_delete_shopping_cart', 'post',
+             f'/api/recipes/{recipe.id}/shopping_cart/'),
+            (RecipeViewSet, 'download_shopping_cart', 'get',
+             '/api/recipes/download_shopping_cart/'),
+            (RecipeViewSet, 'shopping_cart_summary', 'get',
+             '/api/recipes/shopping_cart_summary/'),
+            (RecipeViewSet, 'add_delete_shopping_cart', 'delete',
+             f'/api/recipes/{recipe.id}/shopping_cart/'),
+            (RecipeViewSet, 'destroy', 'delete',
+             f'/api/recipes/{own_recipe.id}/'),
+            (ProfileViewSet, 'list', 'get', '/api/users/?limit=50'),
+            (ProfileViewSet, 'retrieve', 'get', f'/api/users/{author.id}/'),
+            (ProfileViewSet, 'get_current_user_info', 'get', '/api/users/me/'),
+            (ProfileViewSet, 'add_delete_avatar', 'delete',
+             '/api/users/me/avatar/'),
+            (ProfileViewSet, 'get_subscriptions', 'get',
+             '/api/users/subscriptions/?limit=20&recipes_limit=3'),
+            (ProfileViewSet, 'set_subscription', 'delete',
+             f'/api/users/{author.id}/subscribe/'),
+            (ProfileViewSet, 'set_subscription', 'post',
+             f'/api/users/{author.id}/subscribe/'),
+        )
+        self.assertWithinQueryBudget(
+            RecipeViewSet, 'partial_update', 'patch',
+            f'/api/recipes/{own_recipe.id}/',
+            data={
+                'ingredients': [{'id': ingredient.id, 'amount': 15}],
+                'tags': [tag.id],
+                'name': own_recipe.name,
+                'text': own_recipe.text,
+                'cooking_time': own_recipe.cooking_time,
+            },
+            content_type='application/json'
+        )
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            MEDIA_ROOT=directory
+        ):
+            write_ingredient_catalog()
+            self.assertWithinQueryBudget(
+                RecipeViewSet, 'create', 'post', '/api/recipes/',
+                data={
+                    'ingredients': [
+                        {'id': ingredient.id, 'amount': 5}
+                        for ingredient in self.ingredients
+                    ],
+                    'tags': [tag.id for tag in self.tags],
+                    'image': get_base64_image(),
+                    'name': 'Новый рецепт',
+                    'text': 'Описание',
+                    'cooking_time': 10,
+                },
+                content_type='application/json'
+            )
+            for viewset, action, method, url in checks:
+                with self.subTest(url=url, method=method):
+                    self.assertWithinQueryBudget(viewset, action, method, url)
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:10])
+        author_ids = [author.id for author in self.authors]
+        for viewset, action, url, data in (
+            (RecipeViewSet, 'batch_favorite', '/api/recipes/favorite/batch/',
+             {'add': recipe_ids}),
+            (RecipeViewSet, 'batch_favorite', '/api/recipes/favorite/batch/',
+             {'remove': recipe_ids}),
+            (RecipeViewSet, 'batch_shopping_cart',
+             '/api/recipes/shopping_cart/batch/', {'add': recipe_ids}),
+            (RecipeViewSet, 'batch_shopping_cart',
+             '/api/recipes/shopping_cart/batch/', {'remove': recipe_ids[5:]}),
+            (ProfileViewSet, 'batch_subscriptions',
+             '/api/users/subscribe/batch/', {'remove': author_ids}),
+            (ProfileViewSet, 'batch_subscriptions',
+             '/api/users/subscribe/batch/', {'add': author_ids}),
+        ):
+            with self.subTest(url=url, data=data):
+                self.assertWithinQueryBudget(
+                    viewset, action, 'post', url,
+                    data=data, content_type='application/json'
+                )
+        self.assertWithinQueryBudget(
+            RecipeViewSet, 'clear_shopping_cart', 'delete',
+            '/api/recipes/shopping_cart/clear/'
+        )
+        self.assertEqual(self.checked_actions, {
+            (viewset, action)
+            for viewset in (TagViewSet, IngredientViewSet, RecipeViewSet,
+                            ProfileViewSet)
+            for action in viewset.query_budget
+        })
+
+    @override_settings(DEBUG=True, QUERY_BUDGET_RAISE=True)
+    def test_middleware_raises_over_budget(self):
+        """Промежуточный слой сообщает о превышении бюджета."""
+        client = Client(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(
+            client.get('/api/tags/').status_code, HTTPStatus.OK
+        )
+        with mock.patch.dict(TagViewSet.query_budget, {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded), self.assertLogs(
+                'django.request', 'ERROR'
+            ):
+                client.get('/api/tags/')
+
+
+class MetricsTestCase(FoodgramAPITestCase):
+    def test_metrics_endpoint(self):
+        """Эндпоинт метрик отдаёт счётчики и гистограммы по токену."""
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            METRICS_TOKEN='secret', METRICS_DIR=directory
+        ):
+            self.guest_client.get('/api/recipes/')
+            self.assertEqual(
+                self.guest_client.get('/api/_metrics').status_code,
+                HTTPStatus.FORBIDDEN
+            )
+            self.assertEqual(
+                self.guest_client.get(
+                    '/api/_metrics', HTTP_AUTHORIZATION='Bearer сéкрет'
+                ).status_code,
+                HTTPStatus.FORBIDDEN
+            )
+            response = self.guest_client.get(
+                '/api/_metrics', HTTP_AUTHORIZATION='Bearer secret'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        content = response.content.decode()
+        self.assertIn(
+            'foodgram_http_requests_total{method="GET",'
+            'route="recipes-list",status="200"}', content
+        )
+        self.assertIn(
+            'foodgram_http_request_duration_seconds_bucket{method="GET",'
+            'route="recipes-list",le="+Inf"}', content
+        )
+        self.assertIn('foodgram_db_queries_count{method="GET",', content)
+
+    def test_metrics_keep_finished_workers(self):
+        """Метрики завершившихся воркеров остаются в сумме после сбора."""
+        process = subprocess.Popen((sys.executable, '-c', ''))
+        process.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            METRICS_DIR=directory
+        ):
+            path = os.path.join(directory, f'metrics-{process.pid}.json')
+            with open(path, 'w') as file:
+                json.dump({
+                    'counters': {'foodgram_http_errors_total': {'': 100}},
+                    'histograms': {'foodgram_db_queries': {'': {
+                        'buckets': [1], 'counts': [2, 3], 'sum': 10,
+                    }}},
+                }, file)
+            for _ in range(2):
+                counters, histograms = metrics.collect()
+                self.assertFalse(os.path.exists(path))
+                self.assertEqual(
+                    counters['foodgram_http_errors_total'][''], 100
+                )
+                self.assertEqual(
+                    histograms['foodgram_db_queries'][''],
+                    {'buckets': [1], 'counts': [2, 3], 'sum': 10}
+                )
+            self.assertTrue(os.path.exists(os.path.join(
+                directory, f'metrics-{os.getpid()}.json'
+            )))
+
+    def test_metrics_disabled_without_token(self):
+        """Без токена эндпоинт метрик недоступен."""
+        with override_settings(METRICS_TOKEN=''):
+            response = self.guest_client.get('/api/_metrics')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class IngredientSearchTestCase(FoodgramAPITestCase):
+    def test_prefix_search(self):
+        """Поиск по префиксу без учёта регистра, по алфавиту и с лимитом."""
+        Ingredient.objects.create(name='Яблоко', measurement_unit='шт')
+        Ingredient.objects.create(name='яблочный сок', measurement_unit='мл')
+        Ingredient.objects.create(name='Ячмень', measurement_unit='г')
+        response = self.guest_client.get('/api/ingredients/?name=ЯБЛ')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [item['name'] for item in response.json()],
+            ['Яблоко', 'яблочный сок']
+        )
+        with override_settings(INGREDIENT_SEARCH_LIMIT=2):
+            response = self.guest_client.get('/api/ingredients/?name=ингр')
+        self.assertEqual(
+            response.json(),
+            [
+                {'id': ingredient.id, 'name': ingredient.name,
+                 'measurement_unit': 'г'}
+                for ingredient in self.ingredients[:2]
+            ]
+        )
+
+    def test_search_without_queries(self):
+        """Поиск по построенному индексу не обращается к базе."""
+        self.guest_client.get('/api/ingredients/?name=и')
+        with CaptureQueriesContext(connection) as context:
+            response = self.guest_client.get('/api/ingredients/?name=и')
+        self.assertEqual(len(response.json()), len(self.ingredients))
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_index_rebuilt_after_change(self):
+        """Изменение ингредиента сразу видно в поиске."""
+        self.guest_client.get('/api/ingredients/?name=и')
+        ingredient = self.ingredients[0]
+        ingredient.name = 'Соль'
+        ingredient.save()
+        names = [
+            item['name'] for item in
+            self.guest_client.get('/api/ingredients/?name=').json()
+        ]
+        self.assertEqual(names[-1], 'Соль')
+        self.assertNotIn('Ингредиент 0', names)
+
+    def test_ranked_search(self):
+        """Ранжированный поиск: начало, подстрока, опечатка, популярность."""
+        for name in ('Молоко', 'Молоко кокосовое', 'Сгущённое молоко',
+                     'Топлёное молоко', 'Малоко', 'Мука'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        popular = Ingredient.objects.get(name='Топлёное молоко')
+        recipe = Recipe.objects.first()
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=popular, amount=1
+        )
+        with CaptureQueriesContext(connection) as context:
+            self.guest_client.get('/api/ingredients/?name=молоко&ranked=1')
+        self.assertFalse(any(
+            'foodgram_ingredientrecipe' in query['sql']
+            for query in context.captured_queries
+        ))
+        call_command('rank_recipes', stdout=StringIO())
+        ingredient_index.bump_version()
+        response = self.guest_client.get(
+            '/api/ingredients/?name=молоко&ranked=1'
+        )
+        self.assertEqual(
+            [item['name'] for item in response.json()],
+            ['Молоко', 'Молоко кокосовое', 'Топлёное молоко',
+             'Сгущённое молоко', 'Малоко']
+        )
+        response = self.guest_client.get(
+            '/api/ingredients/?name=малако&ranked=1'
+        )
+        self.assertIn('Малоко', [item['name'] for item in response.json()])
+        response = self.guest_client.get('/api/ingredients/?name=мо&ranked=1')
+        self.assertEqual(
+            [item['name'] for item in response.json()],
+            ['Молоко', 'Молоко кокосовое']
+        )
+        with mock.patch(
+            'api.ingredient_index.INGREDIENT_SEARCH_CANDIDATES', 1
+        ):
+            response = self.guest_client.get(
+                '/api/ingredients/?name=молоко&ranked=1'
+            )
+        self.assertEqual(response.json()[0]['name'], 'Молоко')
+        self.assertLessEqual(len(response.json()), 2)
+
+
+class IngredientCatalogTestCase(FoodgramAPITestCase):
+    def test_catalog_snapshot(self):
+        """Команда пишет сжатый снимок, эндпоинт отдаёт его версию."""
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            MEDIA_ROOT=directory
+        ):
+            self.assertEqual(
+                self.guest_client.get('/api/ingredients/catalog/').status_code,
+                HTTPStatus.NOT_FOUND
+            )
+            call_command(
+                'build_ingredient_catalog',
+                stdout=StringIO(), stderr=StringIO()
+            )
+            response = self.guest_client.get('/api/ingredients/catalog/')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            version = response.json()['version']
+            path = os.path.join(
+                directory, 'catalog', f'ingredients.{version}.json'
+            )
+            self.assertTrue(response.json()['url'].endswith(
+                f'/media/catalog/ingredients.{version}.json'
+            ))
+            with open(path + '.gz', 'rb') as file:
+                catalog = json.loads(gzip.decompress(file.read()))
+            self.assertEqual(catalog, [
+                {'id': ingredient.id, 'name': ingredient.name,
+                 'measurement_unit': ingredient.measurement_unit}
+                for ingredient in self.ingredients
+            ])
+            call_command(
+                'build_ingredient_catalog',
+                stdout=StringIO(), stderr=StringIO()
+            )
+            self.assertEqual(
+                self.guest_client.get(
+                    '/api/ingredients/catalog/'
+                ).json()['version'],
+                version
+            )
+            Ingredient.objects.create(name='Соль', measurement_unit='г')
+            write_ingredient_catalog()
+            self.assertNotEqual(
+                self.guest_client.get(
+                    '/api/ingredients/catalog/'
+                ).json()['version'],
+                version
+            )
+            self.assertTrue(os.path.exists(path))
+
+    def test_catalog_written_once_per_transaction(self):
+        """Снимок каталога пишется один раз на транзакцию."""
+        for index in range(3):
+            Ingredient.objects.create(
+                name=f'Специя {index}', measurement_unit='г'
+            )
+        self.ingredients[0].delete()
+        self.assertEqual(
+            [
+                callback for *_, callback in connection.run_on_commit
+                if callback is ingredients_committed
+            ],
+            [ingredients_committed]
+        )
+
+
+@mock.patch.multiple(
+    'api.events', EVENTS_POLL_INTERVAL=0.01, EVENTS_HEARTBEAT_INTERVAL=0.05
+)
+class RecipeEventsTestCase(FoodgramAPITestCase):
+    def setUp(self):
+        super().setUp()
+        # Как клиент тестов Django, не закрываем соединение внутри
+        # транзакции теста.
+        patcher = mock.patch('api.events.close_old_connections')
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, query_string=b'', headers=()):
+        return ApplicationCommunicator(application, {
+            'type': 'http',
+            'method': 'GET',
+            'path': EVENTS_PATH,
+            'query_string': query_string,
+            'headers': list(headers),
+        })
+
+    async def read(self, communicator, marker):
+        text = ''
+        while marker not in text:
+            message = await communicator.receive_output(2)
+            text += message.get('body', b'').decode()
+        return text
+
+    async def test_events_for_followed_authors(self):
+        """Поток присылает рецепты только авторов из подписок."""
+        communicator = self.connect(f'token={self.token.key}'.encode())
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(2)
+        self.assertEqual(start['status'], HTTPStatus.OK)
+        self.assertIn(
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            start['headers']
+        )
+        await self.read(communicator, 'retry:')
+        await self.read(communicator, ': ping')
+        await sync_to_async(self.create_recipe)(self.authors[1], 'чужой')
+        recipe = await sync_to_async(self.create_recipe)(
+            self.authors[0], 'новый'
+        )
+        text = await self.read(communicator, 'event: recipe')
+        self.assertIn(f'id: {recipe.id}\n', text)
+        self.assertIn('"name": "Рецепт новый"', text)
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(2)
+        self.assertEqual(broker.connections, 0)
+
+    async def test_events_replay_and_limits(self):
+        """Пропущенные события досылаются, медленный клиент отключается."""
+        first = await sync_to_async(self.create_recipe)(
+            self.authors[0], 'первый'
+        )
+        second = await sync_to_async(self.create_recipe)(
+            self.authors[0], 'второй'
+        )
+        communicator = self.connect(headers=(
+            (b'authorization', f'Token {self.token.key}'.encode()),
+            (b'last-event-id', str(first.id).encode()),
+        ))
+        await communicator.send_input({'type': 'http.request'})
+        await communicator.receive_output(2)
+        text = await self.read(communicator, 'event: recipe')
+        self.assertIn(f'id: {second.id}\n', text)
+        self.assertNotIn(f'id: {first.id}\n', text)
+        (subscriber,) = broker.subscribers[self.authors[0].id]
+        for index in range(EVENTS_QUEUE_SIZE + 1):
+            subscriber.offer({'id': second.id, 'author': self.authors[0].id})
+        await self.read(communicator, 'event: reset')
+        await communicator.wait(2)
+        self.assertEqual(broker.connections, 0)
+
+    @mock.patch('api.events.EVENTS_POLL_INTERVAL', 0.01)
+    async def test_poll_delivers_late_commits_after_errors(self):
+        """Рецепт с меньшим id, зафиксированный позже, доходит до
+        подписчиков, ошибки чтения не останавливают опрос."""
+        now = timezone.now()
+        author_id = self.authors[0].id
+        recipes = [
+            (now, {'id': 10, 'name': 'новый', 'author': author_id,
+                   'created': now.isoformat()}),
+        ]
+        late = (now, {'id': 9, 'name': 'поздний', 'author': author_id,
+                      'created': now.isoformat()})
+        responses = iter((recipes, DatabaseError('нет соединения')))
+
+        def get_recent_recipes(newest):
+            response = next(responses, [late, *recipes])
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        subscriber = Subscriber({author_id})
+        with mock.patch(
+            'api.events.get_recent_recipes', get_recent_recipes
+        ), self.assertLogs('api.events', 'ERROR'):
+            broker.subscribe(subscriber)
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), 2)
+                await asyncio.sleep(0.05)
+            finally:
+                broker.unsubscribe(subscriber)
+        self.assertEqual(event['id'], 9)
+        self.assertTrue(subscriber.queue.empty())
+        self.assertIsNone(broker.poller)
+        self.close_old_connections.assert_called()
+
+    async def test_events_require_token(self):
+        """Без токена поток недоступен."""
+        communicator = self.connect(b'token=wrong')
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(2)
+        self.assertEqual(start['status'], HTTPStatus.UNAUTHORIZED)
+
+    @mock.patch('api.events.EVENTS_IDLE_TIMEOUT', 0.1)
+    async def test_events_idle_timeout(self):
+        """Поток без событий закрывается после простоя."""
+        communicator = self.connect(f'token={self.token.key}'.encode())
+        await communicator.send_input({'type': 'http.request'})
+        await communicator.receive_output(2)
+        message = {'more_body': True}
+        while message.get('more_body'):
+            message = await communicator.receive_output(2)
+        await communicator.wait(2)
+        self.assertEqual(broker.connections, 0)
@@ -1,5 +1,5 @@
 from api.views import (ProfileViewSet, IngredientViewSet, RecipeViewSet,
-                       TagViewSet)
+                       TagViewSet, metrics_view)
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -11,6 +11,7 @@ router_v1.register('recipes', RecipeViewSet, basename='recipes')
 router_v1.register('users', ProfileViewSet, basename='users')
 
 urlpatterns = [
+    path('_metrics', metrics_view, name='metrics'),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,10 +1,14 @@
 import random
 import string
+from collections import defaultdict
 
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber
 from django.urls import reverse
 
 from short_url.models import ShortLink
 from foodgram.constants import MAX_SHORT_URL_LENGTH
+from foodgram.models import Recipe, Subscription
 
 
 def generate_short_url():
@@ -37,3 +41,45 @@ def get_new_url(request, id):
         reverse('redirect_url', args=[url.short_url])
     )
     return new_url
+
+
+def annotate_is_subscribed(queryset, user):
+    """Функция добавления к кверисету пользователей флага подписки."""
+    if not user.is_authenticated:
+        return queryset
+    return queryset.annotate(
+        is_subscribed=Exists(
+            Subscription.objects.filter(user=user, subscription=OuterRef('pk'))
+        )
+    )
+
+
+def get_latest_recipes(author_ids, limit=None):
+    """Функция получения последних рецептов авторов одним запросом.
+
+    Возвращает словарь {id автора: список рецептов}. Если задан limit,
+    рецепты нумеруются оконной функцией ROW_NUMBER по автору и
+    отбираются первые limit рецептов каждого автора.
+    """
+    recipes = Recipe.objects.filter(author_id__in=author_ids)
+    if limit is None:
+        recipes = recipes.order_by('author_id', '-created', '-id')
+    else:
+        ranked = recipes.annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('created').desc(), F('id').desc()),
+            )
+        ).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.recipe_rank',
+            (*params, limit)
+        )
+    latest_recipes = defaultdict(list)
+    for recipe in recipes:
+        latest_recipes[recipe.author_id].append(recipe)
+    return latest_recipes
@@ -1,5 +1,10 @@
-from django.db.models import F, Exists, OuterRef
-from django.http import HttpResponse
+import hmac
+from itertools import islice
+
+from django.conf import settings as django_settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.conf import settings
@@ -7,20 +12,50 @@ from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.paginators import LimitNumberPaginator, LimitSubscriptionsPaginator
+from api.catalog import read_catalog_manifest
+from api.filters import RecipeFilter
+from api.ingredient_index import ingredient_index, search_ingredients_ranked
+from api.metrics import metrics
+from api.paginators import (FeedCursorPaginator, LimitNumberPaginator,
+                            LimitSubscriptionsPaginator,
+                            RecipeCursorPaginator)
 from api.permissions import IsAuthorOrAdminOnly
-from api.serializers import (AvatarSeializer, FavoriteCreateSerializer,
-                             IngredientSerializer, UserListSerializer,
-                             RecipeCreateSerializer, RecipeSerializer,
-                             ShoppingCartSerializer, TagSerializer,
+from api.renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                           ShoppingCartTextRenderer)
+from api.serializers import (AvatarSeializer, FavoriteBatchSerializer,
+                             FavoriteCreateSerializer, IngredientSerializer,
+                             UserListSerializer, RecipeCreateSerializer,
+                             RecipeMinifiedSerializer, RecipeSerializer,
+                             ShoppingCartBatchSerializer,
+                             ShoppingCartSerializer,
+                             ShoppingListItemSerializer, TagSerializer,
+                             SubscriptionBatchSerializer,
                              SubscriptionCreateSerializer,
                              SubscriptionSerializer)
-from api.utils import get_new_url
-from foodgram.models import (Ingredient, Recipe, Tag, Favorite,
-                             ShoppingCart, Profile)
+from api.similar import recipe_matrix
+from api.utils import annotate_is_subscribed, get_new_url
+from foodgram.constants import (MAX_SIMILAR_RECIPES_LIMIT,
+                                SIMILAR_RECIPES_LIMIT, TRANSFER_RECIPES_FILE,
+                                TRANSFER_UPLOAD_MAX_RECORDS,
+                                TRANSFER_UPLOAD_MAX_SIZE)
+from foodgram.models import (Ingredient, IngredientRecipe, Recipe, Tag,
+                             Favorite, ShoppingCart, ShoppingListItem, Profile)
+from foodgram.transfer import (export_recipes, format_record,
+                               import_uploaded_recipes)
+
+
+def save_batch(request, serializer_class):
+    """Функция записи пакета связей текущего пользователя."""
+    serializer = serializer_class(
+        data=request.data, context={'request': request}
+    )
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    return Response(serializer.data)
 
 
 class ProfileViewSet(UserViewSet):
@@ -29,6 +64,15 @@ class ProfileViewSet(UserViewSet):
     queryset = Profile.objects.all()
     serializer_class = UserListSerializer
     pagination_class = LimitNumberPaginator
+    query_budget = {
+        'list': 3,
+        'retrieve': 2,
+        'get_current_user_info': 2,
+        'add_delete_avatar': 2,
+        'get_subscriptions': 4,
+        'set_subscription': 15,
+        'batch_subscriptions': 9,
+    }
 
     def get_permissions(self):
         """Метод получает разрешения для текущего пользователя."""
@@ -39,6 +83,12 @@ class ProfileViewSet(UserViewSet):
 
         return super().get_permissions()
 
+    def get_queryset(self):
+        """Метод переопределения кверисета для пользователя."""
+        return annotate_is_subscribed(
+            super().get_queryset(), self.request.user
+        )
+
     @action(
         methods=['GET'],
         detail=False,
@@ -76,8 +126,9 @@ class ProfileViewSet(UserViewSet):
     )
     def get_subscriptions(self, request):
         """Метод получения подписок пользователя."""
-        users_we_follow = Profile.objects.filter(
-            subscription__user=request.user
+        users_we_follow = annotate_is_subscribed(
+            Profile.objects.filter(subscription__user=request.user),
+            request.user
         )
         paginator = LimitSubscriptionsPaginator()
         paginated_users_we_follow = paginator.paginate_queryset(
@@ -108,7 +159,8 @@ class ProfileViewSet(UserViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if not request.user.subscriber.filter(
             subscription=subscription
@@ -121,6 +173,16 @@ class ProfileViewSet(UserViewSet):
         unsubscribe.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(IsAuthorOrAdminOnly,),
+        url_path='subscribe/batch'
+    )
+    def batch_subscriptions(self, request):
+        """Метод пакетного создания удаления подписок пользователя."""
+        return save_batch(request, SubscriptionBatchSerializer)
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """Настройки вьюсета модели Тэгов."""
@@ -129,6 +191,10 @@ class TagViewSet(viewsets.ModelViewSet):
     http_method_names = ['get']
     serializer_class = TagSerializer
     pagination_class = None
+    query_budget = {
+        'list': 2,
+        'retrieve': 2,
+    }
 
 
 class IngredientViewSet(viewsets.ModelViewSet):
@@ -137,20 +203,81 @@ class IngredientViewSet(viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     http_method_names = ['get']
     serializer_class = IngredientSerializer
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
     pagination_class = None
+    query_budget = {
+        'list': 3,
+        'retrieve': 2,
+        'catalog': 1,
+    }
+
+    def list(self, request, *args, **kwargs):
+        """Метод поиска ингредиентов по индексу в памяти.
+
+        С параметром ranked=1 ищутся также подстроки и опечатки.
+        """
+        search = ingredient_index.search
+        if request.query_params.get('ranked') == '1':
+            search = search_ingredients_ranked
+        return Response(search(
+            request.query_params.get('name', ''),
+            django_settings.INGREDIENT_SEARCH_LIMIT
+        ))
+
+    @action(detail=False, url_path='catalog')
+    def catalog(self, request):
+        """Метод выдачи версии и адреса снимка каталога ингредиентов.
+
+        Сам снимок неизменяем и отдаётся nginx из медиа.
+        """
+        manifest = read_catalog_manifest()
+        if manifest is None:
+            raise Http404
+        return Response(
+            {
+                'version': manifest['version'],
+                'url': request.build_absolute_uri(manifest['url']),
+            },
+            headers={'Cache-Control': 'no-cache'}
+        )
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Настройки вьюсета модели Рецепта."""
 
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('search_vector')
     serializer_class = RecipeSerializer
     http_method_names = ['post', 'get', 'delete', 'patch']
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     pagination_class = LimitNumberPaginator
+    query_budget = {
+        'list': 8,
+        'retrieve': 6,
+        'create': 16,
+        'partial_update': 17,
+        'destroy': 16,
+        'get_link': 8,
+        'add_delete_favorite': 7,
+        'add_delete_shopping_cart': 12,
+        'batch_favorite': 8,
+        'batch_shopping_cart': 12,
+        'clear_shopping_cart': 11,
+        'download_shopping_cart': 2,
+        'shopping_cart_summary': 3,
+        'similar': 5,
+        'feed': 7,
+    }
+
+    @property
+    def paginator(self):
+        """Пагинатор по курсору, если он запрошен параметром cursor."""
+        if (
+            not hasattr(self, '_paginator')
+            and RecipeCursorPaginator.cursor_query_param
+            in self.request.query_params
+        ):
+            self._paginator = RecipeCursorPaginator()
+        return super().paginator
 
     def get_queryset(self):
         """Метод переопределения кверисета для рецепта."""
@@ -167,6 +294,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
         else:
             queryset = self.queryset
+        if self.action in ('list', 'retrieve', 'feed'):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'author',
+                    queryset=annotate_is_subscribed(
+                        Profile.objects.all(), self.request.user
+                    )
+                ),
+                'tags',
+                Prefetch(
+                    'ingredient_recipe',
+                    queryset=IngredientRecipe.objects.select_related(
+                        'ingredient'
+                    )
+                ),
+            )
         return queryset
 
     def get_serializer_class(self):
@@ -175,6 +318,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeCreateSerializer
         return RecipeSerializer
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        """Метод создания рецепта вместе со счётчиком автора."""
+        super().perform_create(serializer)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        """Метод применения изменений рецепта одной транзакцией."""
+        super().perform_update(serializer)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        """Метод удаления рецепта со связями одной транзакцией."""
+        super().perform_destroy(instance)
+
     def get_permissions(self):
         """Метод получает разрешения для текущего пользователя."""
         if self.action == 'create':
@@ -194,6 +352,46 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response({'short-link': get_new_url(request, recipe.id)},
                         status=status.HTTP_200_OK)
 
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        url_path='feed'
+    )
+    def feed(self, request):
+        """Метод получения ленты рецептов авторов из подписок."""
+        paginator = FeedCursorPaginator()
+        page = paginator.paginate_queryset(
+            self.get_queryset(), request, view=self
+        )
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path='similar'
+    )
+    def similar(self, request, pk):
+        """Метод получения рецептов, похожих по ингредиентам и тэгам."""
+        recipe = get_object_or_404(Recipe.objects.only('id'), id=pk)
+        limit = request.query_params.get('limit', SIMILAR_RECIPES_LIMIT)
+        try:
+            limit = min(int(limit), MAX_SIMILAR_RECIPES_LIMIT)
+        except ValueError:
+            raise ValidationError(
+                f'{limit} не является числом. Введите число рецептов.'
+            )
+        if limit < 1:
+            return Response([])
+        recipe_ids = recipe_matrix.similar(recipe, limit * 2)
+        recipes = Recipe.objects.defer('search_vector').in_bulk(recipe_ids)
+        return Response(RecipeMinifiedSerializer(
+            [recipes[recipe_id] for recipe_id in recipe_ids
+             if recipe_id in recipes][:limit],
+            many=True
+        ).data)
+
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
@@ -202,23 +400,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def add_delete_favorite(self, request, pk):
         """Метод добавления удаления рецепта в избранное."""
-        recipe = get_object_or_404(Recipe, id=pk)
-        if request.method == 'POST':
-            serializer = FavoriteCreateSerializer(data={
-                'user': request.user,
-                'recipe': recipe.id,
-            })
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not request.user.favorite.filter(recipe=recipe).exists():
-            return Response(
-                'Нет такого рецепта в избранном',
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        favorite = request.user.favorite.filter(recipe=recipe)
-        favorite.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.add_delete_recipe(
+            request, pk, FavoriteCreateSerializer,
+            'Нет такого рецепта в избранном'
+        )
 
     @action(
         methods=['POST', 'DELETE'],
@@ -228,54 +413,215 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def add_delete_shopping_cart(self, request, pk):
         """Метод добавления удаления рецепта в список покупок."""
-        recipe = get_object_or_404(Recipe, id=pk)
+        return self.add_delete_recipe(
+            request, pk, ShoppingCartSerializer,
+            'Нет такого рецепта в корзине'
+        )
+
+    def add_delete_recipe(self, request, pk, serializer_class,
+                          missing_message):
+        """Метод добавления удаления рецепта в избранное или корзину.
+
+        Добавление это INSERT ... ON CONFLICT DO NOTHING, удаление это
+        DELETE ... RETURNING, поэтому повторное нажатие, пришедшее
+        одновременно с первым, получает 400, а не ошибку целостности.
+        Сигналы о связи, по которым меняются счётчики и список покупок,
+        отправляются в той же транзакции, только если связь действительно
+        добавлена или удалена. Счётчики и строки списка покупок лежат в
+        других таблицах и пишутся отдельными запросами тех же обработчиков,
+        что и при изменениях из админки и каскадных удалениях.
+        """
+        try:
+            recipe_id = int(pk)
+        except ValueError:
+            raise Http404
+        manager = serializer_class.Meta.model.objects
         if request.method == 'POST':
-            serializer = ShoppingCartSerializer(data={
-                'user': request.user,
-                'recipe': recipe.id,
-            })
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            recipe = get_object_or_404(self.queryset, id=recipe_id)
+            with transaction.atomic():
+                instance = manager.add(request.user, recipe.id)
+            if instance is None:
+                raise serializer_class.get_unique_error()
             return Response(
-                serializer.data, status=status.HTTP_201_CREATED
+                RecipeMinifiedSerializer(recipe).data,
+                status=status.HTTP_201_CREATED
             )
-        if not request.user.shopping_cart.filter(recipe=recipe).exists():
+        with transaction.atomic():
+            instance = manager.remove(request.user, recipe_id)
+        if instance is None:
+            if not Recipe.objects.filter(id=recipe_id).exists():
+                raise Http404
             return Response(
-                'Нет такого рецепта в корзине',
-                status=status.HTTP_400_BAD_REQUEST
+                missing_message, status=status.HTTP_400_BAD_REQUEST
             )
-        recipe_in_shopping_cart = request.user.shopping_cart.filter(
-            recipe=recipe
-        )
-        recipe_in_shopping_cart.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(IsAuthorOrAdminOnly,),
+        url_path='favorite/batch'
+    )
+    def batch_favorite(self, request):
+        """Метод пакетного добавления удаления рецептов в избранное."""
+        return save_batch(request, FavoriteBatchSerializer)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(IsAuthorOrAdminOnly,),
+        url_path='shopping_cart/batch'
+    )
+    def batch_shopping_cart(self, request):
+        """Метод пакетного добавления удаления рецептов в список покупок."""
+        return save_batch(request, ShoppingCartBatchSerializer)
+
+    @action(
+        methods=['DELETE'],
+        detail=False,
+        permission_classes=(IsAuthorOrAdminOnly,),
+        url_path='shopping_cart/clear'
+    )
+    def clear_shopping_cart(self, request):
+        """Метод очистки списка покупок."""
+        serializer = ShoppingCartBatchSerializer(context={'request': request})
+        return Response(serializer.apply(request.user, []))
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthorOrAdminOnly,),
+        url_path='shopping_cart_summary'
+    )
+    def shopping_cart_summary(self, request):
+        """Метод получения сводного списка покупок."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient')
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response({
+            'recipes_count': request.user.shopping_cart.count(),
+            'ingredients': serializer.data,
+        }, status=status.HTTP_200_OK)
+
     @action(
         methods=['GET'],
         detail=False,
         permission_classes=(IsAuthorOrAdminOnly,),
+        renderer_classes=(
+            ShoppingCartTextRenderer,
+            ShoppingCartCSVRenderer,
+            ShoppingCartJSONRenderer,
+        ),
         url_path='download_shopping_cart'
     )
     def download_shopping_cart(self, request):
-        """Метод позволяющий скачать список покупок."""
-        ingredients = Ingredient.objects.filter(
-            recipes__shopping_cart__user=request.user).annotate(
-            amount=F('ingredient_recipe__amount')
+        """Метод позволяющий скачать список покупок.
+
+        Количество ингредиентов берётся из сводного списка покупок,
+        а файл отдаётся по строкам в формате из параметра format.
+        """
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="Покупки.{renderer.format}"'
+        )
+        return response
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAdminUser,),
+        url_path='export'
+    )
+    def export_recipes(self, request):
+        """Метод потоковой выгрузки рецептов в JSON Lines.
+
+        Изображения не встраиваются в строки: в каждой записи есть адрес
+        файла image_url.
+        """
+        response = StreamingHttpResponse(
+            map(format_record, export_recipes(
+                media_url=request.build_absolute_uri(
+                    django_settings.MEDIA_URL
+                )
+            )),
+            content_type='application/x-ndjson; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{TRANSFER_RECIPES_FILE}"'
         )
-        all_list = {}
-        for ingredient in ingredients:
-            if (
-                f'{ingredient.name} ({ingredient.measurement_unit})'
-            ) in all_list:
-                all_list[
-                    f'{ingredient.name} ({ingredient.measurement_unit})'
-                ] += int(f'{ingredient.amount}')
-            else:
-                all_list[
-                    f'{ingredient.name} ({ingredient.measurement_unit})'
-                ] = int(f'{ingredient.amount}')
-        response = HttpResponse(content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="Покупки.txt"'
-        for key, value in all_list.items():
-            response.write(f'{key.capitalize()} - {value}\n')
         return response
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=(IsAdminUser,),
+        parser_classes=(MultiPartParser,),
+        url_path='import'
+    )
+    def import_recipes(self, request):
+        """Метод потоковой загрузки рецептов из JSON Lines.
+
+        Файл recipes и файлы изображений images передаются формой. После
+        каждой пачки в ответ пишется строка с номером последней
+        обработанной строки файла, с неё загрузку можно продолжить
+        параметром start. Загрузка идёт в воркере веб-сервера, поэтому
+        размер формы и число записей ограничены, большие каталоги
+        загружаются командой import_recipes.
+        """
+        recipes_file = request.FILES.get('recipes')
+        if recipes_file is None:
+            raise ValidationError({'recipes': ['Обязательное поле.']})
+        try:
+            start = int(request.query_params.get('start', 0))
+        except ValueError:
+            raise ValidationError(
+                {'start': ['Требуется целочисленное значение.']}
+            )
+        image_files = request.FILES.getlist('images')
+        upload_size = recipes_file.size + sum(
+            image_file.size for image_file in image_files
+        )
+        records = sum(1 for _ in islice(
+            recipes_file, start, start + TRANSFER_UPLOAD_MAX_RECORDS + 1
+        ))
+        recipes_file.seek(0)
+        if (upload_size > TRANSFER_UPLOAD_MAX_SIZE
+                or records > TRANSFER_UPLOAD_MAX_RECORDS):
+            raise ValidationError({'recipes': [
+                f'Через API загружается не больше '
+                f'{TRANSFER_UPLOAD_MAX_RECORDS} рецептов и '
+                f'{TRANSFER_UPLOAD_MAX_SIZE // 1024 // 1024} МБ файлов, '
+                f'большие каталоги загружаются командой import_recipes.'
+            ]})
+        return StreamingHttpResponse(
+            import_uploaded_recipes(
+                recipes_file, image_files, start,
+                request.query_params.get('author')
+            ),
+            content_type='application/x-ndjson; charset=utf-8'
+        )
+
+
+def metrics_view(request):
+    """Функция выдачи метрик в формате Prometheus по токену."""
+    token = django_settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not token:
+        raise Http404
+    if not hmac.compare_digest(
+        authorization.encode(), f'Bearer {token}'.encode()
+    ):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
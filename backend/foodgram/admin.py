@@ -5,7 +5,7 @@ from foodgram.forms import (RecipeForm, IngredientRecipeForm,
                             TagRecipeForm, SubscriptionForm)
 from foodgram.models import (Profile, Favorite, Ingredient,
                              IngredientRecipe, Recipe, ShoppingCart,
-                             Subscription, Tag, TagRecipe)
+                             ShoppingListItem, Subscription, Tag, TagRecipe)
 
 admin.site.empty_value_display = 'Не задано'
 
@@ -38,7 +38,8 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'name',
         'author',
-        'get_favorite_count',
+        'favorites_count',
+        'shopping_cart_count',
     )
 
     search_fields = ('name', 'author__username')
@@ -63,13 +64,6 @@ class RecipeAdmin(admin.ModelAdmin):
                 raise ValidationError('Ингредиенты должны быть уникальными.')
         formset.save()
 
-    def get_favorite_count(self, obj):
-        """Функция подсчёта колличества избанного у рецепта."""
-        return obj.get_favorite_count()
-
-    get_favorite_count.short_description = 'В избранном'
-    get_favorite_count.admin_order_field = 'get_favorite_count'
-
 
 class IngredientAdmin(admin.ModelAdmin):
     """Настройки админ панели модели Ингредиентов."""
@@ -180,32 +174,15 @@ class ProfileAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'avatar',
-        'recipe_count',
-        'get_subscriptions_count',
-        'get_favorites',
+        'recipes_count',
+        'followers_count',
+        'following_count',
+        'favorites_count',
     )
     search_fields = ('email', 'username')
     list_display_links = ('username',)
     list_filter = (SubscribersFilter, SubscriptionsFilter, RecipesFilter)
 
-    def get_favorites(self, obj):
-        return obj.favorite.count()
-
-    def get_subscriptions_count(self, obj):
-        return obj.subscription.count()
-
-    def recipe_count(self, obj):
-        return obj.recipes.count()
-
-    recipe_count.short_description = 'Количество рецептов'
-    recipe_count.admin_order_field = 'recipe_count'
-
-    get_subscriptions_count.short_description = 'Количество подписок'
-    get_subscriptions_count.admin_order_field = 'get_subscriptions_count'
-
-    get_favorites.short_description = 'Количество избранного'
-    get_favorites.admin_order_field = 'get_favorites'
-
     def save_model(self, request, obj, form, change):
         if not obj.username:
             raise ValidationError('Выберите юзернейм.')
@@ -254,6 +231,20 @@ class ShoppingCartAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    """Настройки админ панели модели сводного Списка покупок."""
+
+    list_display = (
+        'user',
+        'ingredient',
+        'amount',
+    )
+
+    search_fields = ('user__username',)
+    list_display_links = ('user',)
+    readonly_fields = ('user', 'ingredient', 'amount')
+
+
 class SubscriptionAdmin(admin.ModelAdmin):
     """Настройки админ панели модели Подписок."""
 
@@ -314,6 +305,7 @@ admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
 admin.site.register(Subscription, SubscriptionAdmin)
 admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
 admin.site.register(TagRecipe, TagRecipeAdmin)
@@ -14,3 +14,62 @@ MAX_SHORT_URL_LENGTH = 3
 MAX_PAGE_SIZE_IN_REQUEST = 10
 MAX_PAGE_SIZE = 20
 DEFAULT_PAGE_SIZE = 6
+MAX_CURSOR_PAGE_SIZE = 100
+LOAD_BATCH_SIZE = 1000
+LOAD_READ_SIZE = 64 * 1024
+GENERATE_BATCH_SIZE = 5000
+MIN_RECIPE_INGREDIENTS = 3
+MAX_RECIPE_INGREDIENTS = 12
+MAX_RECIPE_TAGS = 3
+ZIPF_EXPONENT = 1.1
+BENCHMARK_ITERATIONS = 30
+BENCHMARK_WARMUP = 3
+BENCHMARK_THRESHOLD = 0.2
+BENCHMARK_BATCH_SIZE = 20
+METRICS_FLUSH_INTERVAL = 5
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+METRICS_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+METRICS_QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+INGREDIENT_INDEX_CHECK_INTERVAL = 1
+INGREDIENT_POPULARITY_TTL = 300
+INGREDIENT_TRIGRAM_THRESHOLD = 0.3
+INGREDIENT_SEARCH_CANDIDATES = 2000
+INGREDIENT_CATALOG_DIR = 'catalog'
+INGREDIENT_CATALOG_KEEP = 2
+RECIPE_MATRIX_CHECK_INTERVAL = 5
+RECIPE_MATRIX_KEEP = 2
+SIMILAR_RECIPES_LIMIT = 10
+MAX_SIMILAR_RECIPES_LIMIT = 50
+SIMILAR_MAX_POSTINGS = 5000
+TRENDING_WINDOW_DAYS = 7
+TRENDING_HALF_LIFE_HOURS = 24
+FAVORITE_RANK_WEIGHT = 1
+SHOPPING_CART_RANK_WEIGHT = 0.5
+RANKING_BATCH_SIZE = 1000
+RECIPE_ORDERINGS = (
+    ('popular', 'Популярные'),
+    ('trending', 'В тренде'),
+)
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+FEED_BACKFILL_SIZE = 50
+FEED_BATCH_SIZE = 1000
+EVENTS_POLL_INTERVAL = 1
+EVENTS_POLL_WINDOW = 30
+EVENTS_POLL_BATCH = 500
+EVENTS_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT_INTERVAL = 15
+EVENTS_IDLE_TIMEOUT = 300
+EVENTS_SEND_TIMEOUT = 10
+EVENTS_MAX_CONNECTIONS = 1000
+EVENTS_RETRY_MS = 5000
+MAX_BATCH_SIZE = 100
+TRANSFER_RECIPES_FILE = 'recipes.jsonl'
+TRANSFER_IMAGES_DIR = 'images'
+TRANSFER_BATCH_SIZE = 500
+TRANSFER_INSERT_SIZE = 1000
+TRANSFER_EXPORT_CHUNK_SIZE = 2000
+TRANSFER_WORKERS = 2
+TRANSFER_UPLOAD_MAX_RECORDS = 1000
+TRANSFER_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
@@ -0,0 +1,82 @@
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from foodgram.models import Favorite, Recipe, ShoppingCart, Subscription
+
+COUNTERS = (
+    (Recipe, 'author', 'recipes_count'),
+    (Favorite, 'recipe', 'favorites_count'),
+    (Favorite, 'user', 'favorites_count'),
+    (ShoppingCart, 'recipe', 'shopping_cart_count'),
+    (Subscription, 'subscription', 'followers_count'),
+    (Subscription, 'user', 'following_count'),
+)
+
+
+def get_counter_value(counter, delta):
+    """Функция получения выражения счётчика, изменённого на delta."""
+    if delta > 0:
+        return F(counter) + delta
+    return Greatest(F(counter) + delta, Value(0))
+
+
+def change_counters(instance, delta):
+    """Функция изменения счётчиков связанных объектов на delta.
+
+    Счётчик меняется одним UPDATE через F(), поэтому одновременные
+    запросы не теряют изменения друг друга. Ниже нуля счётчик не уходит.
+    """
+    for model, field, counter in COUNTERS:
+        if not isinstance(instance, model):
+            continue
+        target = model._meta.get_field(field).related_model
+        target.objects.filter(
+            pk=getattr(instance, f'{field}_id')
+        ).update(**{counter: get_counter_value(counter, delta)})
+
+
+def change_counters_many(instances, delta):
+    """Функция изменения счётчиков после пакетной вставки или удаления.
+
+    Все instances это связи одной модели. Объекты с одинаковым
+    изменением счётчика обновляются одним UPDATE.
+    """
+    if not instances:
+        return
+    for model, field, counter in COUNTERS:
+        if not isinstance(instances[0], model):
+            continue
+        deltas = Counter(
+            getattr(instance, f'{field}_id') for instance in instances
+        )
+        pks_by_delta = {}
+        for pk, count in deltas.items():
+            pks_by_delta.setdefault(count * delta, []).append(pk)
+        target = model._meta.get_field(field).related_model
+        for change, pks in pks_by_delta.items():
+            target.objects.filter(pk__in=pks).update(
+                **{counter: get_counter_value(counter, change)}
+            )
+
+
+def recount_counters(verify=False):
+    """Функция пересчёта всех счётчиков по связям в базе.
+
+    Обновляются только строки с неверным значением, с verify строки
+    лишь считаются. Возвращает {(модель, счётчик): число строк}.
+    """
+    mismatches = {}
+    for model, field, counter in COUNTERS:
+        target = model._meta.get_field(field).related_model
+        actual = Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(count=Count('pk')).values('count')
+        ), 0)
+        wrong = target.objects.exclude(**{counter: actual})
+        mismatches[target._meta.model_name, counter] = (
+            wrong.count() if verify else wrong.update(**{counter: actual})
+        )
+    return mismatches
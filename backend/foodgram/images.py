@@ -0,0 +1,60 @@
+import base64
+import hashlib
+import os
+from io import BytesIO
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+}
+
+
+def decode_image(image, root):
+    """Функция чтения и проверки изображения рецепта.
+
+    image это путь к файлу относительно root или data URI в base64, как
+    в API. Модуль не импортирует модели, поэтому функция выполняется в
+    пуле процессов без настройки Django. Возвращает имя файла по хешу
+    содержимого и содержимое.
+    """
+    if not isinstance(image, str) or not image:
+        raise ValueError('Не указано изображение.')
+    if image.startswith('data:image'):
+        try:
+            content = base64.b64decode(image.split(';base64,', 1)[1])
+        except (IndexError, ValueError):
+            raise ValueError('Некорректное изображение в base64.')
+    else:
+        root = os.path.realpath(root)
+        path = os.path.realpath(os.path.join(root, image))
+        if os.path.commonpath((root, path)) != root:
+            raise ValueError(f'Изображение {image} вне папки выгрузки.')
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+        except OSError:
+            raise ValueError(f'Нет файла изображения {image}.')
+    try:
+        with Image.open(BytesIO(content)) as picture:
+            picture.verify()
+            image_format = picture.format
+    except Exception:
+        raise ValueError(f'Файл {image[:100]} не является изображением.')
+    if image_format not in IMAGE_EXTENSIONS:
+        raise ValueError(f'Формат изображения {image_format} не поддержан.')
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    return f'{digest}.{IMAGE_EXTENSIONS[image_format]}', content
+
+
+def try_decode_image(image, root):
+    """Функция чтения изображения, возвращающая ошибку вместо исключения.
+
+    Так пул процессов отдаёт результаты пачкой, не прерываясь на
+    первом неверном изображении.
+    """
+    try:
+        return decode_image(image, root)
+    except ValueError as error:
+        return error
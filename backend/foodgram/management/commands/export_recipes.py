@@ -0,0 +1,53 @@
+import os
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.constants import (TRANSFER_EXPORT_CHUNK_SIZE,
+                                TRANSFER_IMAGES_DIR, TRANSFER_RECIPES_FILE)
+from foodgram.transfer import export_recipes, format_record
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка рецептов в JSON Lines с изображениями в отдельных файлах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help=(
+                f'Папка выгрузки: {TRANSFER_RECIPES_FILE} и изображения '
+                f'в {TRANSFER_IMAGES_DIR}.'
+            )
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=TRANSFER_EXPORT_CHUNK_SIZE,
+            help='Количество рецептов, читаемых с курсора за раз.'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('Размер пачки должен быть больше нуля.')
+        started = monotonic()
+        images_dir = os.path.join(options['directory'], TRANSFER_IMAGES_DIR)
+        os.makedirs(images_dir, exist_ok=True)
+        count = missing = 0
+        with open(
+            os.path.join(options['directory'], TRANSFER_RECIPES_FILE),
+            'w', encoding='utf-8'
+        ) as file:
+            for record in export_recipes(
+                options['chunk_size'], images_dir=images_dir
+            ):
+                file.write(format_record(record))
+                count += 1
+                missing += record['image'] is None
+                if not count % options['chunk_size']:
+                    self.stdout.write(f'Выгружено рецептов: {count}')
+        if missing:
+            self.stderr.write(f'Рецептов без файла изображения: {missing}')
+        self.stdout.write(
+            f'Выгрузка завершена! Рецептов: {count}, '
+            f'время: {monotonic() - started:.2f} с'
+        )
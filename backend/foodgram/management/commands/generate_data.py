@@ -0,0 +1,217 @@
+import random
+from itertools import accumulate
+from time import monotonic
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from foodgram.constants import (GENERATE_BATCH_SIZE, MAX_RECIPE_INGREDIENTS,
+                                MAX_RECIPE_TAGS, MIN_RECIPE_INGREDIENTS,
+                                ZIPF_EXPONENT)
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Profile,
+                             Recipe, ShoppingCart, Subscription, Tag,
+                             TagRecipe)
+
+
+def zipf_weights(size, exponent=ZIPF_EXPONENT):
+    """Функция накопленных весов распределения Ципфа."""
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)
+    ))
+
+
+def get_next_id(model):
+    """Функция получения первого свободного id модели."""
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Генерация тестовых данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Среднее число избранных рецептов у пользователя.'
+        )
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Среднее число рецептов в корзине пользователя.'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Среднее число подписок пользователя.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=GENERATE_BATCH_SIZE
+        )
+        parser.add_argument('--prefix', default='synthetic')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.tag_ids = list(
+            Tag.objects.order_by('id').values_list('id', flat=True)
+        )
+        if not self.ingredient_ids or not self.tag_ids:
+            raise CommandError(
+                'Нет ингредиентов или тэгов, сначала выполните loadcsv.'
+            )
+        if options['users'] < 1 or self.batch_size < 1:
+            raise CommandError(
+                'Число пользователей и размер пачки должны быть больше нуля.'
+            )
+        started = monotonic()
+        user_ids = self.create_users(options['users'], options['prefix'])
+        recipe_ids = self.create_recipes(options['recipes'], user_ids)
+        self.create_relations(
+            Favorite, 'recipe', user_ids, recipe_ids, options['favorites']
+        )
+        self.create_relations(
+            ShoppingCart, 'recipe', user_ids, recipe_ids, options['carts']
+        )
+        self.create_relations(
+            Subscription, 'subscription', user_ids, user_ids,
+            options['subscriptions']
+        )
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), (Profile, Recipe)
+            ):
+                cursor.execute(sql)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('recount_counters', stdout=self.stdout)
+        call_command('rebuild_timelines', stdout=self.stdout)
+        call_command('rank_recipes', stdout=self.stdout)
+        self.stdout.write(
+            f'Генерация завершена за {monotonic() - started:.2f} с'
+        )
+
+    def bulk_create(self, model, objects):
+        """Метод пакетной вставки объектов."""
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_users(self, count, prefix):
+        """Метод создания пользователей с заранее известными id."""
+        password = make_password(prefix)
+        first_id = get_next_id(Profile)
+        user_ids = list(range(first_id, first_id + count))
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                self.bulk_create(Profile, [
+                    Profile(
+                        id=user_id,
+                        username=f'{prefix}_{user_id}',
+                        email=f'{prefix}_{user_id}@example.com',
+                        first_name='Имя',
+                        last_name='Фамилия',
+                        password=password,
+                    )
+                    for user_id in user_ids[start:start + self.batch_size]
+                ])
+        self.stdout.write(f'Пользователей создано: {count}')
+        return user_ids
+
+    def create_recipes(self, count, user_ids):
+        """Метод создания рецептов с ингредиентами и тэгами."""
+        authors = user_ids[:]
+        self.random.shuffle(authors)
+        author_weights = zipf_weights(len(authors))
+        ingredients = self.ingredient_ids[:]
+        self.random.shuffle(ingredients)
+        ingredient_weights = zipf_weights(len(ingredients))
+        first_id = get_next_id(Recipe)
+        recipe_ids = list(range(first_id, first_id + count))
+        for start in range(0, count, self.batch_size):
+            batch_ids = recipe_ids[start:start + self.batch_size]
+            batch_authors = self.random.choices(
+                authors, cum_weights=author_weights, k=len(batch_ids)
+            )
+            recipes, recipe_ingredients, recipe_tags = [], [], []
+            for recipe_id, author_id in zip(batch_ids, batch_authors):
+                recipes.append(Recipe(
+                    id=recipe_id,
+                    author_id=author_id,
+                    name=f'Рецепт {recipe_id}',
+                    text=f'Описание рецепта {recipe_id}',
+                    cooking_time=self.random.randint(5, 180),
+                    image='recipes/images/synthetic.png',
+                ))
+                chosen_ingredients = set(self.random.choices(
+                    ingredients,
+                    cum_weights=ingredient_weights,
+                    k=self.random.randint(
+                        MIN_RECIPE_INGREDIENTS, MAX_RECIPE_INGREDIENTS
+                    )
+                ))
+                recipe_ingredients += [
+                    IngredientRecipe(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=self.random.randint(1, 500),
+                    )
+                    for ingredient_id in sorted(chosen_ingredients)
+                ]
+                recipe_tags += [
+                    TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+                    for tag_id in sorted(self.random.sample(
+                        self.tag_ids,
+                        self.random.randint(
+                            1, min(MAX_RECIPE_TAGS, len(self.tag_ids))
+                        )
+                    ))
+                ]
+            with transaction.atomic():
+                self.bulk_create(Recipe, recipes)
+                self.bulk_create(IngredientRecipe, recipe_ingredients)
+                self.bulk_create(TagRecipe, recipe_tags)
+            self.stdout.write(
+                f'Рецептов создано: {start + len(batch_ids)} из {count}'
+            )
+        return recipe_ids
+
+    def create_relations(self, model, target_field, user_ids, target_ids,
+                         average):
+        """Метод создания связей пользователей с популярными объектами.
+
+        Число связей у пользователя и выбор объектов подчиняются
+        распределению Ципфа, поэтому немногие объекты очень популярны.
+        """
+        if not target_ids or average < 1:
+            return
+        targets = target_ids[:]
+        self.random.shuffle(targets)
+        target_weights = zipf_weights(len(targets))
+        objects = []
+        created = 0
+        for user_id in user_ids:
+            count = min(
+                int(self.random.expovariate(1 / average)), len(targets)
+            )
+            chosen = set(self.random.choices(
+                targets, cum_weights=target_weights, k=count
+            ))
+            if target_field == 'subscription':
+                chosen.discard(user_id)
+            objects += [
+                model(user_id=user_id, **{f'{target_field}_id': target_id})
+                for target_id in sorted(chosen)
+            ]
+            if len(objects) >= self.batch_size:
+                self.bulk_create(model, objects)
+                created += len(objects)
+                objects = []
+        self.bulk_create(model, objects)
+        created += len(objects)
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: создано {created}'
+        )
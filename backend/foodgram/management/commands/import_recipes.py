@@ -0,0 +1,105 @@
+import os
+import tempfile
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.constants import (TRANSFER_BATCH_SIZE, TRANSFER_INSERT_SIZE,
+                                TRANSFER_RECIPES_FILE, TRANSFER_WORKERS)
+from foodgram.transfer import RecipeImporter
+
+
+def read_checkpoint(path):
+    """Функция чтения номера последней загруженной строки."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            return int(file.read())
+    except FileNotFoundError:
+        return 0
+    except ValueError:
+        raise CommandError(f'Повреждён файл {path}, используйте --restart.')
+
+
+def write_checkpoint(path, line):
+    """Функция атомарной записи номера последней загруженной строки."""
+    with tempfile.NamedTemporaryFile(
+        'w', dir=os.path.dirname(path), delete=False, suffix='.tmp'
+    ) as file:
+        file.write(str(line))
+    os.replace(file.name, path)
+
+
+class Command(BaseCommand):
+    help = 'Загрузка рецептов из выгрузки JSON Lines с изображениями'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help=f'Папка выгрузки с {TRANSFER_RECIPES_FILE} и изображениями.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=TRANSFER_BATCH_SIZE,
+            help='Количество рецептов в одной транзакции.'
+        )
+        parser.add_argument(
+            '--insert-size',
+            type=int,
+            default=TRANSFER_INSERT_SIZE,
+            help='Количество строк в одной пакетной вставке.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=TRANSFER_WORKERS,
+            help='Процессов для чтения изображений, 0 без пула.'
+        )
+        parser.add_argument(
+            '--author',
+            help='Пользователь для рецептов, автора которых нет в базе.'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать сначала, не продолжая с сохранённой строки.'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['insert_size'] < 1:
+            raise CommandError('Размер пачки должен быть больше нуля.')
+        if options['workers'] < 0:
+            raise CommandError('Число процессов не может быть меньше нуля.')
+        path = os.path.join(options['directory'], TRANSFER_RECIPES_FILE)
+        checkpoint = f'{path}.checkpoint'
+        start = 0 if options['restart'] else read_checkpoint(checkpoint)
+        if start:
+            self.stdout.write(f'Продолжение загрузки после строки {start}')
+        importer = RecipeImporter(
+            options['directory'],
+            batch_size=options['batch_size'],
+            insert_size=options['insert_size'],
+            workers=options['workers'],
+            default_author=options['author'],
+        )
+        started = monotonic()
+        created = errors = 0
+        with open(path, encoding='utf-8') as file:
+            for progress in importer.run(file, start):
+                write_checkpoint(checkpoint, progress['line'])
+                created += progress['created']
+                errors += len(progress['errors'])
+                for error in progress['errors']:
+                    self.stderr.write(
+                        f'Строка {error["line"]}: {error["error"]}'
+                    )
+                self.stdout.write(
+                    f'Обработано строк: {progress["line"]}, '
+                    f'загружено рецептов: {created}'
+                )
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(
+            f'Загрузка завершена! Рецептов: {created}, ошибок: {errors}, '
+            f'время: {monotonic() - started:.2f} с'
+        )
@@ -1,44 +1,173 @@
+import csv
+import io
+import json
 import os
-from csv import reader
+from itertools import islice
+from time import monotonic
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from foodgram_backend.settings import BASE_DIR
 
+from foodgram.constants import LOAD_BATCH_SIZE, LOAD_READ_SIZE
 from foodgram.models import Ingredient, Tag
+from foodgram.signals import ingredients_loaded
 
+models_fields = (
+    ('ingredients', Ingredient, ('name', 'measurement_unit')),
+    ('tags', Tag, ('name', 'slug')),
+)
+
+
+def read_csv(file, fields):
+    """Функция построчного чтения CSV файла.
+
+    Пустые строки и строка заголовка пропускаются.
+    """
+    for row in csv.reader(file):
+        row = tuple(value.strip() for value in row)
+        if len(row) != len(fields) or row == fields:
+            continue
+        yield row
+
+
+def read_json(file, fields):
+    """Функция потокового чтения массива объектов JSON по частям."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    while True:
+        chunk = file.read(LOAD_READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in '[, \t\r\n':
+                position += 1
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield tuple(str(item[field]).strip() for field in fields)
+        if not chunk:
+            return
 
-def load_ingredients(row):
-    """Метод создания таблицы ингредиентов."""
-    Ingredient.objects.get_or_create(
-        name=row[0],
-        measurement_unit=row[1]
-    )
 
+readers = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
-def load_tags(row):
-    """Метод создания таблицы тэгов."""
-    Tag.objects.get_or_create(
-        name=row[0],
-        slug=row[1]
+
+def chunked(rows, size):
+    """Функция разбиения строк на пачки заданного размера."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_load(model, fields, chunk):
+    """Функция загрузки пачки строк пакетной вставкой."""
+    model.objects.bulk_create(
+        (model(**dict(zip(fields, row))) for row in chunk),
+        ignore_conflicts=True
     )
 
 
-files_functions = (
-    ('ingredients.csv', load_ingredients),
-    ('tags.csv', load_tags),
-)
+def copy_load(model, fields, chunk):
+    """Функция загрузки пачки строк через COPY в PostgreSQL."""
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ', '.join(
+        quote_name(model._meta.get_field(field).column) for field in fields
+    )
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE load_rows '
+            f'ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY load_rows ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT DISTINCT {columns} FROM load_rows '
+            'ON CONFLICT DO NOTHING'
+        )
 
 
 class Command(BaseCommand):
     help = 'Начало загрузки файлов'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=tuple(readers),
+            default='csv',
+            help='Формат файлов с данными в папке data.'
+        )
+        parser.add_argument(
+            '--ingredients',
+            help='Путь к файлу ингредиентов вместо файла из папки data.'
+        )
+        parser.add_argument(
+            '--tags',
+            help='Путь к файлу тэгов вместо файла из папки data.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=LOAD_BATCH_SIZE,
+            help='Количество строк в одной пачке вставки.'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загружать через COPY (только PostgreSQL).'
+        )
+
     def handle(self, *args, **options):
-        for file, function in files_functions:
-            file_path = os.path.join(BASE_DIR, "data", file)
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть больше нуля.')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('Загрузка через COPY требует PostgreSQL.')
+        load = copy_load if options['copy'] else bulk_load
+        started = monotonic()
+        for name, model, fields in models_fields:
+            file_path = options[name] or os.path.join(
+                BASE_DIR, 'data', f'{name}.{options["format"]}'
+            )
+            file_format = os.path.splitext(file_path)[1].lstrip('.')
+            if file_format not in readers:
+                raise CommandError(f'Неизвестный формат файла {file_path}.')
+            file_started = monotonic()
+            rows_count = 0
+            objects_count = model.objects.count()
             with open(file_path, 'r', encoding='utf-8') as current_file:
-                content = reader(current_file)
-                next(content)
-                for row in content:
-                    function(row)
-            self.stdout.write(f'{file} загружен!')
-        self.stdout.write('Загрузка завершена')
+                rows = readers[file_format](current_file, fields)
+                for chunk in chunked(rows, options['batch_size']):
+                    load(model, fields, chunk)
+                    rows_count += len(chunk)
+                    self.stdout.write(
+                        f'{os.path.basename(file_path)}: '
+                        f'обработано строк {rows_count}'
+                    )
+            self.stdout.write(
+                f'{os.path.basename(file_path)} загружен! '
+                f'Строк: {rows_count}, добавлено: '
+                f'{model.objects.count() - objects_count}, '
+                f'время: {monotonic() - file_started:.2f} с'
+            )
+        ingredients_loaded.send(sender=Ingredient)
+        self.stdout.write(
+            f'Загрузка завершена за {monotonic() - started:.2f} с'
+        )
@@ -0,0 +1,134 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import (Count, DateTimeField, F, FloatField, Func,
+                              OuterRef, Q, Subquery, Sum, Value)
+from django.db.models.functions import Coalesce, Power
+from django.utils import timezone
+
+from foodgram.constants import (FAVORITE_RANK_WEIGHT, RANKING_BATCH_SIZE,
+                                SHOPPING_CART_RANK_WEIGHT,
+                                TRENDING_HALF_LIFE_HOURS,
+                                TRENDING_WINDOW_DAYS)
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             RecipeRanking, ShoppingCart)
+
+RANKED_MODELS = (
+    (Favorite, FAVORITE_RANK_WEIGHT),
+    (ShoppingCart, SHOPPING_CART_RANK_WEIGHT),
+)
+
+
+class HoursSince(Func):
+    """Выражение числа часов от даты в столбце до момента now."""
+
+    template = 'EXTRACT(EPOCH FROM (%(expressions)s)) / 3600'
+    arg_joiner = ' - '
+    output_field = FloatField()
+
+    def __init__(self, expression, now):
+        super().__init__(
+            Value(now, output_field=DateTimeField()), expression
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        """Метод SQL для SQLite через julianday."""
+        return self.as_sql(
+            compiler, connection,
+            template='(julianday(%(expressions)s)) * 24',
+            arg_joiner=') - julianday(', **extra_context
+        )
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт популярности и тренда рецептов, популярности ингредиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window-days',
+            type=int,
+            default=TRENDING_WINDOW_DAYS,
+            help='Окно в днях, за которое считается тренд.'
+        )
+        parser.add_argument(
+            '--half-life-hours',
+            type=float,
+            default=TRENDING_HALF_LIFE_HOURS,
+            help='Через сколько часов вклад добавления в тренд вдвое меньше.'
+        )
+
+    def handle(self, *args, **options):
+        if options['window_days'] < 1 or options['half_life_hours'] <= 0:
+            raise CommandError('Окно и период полураспада должны быть > 0.')
+        popular, trending = self.get_scores(
+            timezone.now(), options['window_days'],
+            options['half_life_hours']
+        )
+        with transaction.atomic():
+            RecipeRanking.objects.bulk_create(
+                (
+                    RecipeRanking(recipe_id=recipe_id)
+                    for recipe_id in Recipe.objects.filter(
+                        ranking__isnull=True
+                    ).values_list('id', flat=True).iterator()
+                ),
+                batch_size=RANKING_BATCH_SIZE,
+                ignore_conflicts=True
+            )
+            changed = RecipeRanking.objects.alias(
+                new_popular=popular, new_trending=trending
+            ).filter(
+                ~Q(popular_score=F('new_popular'))
+                | ~Q(trending_score=F('new_trending'))
+            ).update(popular_score=popular, trending_score=trending)
+        self.stdout.write(f'Рейтинги пересчитаны, изменено: {changed}')
+        changed = self.rank_ingredients()
+        self.stdout.write(
+            f'Популярность ингредиентов пересчитана, изменено: {changed}'
+        )
+
+    def rank_ingredients(self):
+        """Метод пересчёта числа рецептов с каждым ингредиентом.
+
+        Ранжированный поиск ингредиентов сортирует по этому числу, не
+        считая его на каждый запрос. Одним UPDATE обновляются только
+        изменившиеся строки.
+        """
+        popularity = Coalesce(Subquery(
+            IngredientRecipe.objects.filter(
+                ingredient_id=OuterRef('id')
+            ).order_by().values('ingredient_id').annotate(
+                count=Count('id')
+            ).values('count')
+        ), 0)
+        return Ingredient.objects.alias(new_popularity=popularity).exclude(
+            popularity=F('new_popularity')
+        ).update(popularity=popularity)
+
+    def get_scores(self, now, window_days, half_life_hours):
+        """Метод получения SQL выражений популярности и тренда рецепта.
+
+        Популярность это взвешенное число добавлений в избранное и в
+        корзину за всё время. Тренд это те же добавления за окно, вклад
+        каждого убывает вдвое за half_life_hours. Суммы считает база
+        коррелированными подзапросами по строке рейтинга.
+        """
+        since = now - timedelta(days=window_days)
+        popular, trending = [], []
+        for model, weight in RANKED_MODELS:
+            relations = model.objects.filter(
+                recipe_id=OuterRef('recipe_id')
+            ).order_by().values('recipe_id')
+            popular.append(Coalesce(Subquery(relations.annotate(
+                score=Sum(Value(float(weight)), output_field=FloatField())
+            ).values('score')), 0.0))
+            trending.append(Coalesce(Subquery(relations.filter(
+                created__gte=since
+            ).annotate(score=Sum(
+                Value(float(weight)) * Power(
+                    0.5, HoursSince('created', now) / half_life_hours
+                ),
+                output_field=FloatField()
+            )).values('score')), 0.0))
+        return sum(popular[1:], popular[0]), sum(trending[1:], trending[0])
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from foodgram.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт сводных списков покупок по корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить списки покупок, не изменяя их.'
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.compute().iterator()
+        }
+        if options['verify']:
+            stored = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'amount'
+                ).order_by().iterator()
+            }
+            mismatches = [
+                key for key in expected.keys() | stored.keys()
+                if expected.get(key) != stored.get(key)
+            ]
+            for user_id, ingredient_id in sorted(mismatches):
+                self.stdout.write(
+                    f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                    f'ожидалось {expected.get((user_id, ingredient_id))}, '
+                    f'сохранено {stored.get((user_id, ingredient_id))}'
+                )
+            if mismatches:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {len(mismatches)}'
+                )
+            self.stdout.write('Списки покупок совпадают с корзинами')
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount
+                    )
+                    for (user_id, ingredient_id), amount in expected.items()
+                ),
+                batch_size=1000
+            )
+        self.stdout.write(
+            f'Списки покупок пересчитаны, строк: {len(expected)}'
+        )
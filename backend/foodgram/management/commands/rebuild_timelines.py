@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from foodgram.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересборка лент подписок по подпискам и рецептам'
+
+    def handle(self, *args, **options):
+        count = TimelineEntry.objects.rebuild()
+        self.stdout.write(f'Ленты подписок пересобраны, записей: {count}')
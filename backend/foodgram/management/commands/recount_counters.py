@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from foodgram.counters import recount_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков рецептов и пользователей по связям'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить счётчики, не изменяя их.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            mismatches = recount_counters(verify=options['verify'])
+        for (model_name, counter), count in mismatches.items():
+            if count:
+                self.stdout.write(f'{model_name}.{counter}: строк {count}')
+        total = sum(mismatches.values())
+        if options['verify']:
+            if total:
+                raise CommandError(f'Расхождений в счётчиках: {total}')
+            self.stdout.write('Счётчики совпадают со связями')
+            return
+        self.stdout.write(f'Счётчики пересчитаны, исправлено строк: {total}')
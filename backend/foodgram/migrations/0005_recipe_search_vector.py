@@ -0,0 +1,62 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:09
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce({row}text, '')), 'B')"
+)
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE OR REPLACE FUNCTION foodgram_recipe_search_vector() '
+        'RETURNS trigger AS $$ BEGIN '
+        f'NEW.search_vector := {SEARCH_VECTOR_SQL.format(row="NEW.")}; '
+        'RETURN NEW; END $$ LANGUAGE plpgsql'
+    )
+    schema_editor.execute(
+        'CREATE TRIGGER recipe_search_vector_update '
+        'BEFORE INSERT OR UPDATE OF name, text ON foodgram_recipe '
+        'FOR EACH ROW EXECUTE FUNCTION foodgram_recipe_search_vector()'
+    )
+    schema_editor.execute(
+        'UPDATE foodgram_recipe SET search_vector = '
+        f'{SEARCH_VECTOR_SQL.format(row="")}'
+    )
+    schema_editor.execute(
+        'CREATE INDEX recipe_search_vector_idx '
+        'ON foodgram_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipe_search_vector_update '
+        'ON foodgram_recipe'
+    )
+    schema_editor.execute(
+        'DROP FUNCTION IF EXISTS foodgram_recipe_search_vector()'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0004_ingredient_name_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:11
+
+import django.contrib.postgres.fields
+from django.contrib.postgres.operations import CreateExtension
+from django.db import migrations, models
+import django.db.models.deletion
+
+REFRESH_SQL = '''
+DELETE FROM foodgram_recipeingredientindex
+WHERE recipe_id IN (SELECT recipe_id FROM changed_rows)
+  AND NOT EXISTS (
+    SELECT 1 FROM foodgram_ingredientrecipe
+    WHERE foodgram_ingredientrecipe.recipe_id
+      = foodgram_recipeingredientindex.recipe_id
+  );
+INSERT INTO foodgram_recipeingredientindex (recipe_id, ingredient_ids)
+SELECT recipe_id, array_agg(DISTINCT ingredient_id::int ORDER BY ingredient_id::int)
+FROM foodgram_ingredientrecipe
+WHERE recipe_id IN (SELECT recipe_id FROM changed_rows)
+GROUP BY recipe_id
+ON CONFLICT (recipe_id) DO UPDATE SET ingredient_ids = EXCLUDED.ingredient_ids;
+'''
+
+TRIGGERS = (
+    ('insert', 'INSERT', 'NEW'),
+    ('update', 'UPDATE', 'NEW'),
+    ('delete', 'DELETE', 'OLD'),
+)
+
+
+def create_index_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE OR REPLACE FUNCTION foodgram_recipe_ingredient_index() '
+        f'RETURNS trigger AS $$ BEGIN {REFRESH_SQL} RETURN NULL; END $$ '
+        'LANGUAGE plpgsql'
+    )
+    for name, event, table in TRIGGERS:
+        schema_editor.execute(
+            f'CREATE TRIGGER recipe_ingredient_index_{name} '
+            f'AFTER {event} ON foodgram_ingredientrecipe '
+            f'REFERENCING {table} TABLE AS changed_rows '
+            'FOR EACH STATEMENT '
+            'EXECUTE FUNCTION foodgram_recipe_ingredient_index()'
+        )
+    schema_editor.execute(
+        'INSERT INTO foodgram_recipeingredientindex '
+        '(recipe_id, ingredient_ids) '
+        'SELECT recipe_id, '
+        'array_agg(DISTINCT ingredient_id::int ORDER BY ingredient_id::int) '
+        'FROM foodgram_ingredientrecipe GROUP BY recipe_id'
+    )
+    schema_editor.execute(
+        'CREATE INDEX recipe_ingredient_ids_idx '
+        'ON foodgram_recipeingredientindex '
+        'USING gin (ingredient_ids gin__int_ops)'
+    )
+
+
+def drop_index_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGGERS:
+        schema_editor.execute(
+            f'DROP TRIGGER IF EXISTS recipe_ingredient_index_{name} '
+            'ON foodgram_ingredientrecipe'
+        )
+    schema_editor.execute(
+        'DROP FUNCTION IF EXISTS foodgram_recipe_ingredient_index()'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0005_recipe_search_vector'),
+    ]
+
+    operations = [
+        CreateExtension('intarray'),
+        migrations.CreateModel(
+            name='RecipeIngredientIndex',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ingredient_index', serialize=False, to='foodgram.recipe')),
+                ('ingredient_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'verbose_name': 'Индекс ингредиентов рецепта',
+                'verbose_name_plural': 'Индекс ингредиентов рецептов',
+            },
+        ),
+        migrations.RunPython(create_index_triggers, drop_index_triggers),
+    ]
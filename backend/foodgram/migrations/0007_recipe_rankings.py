@@ -0,0 +1,60 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+BACKFILL_SQL = (
+    'INSERT INTO foodgram_reciperanking '
+    '(recipe_id, popular_score, trending_score) '
+    'SELECT id, 0, 0 FROM foodgram_recipe',
+    'UPDATE foodgram_favorite SET created = ('
+    'SELECT created FROM foodgram_recipe '
+    'WHERE foodgram_recipe.id = foodgram_favorite.recipe_id)',
+    'UPDATE foodgram_shoppingcart SET created = ('
+    'SELECT created FROM foodgram_recipe '
+    'WHERE foodgram_recipe.id = foodgram_shoppingcart.recipe_id)',
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0006_recipeingredientindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRanking',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='foodgram.recipe')),
+                ('popular_score', models.FloatField(default=0)),
+                ('trending_score', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['-popular_score', '-recipe'], name='ranking_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reciperanking',
+            index=models.Index(fields=['-trending_score', '-recipe'], name='ranking_trending_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
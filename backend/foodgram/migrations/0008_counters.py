@@ -0,0 +1,66 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Recipe', 'author', 'recipes_count'),
+    ('Favorite', 'recipe', 'favorites_count'),
+    ('Favorite', 'user', 'favorites_count'),
+    ('ShoppingCart', 'recipe', 'shopping_cart_count'),
+    ('Subscription', 'subscription', 'followers_count'),
+    ('Subscription', 'user', 'following_count'),
+)
+
+
+def backfill_counters(apps, schema_editor):
+    for model_name, field, counter in COUNTERS:
+        model = apps.get_model('foodgram', model_name)
+        target = model._meta.get_field(field).related_model
+        target.objects.update(**{counter: Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(count=Count('pk')).values('count')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0007_recipe_rankings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество избранного'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_popularity(apps, schema_editor):
+    Ingredient = apps.get_model('foodgram', 'Ingredient')
+    IngredientRecipe = apps.get_model('foodgram', 'IngredientRecipe')
+    Ingredient.objects.update(popularity=Coalesce(Subquery(
+        IngredientRecipe.objects.filter(
+            ingredient=OuterRef('pk')
+        ).order_by().values('ingredient').annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0009_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='popularity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.RunPython(backfill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:30
+
+from django.db import migrations
+
+UPDATE_FUNCTION_SQL = '''
+CREATE OR REPLACE FUNCTION foodgram_recipe_ingredient_index_update()
+RETURNS trigger AS $$ BEGIN
+DELETE FROM foodgram_recipeingredientindex
+WHERE recipe_id IN (
+    SELECT recipe_id FROM old_rows UNION SELECT recipe_id FROM new_rows
+  )
+  AND NOT EXISTS (
+    SELECT 1 FROM foodgram_ingredientrecipe
+    WHERE foodgram_ingredientrecipe.recipe_id
+      = foodgram_recipeingredientindex.recipe_id
+  );
+INSERT INTO foodgram_recipeingredientindex (recipe_id, ingredient_ids)
+SELECT recipe_id, array_agg(DISTINCT ingredient_id::int ORDER BY ingredient_id::int)
+FROM foodgram_ingredientrecipe
+WHERE recipe_id IN (
+    SELECT recipe_id FROM old_rows UNION SELECT recipe_id FROM new_rows
+  )
+GROUP BY recipe_id
+ON CONFLICT (recipe_id) DO UPDATE SET ingredient_ids = EXCLUDED.ingredient_ids;
+RETURN NULL;
+END $$ LANGUAGE plpgsql
+'''
+
+
+def create_update_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(UPDATE_FUNCTION_SQL)
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipe_ingredient_index_update '
+        'ON foodgram_ingredientrecipe'
+    )
+    schema_editor.execute(
+        'CREATE TRIGGER recipe_ingredient_index_update '
+        'AFTER UPDATE ON foodgram_ingredientrecipe '
+        'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+        'FOR EACH STATEMENT '
+        'EXECUTE FUNCTION foodgram_recipe_ingredient_index_update()'
+    )
+
+
+def restore_update_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipe_ingredient_index_update '
+        'ON foodgram_ingredientrecipe'
+    )
+    schema_editor.execute(
+        'DROP FUNCTION IF EXISTS foodgram_recipe_ingredient_index_update()'
+    )
+    schema_editor.execute(
+        'CREATE TRIGGER recipe_ingredient_index_update '
+        'AFTER UPDATE ON foodgram_ingredientrecipe '
+        'REFERENCING NEW TABLE AS changed_rows '
+        'FOR EACH STATEMENT '
+        'EXECUTE FUNCTION foodgram_recipe_ingredient_index()'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0010_ingredient_popularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_update_trigger, restore_update_trigger),
+    ]
@@ -1,15 +1,20 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (FileExtensionValidator, MaxValueValidator,
                                     MinValueValidator)
-from django.db import models
-from django.db.models import Q
+from django.db import connections, models, transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.db.models.signals import post_delete, post_save
 
 from foodgram.constants import (MAX_COOKING_TIME_SCORE, MAX_EMAIL_LENGTH,
                                 MAX_FIRST_NAME_LENGTH, MAX_INGREDIENT_LENGTH,
                                 MAX_LAST_NAME_LENGTH, MAX_PASSWORD_LENGTH,
                                 MAX_RECIPE_LENGTH, MAX_TAG_LENGTH,
                                 MAX_USERNAME_LENGTH, MIN_COOKING_TIME_SCORE,
-                                MAX_AMOUNT_VALUE, MIN_AMOUNT_VALUE)
+                                MAX_AMOUNT_VALUE, MIN_AMOUNT_VALUE,
+                                FEED_BACKFILL_SIZE, FEED_BATCH_SIZE,
+                                FEED_FANOUT_MAX_FOLLOWERS)
 from foodgram.validators import validate_username
 
 
@@ -48,6 +53,26 @@ class Profile(AbstractUser):
         null=True,
         validators=[FileExtensionValidator(allowed_extensions=['jpg', 'png'])]
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписок',
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество избранного',
+    )
 
     class Meta:
         """Метаданные модели группы."""
@@ -110,6 +135,11 @@ class Ingredient(models.Model):
         max_length=MAX_INGREDIENT_LENGTH,
         verbose_name='Единица измерения'
     )
+    popularity = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов',
+    )
 
     class Meta:
         """Метаданные модели группы."""
@@ -159,6 +189,21 @@ class Recipe(models.Model):
         verbose_name='Дата создания',
         auto_now_add=True,
     )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
 
     class Meta:
         """Метаданные модели группы."""
@@ -166,6 +211,11 @@ class Recipe(models.Model):
         ordering = ['-created']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-created', '-id'), name='recipe_created_id_idx'
+            ),
+        ]
 
     def __str__(self):
         """Возвращает строковое представление объекта."""
@@ -173,7 +223,7 @@ class Recipe(models.Model):
 
     def get_favorite_count(self):
         """Функция подсчёта колличества избанного у рецепта."""
-        return self.favorite.count()
+        return self.favorites_count
 
 
 class TagRecipe(models.Model):
@@ -200,6 +250,30 @@ class TagRecipe(models.Model):
         return f'{self.tag} {self.recipe}'
 
 
+class IngredientRecipeManager(models.Manager):
+    """Менеджер ингредиентов рецепта."""
+
+    def delete_rows(self, ids):
+        """Метод удаления строк одним DELETE ... WHERE id IN.
+
+        Сигналы не отправляются, как при bulk_create и bulk_update, списки
+        покупок обновляет вызывающий код. Возвращает число строк.
+        """
+        if not ids:
+            return 0
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        meta = self.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote_name(meta.db_table)} '
+                f'WHERE {quote_name(meta.pk.column)} IN '
+                f'({", ".join(["%s"] * len(ids))})',
+                list(ids)
+            )
+            return cursor.rowcount
+
+
 class IngredientRecipe(models.Model):
     """Настройки модели Ингредиентов Рецепта."""
 
@@ -219,6 +293,8 @@ class IngredientRecipe(models.Model):
         ],
     )
 
+    objects = IngredientRecipeManager()
+
     class Meta:
         """Метаданные модели Избранное."""
 
@@ -231,6 +307,140 @@ class IngredientRecipe(models.Model):
         return f'{self.ingredient} {self.recipe}'
 
 
+class UserRelationManager(models.Manager):
+    """Менеджер связей пользователя: избранного, корзины и подписок.
+
+    Добавление и удаление выполняются одним запросом без гонок между
+    проверкой и записью: INSERT ... ON CONFLICT DO NOTHING RETURNING и
+    DELETE ... RETURNING. Пакетные add_many и remove_many, как
+    bulk_create, сигналов не отправляют. add и remove отправляют
+    post_save и post_delete как save() и delete(), поэтому счётчики
+    обновляются так же.
+    """
+
+    @property
+    def target_field(self):
+        """Имя поля второй стороны связи."""
+        return next(
+            field.name for field in self.model._meta.concrete_fields
+            if field.is_relation and field.name != 'user'
+        )
+
+    def get_identifiers(self, connection):
+        """Метод получения экранированных имён таблицы и столбцов связи.
+
+        Возвращает таблицу, первичный ключ, столбец пользователя и столбец
+        второй стороны связи.
+        """
+        quote_name = connection.ops.quote_name
+        meta = self.model._meta
+        return (
+            quote_name(meta.db_table),
+            quote_name(meta.pk.column),
+            quote_name(meta.get_field('user').column),
+            quote_name(meta.get_field(self.target_field).column),
+        )
+
+    def add_many(self, user, target_ids):
+        """Метод добавления связей пользователя с target_ids без дублей.
+
+        Возвращает созданные объекты, уже существующие связи пропускаются.
+        """
+        meta = self.model._meta
+        instances = {
+            target_id: self.model(user=user, **{
+                meta.get_field(self.target_field).attname: target_id
+            })
+            for target_id in target_ids
+        }
+        if not instances:
+            return []
+        connection = connections[self.db]
+        table, pk_column, _, target_column = self.get_identifiers(connection)
+        fields = [
+            field for field in meta.concrete_fields if not field.primary_key
+        ]
+        columns = ', '.join(
+            connection.ops.quote_name(field.column) for field in fields
+        )
+        placeholders = f'({", ".join(["%s"] * len(fields))})'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'VALUES {", ".join([placeholders] * len(instances))} '
+                f'ON CONFLICT DO NOTHING RETURNING {pk_column}, '
+                f'{target_column}',
+                [
+                    field.get_db_prep_save(
+                        field.pre_save(instance, True), connection
+                    )
+                    for instance in instances.values()
+                    for field in fields
+                ]
+            )
+            rows = cursor.fetchall()
+        created = []
+        for pk, target_id in rows:
+            instance = instances[target_id]
+            instance.pk = pk
+            instance._state.adding = False
+            instance._state.db = self.db
+            created.append(instance)
+        return created
+
+    def remove_many(self, user, target_ids=None):
+        """Метод удаления связей пользователя с target_ids.
+
+        Без target_ids удаляются все связи пользователя. Возвращает
+        удалённые объекты.
+        """
+        if target_ids is not None and not target_ids:
+            return []
+        connection = connections[self.db]
+        table, pk_column, user_column, target_column = self.get_identifiers(
+            connection
+        )
+        sql = f'DELETE FROM {table} WHERE {user_column} = %s'
+        params = [user.id]
+        if target_ids is not None:
+            sql += (
+                f' AND {target_column} IN '
+                f'({", ".join(["%s"] * len(target_ids))})'
+            )
+            params += target_ids
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{sql} RETURNING {pk_column}, {target_column}', params
+            )
+            rows = cursor.fetchall()
+        meta = self.model._meta
+        return [
+            self.model(pk=pk, user=user, **{
+                meta.get_field(self.target_field).attname: target_id
+            })
+            for pk, target_id in rows
+        ]
+
+    def add(self, user, target_id):
+        """Метод добавления связи, возвращает None, если она уже есть."""
+        for instance in self.add_many(user, [target_id]):
+            post_save.send(
+                sender=self.model, instance=instance, created=True,
+                update_fields=None, raw=False, using=self.db
+            )
+            return instance
+        return None
+
+    def remove(self, user, target_id):
+        """Метод удаления связи, возвращает None, если её не было."""
+        for instance in self.remove_many(user, [target_id]):
+            post_delete.send(
+                sender=self.model, instance=instance, using=self.db
+            )
+            return instance
+        return None
+
+
 class Favorite(models.Model):
     """Настройки модели Избранное."""
 
@@ -240,6 +450,13 @@ class Favorite(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, related_name='favorite'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    objects = UserRelationManager()
 
     class Meta:
         """Метаданные модели Избранное."""
@@ -268,6 +485,13 @@ class ShoppingCart(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, related_name='shopping_cart'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    objects = UserRelationManager()
 
     class Meta:
         """Метаданные модели Список покупок."""
@@ -295,6 +519,8 @@ class Subscription(models.Model):
     subscription = models.ForeignKey(
         Profile, on_delete=models.CASCADE, related_name='subscription')
 
+    objects = UserRelationManager()
+
     class Meta:
         """Метаданные модели подписок."""
 
@@ -315,3 +541,384 @@ class Subscription(models.Model):
     def __str__(self):
         """Возвращает строковое представление объекта."""
         return f'{self.user} {self.subscription}'
+
+
+class ShoppingListManager(models.Manager):
+    """Менеджер сводного списка покупок.
+
+    Строки списка обновляются на разницу количества ингредиентов
+    при добавлении, удалении и изменении рецептов в корзине. Одиночные
+    сохранения и удаления корзины и ингредиентов рецепта, в том числе
+    каскадные и из админки, применяются сигналами, пакетные операции
+    вызывают методы менеджера сами.
+    """
+
+    def apply_deltas(self, deltas):
+        """Метод применения разницы {(user_id, ingredient_id): amount}."""
+        deltas = {key: amount for key, amount in deltas.items() if amount}
+        if not deltas:
+            return
+        user_ids = {user_id for user_id, ingredient_id in deltas}
+        ingredient_ids = {ingredient_id for user_id, ingredient_id in deltas}
+        with transaction.atomic():
+            list(
+                Profile.objects.select_for_update()
+                .filter(id__in=user_ids).values_list('id', flat=True)
+            )
+            items = {
+                (item.user_id, item.ingredient_id): item
+                for item in self.filter(
+                    user_id__in=user_ids, ingredient_id__in=ingredient_ids
+                )
+            }
+            new_items, changed_items, empty_items = [], [], []
+            for (user_id, ingredient_id), amount in deltas.items():
+                item = items.get((user_id, ingredient_id))
+                if item is None:
+                    if amount > 0:
+                        new_items.append(self.model(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            amount=amount
+                        ))
+                    continue
+                item.amount += amount
+                if item.amount > 0:
+                    changed_items.append(item)
+                else:
+                    empty_items.append(item.id)
+            self.bulk_create(new_items)
+            self.bulk_update(changed_items, ('amount',))
+            self.filter(id__in=empty_items).delete()
+
+    def get_recipe_amounts(self, recipe_id):
+        """Метод получения количества ингредиентов рецепта."""
+        return dict(
+            IngredientRecipe.objects.filter(recipe_id=recipe_id)
+            .values_list('ingredient_id', 'amount')
+        )
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """Метод добавления ингредиентов рецепта в список покупок."""
+        self.apply_deltas({
+            (user_id, ingredient_id): sign * amount
+            for ingredient_id, amount
+            in self.get_recipe_amounts(recipe_id).items()
+        })
+
+    def remove_recipe(self, user_id, recipe_id):
+        """Метод вычитания ингредиентов рецепта из списка покупок."""
+        self.add_recipe(user_id, recipe_id, sign=-1)
+
+    def add_recipes(self, user, recipe_ids, sign=1):
+        """Метод добавления ингредиентов нескольких рецептов одним чтением."""
+        deltas = {}
+        for ingredient_id, amount in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', 'amount'):
+            key = (user.id, ingredient_id)
+            deltas[key] = deltas.get(key, 0) + sign * amount
+        self.apply_deltas(deltas)
+
+    def remove_recipes(self, user, recipe_ids):
+        """Метод вычитания ингредиентов нескольких рецептов."""
+        self.add_recipes(user, recipe_ids, sign=-1)
+
+    def change_ingredients(self, changes):
+        """Метод обновления списков покупок после изменения рецептов.
+
+        changes это разница {(recipe_id, ingredient_id): amount}, она
+        применяется к спискам всех, у кого рецепт в корзине.
+        """
+        changes = {key: amount for key, amount in changes.items() if amount}
+        if not changes:
+            return
+        user_ids = {}
+        for user_id, recipe_id in ShoppingCart.objects.filter(
+            recipe_id__in={recipe_id for recipe_id, _ in changes}
+        ).values_list('user_id', 'recipe_id'):
+            user_ids.setdefault(recipe_id, []).append(user_id)
+        deltas = {}
+        for (recipe_id, ingredient_id), amount in changes.items():
+            for user_id in user_ids.get(recipe_id, ()):
+                key = (user_id, ingredient_id)
+                deltas[key] = deltas.get(key, 0) + amount
+        self.apply_deltas(deltas)
+
+    def compute(self):
+        """Метод подсчёта списков покупок заново по корзинам."""
+        return IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        ).values_list(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(
+            total_amount=Sum('amount')
+        ).order_by()
+
+
+class ShoppingListItem(models.Model):
+    """Настройки модели сводного Списка покупок."""
+
+    user = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, related_name='shopping_list'
+    )
+    amount = models.PositiveIntegerField()
+
+    objects = ShoppingListManager()
+
+    class Meta:
+        """Метаданные модели сводного Списка покупок."""
+
+        ordering = ('user', 'ingredient__name')
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Сводный список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_shopping_list_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        """Возвращает строковое представление объекта."""
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+class RecipeRanking(models.Model):
+    """Настройки модели рейтинга Рецептов.
+
+    Популярность и тренд считает команда rank_recipes, строка есть у
+    каждого рецепта, поэтому сортировка по рейтингу идёт по индексу.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ranking',
+    )
+    popular_score = models.FloatField(default=0)
+    trending_score = models.FloatField(default=0)
+
+    class Meta:
+        """Метаданные модели рейтинга Рецептов."""
+
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(
+                fields=('-popular_score', '-recipe'),
+                name='ranking_popular_idx'
+            ),
+            models.Index(
+                fields=('-trending_score', '-recipe'),
+                name='ranking_trending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        """Возвращает строковое представление объекта."""
+        return (
+            f'{self.recipe_id} {self.popular_score} {self.trending_score}'
+        )
+
+
+class RecipeIngredientIndex(models.Model):
+    """Настройки модели индекса ингредиентов Рецепта.
+
+    Хранит отсортированный массив id ингредиентов рецепта с GIN
+    индексом для поиска по продуктам в PostgreSQL. Строки пишет
+    триггер на таблице ингредиентов рецепта.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ingredient_index',
+    )
+    ingredient_ids = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        """Метаданные модели индекса ингредиентов Рецепта."""
+
+        verbose_name = 'Индекс ингредиентов рецепта'
+        verbose_name_plural = 'Индекс ингредиентов рецептов'
+
+    def __str__(self):
+        """Возвращает строковое представление объекта."""
+        return f'{self.recipe_id} {self.ingredient_ids}'
+
+
+class TimelineManager(models.Manager):
+    """Менеджер лент подписок.
+
+    Новый рецепт раскладывается в ленты подписчиков автора при
+    публикации. Авторы, у которых подписчиков больше
+    FEED_FANOUT_MAX_FOLLOWERS, в ленты не пишутся: их рецепты
+    подмешиваются при чтении ленты. Когда подписчиков становится меньше,
+    последние рецепты автора раскладываются в ленты заново.
+    """
+
+    def add_entries(self, entries):
+        """Метод пакетной вставки записей лент без дублей."""
+        self.bulk_create(
+            entries, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True
+        )
+
+    def fan_out(self, recipe):
+        """Метод раскладки нового рецепта в ленты подписчиков автора.
+
+        Популярность автора определяется по followers_count, как и при
+        чтении ленты.
+        """
+        self.fan_out_many([recipe])
+
+    def fan_out_many(self, recipes):
+        """Метод раскладки пачки новых рецептов в ленты подписчиков.
+
+        Подписчики всех авторов пачки читаются одним запросом.
+        """
+        followers = {}
+        for user_id, author_id in Subscription.objects.filter(
+            subscription_id__in={recipe.author_id for recipe in recipes},
+            subscription__followers_count__lte=FEED_FANOUT_MAX_FOLLOWERS
+        ).values_list('user_id', 'subscription_id').order_by():
+            followers.setdefault(author_id, []).append(user_id)
+        self.add_entries(
+            TimelineEntry(
+                user_id=user_id, recipe_id=recipe.id, created=recipe.created
+            )
+            for recipe in recipes
+            for user_id in followers.get(recipe.author_id, ())
+        )
+
+    def add_author(self, user_id, author_id):
+        """Метод добавления последних рецептов автора в ленту подписчика."""
+        self.add_authors(user_id, [author_id])
+
+    def add_authors(self, user_id, author_ids):
+        """Метод добавления последних рецептов авторов в ленту подписчика.
+
+        Последние рецепты каждого автора выбираются одним запросом
+        через коррелированный подзапрос.
+        """
+        latest = Recipe.objects.filter(
+            author_id=OuterRef('author_id')
+        ).order_by('-created', '-id').values('id')[:FEED_BACKFILL_SIZE]
+        self.add_entries(
+            TimelineEntry(
+                user_id=user_id, recipe_id=recipe_id, created=created
+            )
+            for recipe_id, created in Recipe.objects.filter(
+                author_id__in=author_ids,
+                author__followers_count__lte=FEED_FANOUT_MAX_FOLLOWERS,
+                id__in=Subquery(latest)
+            ).values_list('id', 'created')
+        )
+
+    def add_recipes(self, author_id, user_ids):
+        """Метод добавления последних рецептов автора в ленты user_ids.
+
+        Возвращает число записей.
+        """
+        recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+            '-created', '-id'
+        ).values_list('id', 'created')[:FEED_BACKFILL_SIZE])
+        self.add_entries(
+            TimelineEntry(
+                user_id=user_id, recipe_id=recipe_id, created=created
+            )
+            for recipe_id, created in recipes
+            for user_id in user_ids
+        )
+        return len(recipes) * len(user_ids)
+
+    def add_former_celebrities(self, author_ids):
+        """Метод раскладки рецептов авторов, ставших обычными.
+
+        Вызывается после отписки с уже уменьшенным счётчиком
+        подписчиков. Рецепты автора, у которого осталось ровно
+        FEED_FANOUT_MAX_FOLLOWERS подписчиков, перестают подмешиваться
+        при чтении ленты, поэтому его последние рецепты раскладываются в
+        ленты всех подписчиков.
+        """
+        for author_id in Profile.objects.filter(
+            id__in=author_ids, followers_count=FEED_FANOUT_MAX_FOLLOWERS
+        ).values_list('id', flat=True):
+            self.add_recipes(author_id, list(Subscription.objects.filter(
+                subscription_id=author_id
+            ).values_list('user_id', flat=True)))
+
+    def remove_author(self, user_id, author_id):
+        """Метод удаления рецептов автора из ленты бывшего подписчика."""
+        self.remove_authors(user_id, [author_id])
+
+    def remove_authors(self, user_id, author_ids):
+        """Метод удаления рецептов авторов из ленты бывшего подписчика."""
+        self.filter(
+            user_id=user_id, recipe__author_id__in=author_ids
+        ).delete()
+
+    @transaction.atomic
+    def rebuild(self):
+        """Метод пересборки всех лент по подпискам.
+
+        В ленту попадают последние FEED_BACKFILL_SIZE рецептов каждого
+        автора, на которого подписан пользователь. Возвращает число
+        записей.
+        """
+        self.all().delete()
+        followers = {}
+        for user_id, author_id in Subscription.objects.filter(
+            subscription__followers_count__lte=FEED_FANOUT_MAX_FOLLOWERS
+        ).values_list('user_id', 'subscription_id').order_by().iterator():
+            followers.setdefault(author_id, []).append(user_id)
+        count = 0
+        for author_id, user_ids in followers.items():
+            count += self.add_recipes(author_id, user_ids)
+        return count
+
+
+class TimelineEntry(models.Model):
+    """Настройки модели записи ленты подписок.
+
+    Дата публикации рецепта копируется в запись, чтобы страница ленты
+    читалась по индексу (user, created, recipe) без соединений.
+    """
+
+    user = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='timeline_entries'
+    )
+    created = models.DateTimeField(verbose_name='Дата публикации рецепта')
+
+    objects = TimelineManager()
+
+    class Meta:
+        """Метаданные модели записи ленты подписок."""
+
+        ordering = ('user', '-created', '-recipe')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_timeline_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-created', '-recipe'),
+                name='timeline_user_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        """Возвращает строковое представление объекта."""
+        return f'{self.user} {self.recipe}'
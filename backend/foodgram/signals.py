@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Отправляется после пакетной загрузки ингредиентов в обход save(), когда
+# сигналы моделей не приходят. Приложение api по нему обновляет индекс
+# и снимок каталога ингредиентов.
+ingredients_loaded = Signal()
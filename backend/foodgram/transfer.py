@@ -0,0 +1,393 @@
+import codecs
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from urllib.parse import urljoin
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from foodgram.constants import (MAX_AMOUNT_VALUE, MAX_COOKING_TIME_SCORE,
+                                MAX_RECIPE_LENGTH, MIN_AMOUNT_VALUE,
+                                MIN_COOKING_TIME_SCORE, TRANSFER_BATCH_SIZE,
+                                TRANSFER_EXPORT_CHUNK_SIZE,
+                                TRANSFER_IMAGES_DIR, TRANSFER_INSERT_SIZE)
+from foodgram.counters import change_counters_many
+from foodgram.images import try_decode_image
+from foodgram.models import (Ingredient, IngredientRecipe, Profile, Recipe,
+                             RecipeRanking, Tag, TagRecipe, TimelineEntry)
+
+IMAGE_UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+def chunked(rows, size):
+    """Функция разбиения строк на пачки заданного размера."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_record(record):
+    """Функция форматирования записи строкой JSON Lines."""
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def copy_image(image, images_dir):
+    """Функция копирования файла изображения из хранилища в папку.
+
+    Возвращает False, если файла в хранилище нет.
+    """
+    target = os.path.join(images_dir, posixpath.basename(image))
+    if os.path.exists(target):
+        return True
+    try:
+        with default_storage.open(image) as source, open(
+            target, 'wb'
+        ) as file:
+            shutil.copyfileobj(source, file)
+    except OSError:
+        return False
+    return True
+
+
+def export_recipes(chunk_size=TRANSFER_EXPORT_CHUNK_SIZE, images_dir=None,
+                   media_url=None):
+    """Функция выгрузки рецептов записями для JSON Lines.
+
+    Рецепты читаются серверным курсором iterator(), ингредиенты и тэги
+    дочитываются пачками по chunk_size рецептов, поэтому память не
+    зависит от размера каталога. С images_dir файлы изображений
+    копируются в эту папку, изображение без файла выгружается как null.
+    С media_url в запись добавляется адрес изображения.
+    """
+    rows = Recipe.objects.order_by('id').values_list(
+        'id', 'author__username', 'name', 'text', 'cooking_time',
+        'created', 'image'
+    ).iterator(chunk_size=chunk_size)
+    for chunk in chunked(rows, chunk_size):
+        recipe_ids = [row[0] for row in chunk]
+        ingredients, tags = {}, {}
+        for recipe_id, name, measurement_unit, amount in (
+            IngredientRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .order_by('id').values_list(
+                'recipe_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'
+            )
+        ):
+            ingredients.setdefault(recipe_id, []).append({
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            })
+        for recipe_id, slug in TagRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('id').values_list('recipe_id', 'tag__slug'):
+            tags.setdefault(recipe_id, []).append(slug)
+        for recipe_id, author, name, text, cooking_time, created, image in (
+            chunk
+        ):
+            record = {
+                'author': author,
+                'name': name,
+                'text': text,
+                'cooking_time': cooking_time,
+                'created': created.isoformat(),
+                'image': posixpath.join(
+                    TRANSFER_IMAGES_DIR, posixpath.basename(image)
+                ),
+                'tags': tags.get(recipe_id, []),
+                'ingredients': ingredients.get(recipe_id, []),
+            }
+            if images_dir is not None and not copy_image(image, images_dir):
+                record['image'] = None
+            if media_url is not None:
+                record['image_url'] = urljoin(media_url, image)
+            yield record
+
+
+def read_records(lines, start=0):
+    """Функция чтения записей JSON Lines после строки start.
+
+    Отдаёт (номер строки, запись или None, ошибка или None), пустые
+    строки пропускаются.
+    """
+    for number, line in enumerate(lines, 1):
+        if number <= start or not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield number, None, f'Некорректный JSON: {error}.'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Запись должна быть объектом JSON.'
+            continue
+        yield number, record, None
+
+
+def check_range(value, minimum, maximum, name):
+    """Функция проверки целого числа в допустимых границах."""
+    if (
+        not isinstance(value, int) or isinstance(value, bool)
+        or not minimum <= value <= maximum
+    ):
+        raise ValueError(
+            f'Поле {name} должно быть целым от {minimum} до {maximum}.'
+        )
+
+
+def check_record(record):
+    """Функция проверки полей записи рецепта по правилам API."""
+    for name in ('author', 'name', 'text'):
+        if not isinstance(record.get(name), str) or not record[name]:
+            raise ValueError(f'Поле {name} должно быть непустой строкой.')
+    if len(record['name']) > MAX_RECIPE_LENGTH:
+        raise ValueError(
+            f'Название длиннее {MAX_RECIPE_LENGTH} символов.'
+        )
+    check_range(
+        record.get('cooking_time'), MIN_COOKING_TIME_SCORE,
+        MAX_COOKING_TIME_SCORE, 'cooking_time'
+    )
+    if record.get('created') is not None and (
+        not isinstance(record['created'], str)
+        or parse_datetime(record['created']) is None
+    ):
+        raise ValueError('Поле created должно быть датой ISO 8601.')
+    tags = record.get('tags')
+    if not isinstance(tags, list) or not tags or not all(
+        isinstance(slug, str) for slug in tags
+    ):
+        raise ValueError('Нужен хотя бы один тэг в виде slug.')
+    if len(set(tags)) != len(tags):
+        raise ValueError('Тэги не должны повторяться.')
+    ingredients = record.get('ingredients')
+    if not isinstance(ingredients, list) or not ingredients:
+        raise ValueError('Нужен хотя бы один ингредиент.')
+    keys = set()
+    for ingredient in ingredients:
+        if not isinstance(ingredient, dict) or not all(
+            isinstance(ingredient.get(name), str)
+            for name in ('name', 'measurement_unit')
+        ):
+            raise ValueError(
+                'У ингредиента должны быть name и measurement_unit.'
+            )
+        check_range(
+            ingredient.get('amount'), MIN_AMOUNT_VALUE, MAX_AMOUNT_VALUE,
+            'amount'
+        )
+        keys.add((ingredient['name'], ingredient['measurement_unit']))
+    if len(keys) != len(ingredients):
+        raise ValueError('Ингредиенты не должны повторяться.')
+
+
+class RecipeImporter:
+    """Загрузка рецептов из записей JSON Lines пачками.
+
+    Каждая пачка из batch_size записей пишется в своей транзакции
+    пакетными вставками Recipe, IngredientRecipe и TagRecipe по
+    insert_size строк. Изображения читаются и проверяются в пуле из
+    workers процессов, с нулём workers в текущем процессе. Вставки не
+    отправляют сигналов, поэтому рейтинги, счётчики авторов и ленты
+    подписчиков обновляются здесь же пакетно. После каждой пачки run
+    отдаёт номер последней обработанной строки, с него загрузку можно
+    продолжить.
+    """
+
+    def __init__(self, root, batch_size=TRANSFER_BATCH_SIZE,
+                 insert_size=TRANSFER_INSERT_SIZE, workers=0,
+                 default_author=None):
+        self.root = root
+        self.batch_size = batch_size
+        self.insert_size = insert_size
+        self.workers = workers
+        self.default_author = default_author
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+
+    def run(self, lines, start=0):
+        """Метод загрузки строк после start, отдаёт прогресс по пачкам."""
+        pool = ProcessPoolExecutor(self.workers) if self.workers else None
+        try:
+            for chunk in chunked(
+                read_records(lines, start), self.batch_size
+            ):
+                yield self.load_chunk(chunk, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def decode_images(self, records, pool):
+        """Метод чтения изображений пачки, с пулом процессов параллельно.
+
+        Вместо изображения с ошибкой возвращается ValueError.
+        """
+        images = [record.get('image') for record in records]
+        if pool is None:
+            return [try_decode_image(image, self.root) for image in images]
+        return list(pool.map(
+            try_decode_image, images, repeat(self.root),
+            chunksize=max(len(images) // (self.workers * 4), 1)
+        ))
+
+    def save_image(self, name, content):
+        """Метод сохранения изображения в хранилище без дублей."""
+        path = posixpath.join(IMAGE_UPLOAD_TO, name)
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(content))
+        return path
+
+    def load_chunk(self, chunk, pool):
+        """Метод загрузки пачки записей в одной транзакции."""
+        errors = {number: error for number, _, error in chunk if error}
+        records = {}
+        for number, record, error in chunk:
+            if error:
+                continue
+            try:
+                check_record(record)
+            except ValueError as check_error:
+                errors[number] = str(check_error)
+                continue
+            records[number] = record
+        authors = dict(Profile.objects.filter(username__in={
+            record['author'] for record in records.values()
+        } | {self.default_author} - {None}).values_list('username', 'id'))
+        ingredients = {
+            (name, measurement_unit): ingredient_id
+            for ingredient_id, name, measurement_unit
+            in Ingredient.objects.filter(name__in={
+                ingredient['name'] for record in records.values()
+                for ingredient in record['ingredients']
+            }).values_list('id', 'name', 'measurement_unit')
+        }
+        for number, record in list(records.items()):
+            record['author_id'] = authors.get(
+                record['author'], authors.get(self.default_author)
+            )
+            missing = [
+                f'тэг {slug}' for slug in record['tags']
+                if slug not in self.tags
+            ] + [
+                f'ингредиент {ingredient["name"]}'
+                for ingredient in record['ingredients']
+                if (ingredient['name'], ingredient['measurement_unit'])
+                not in ingredients
+            ]
+            if record['author_id'] is None:
+                missing.insert(0, f'автор {record["author"]}')
+            if missing:
+                errors[number] = f'Не найдены: {", ".join(missing)}.'
+                del records[number]
+        for number, image in zip(
+            list(records), self.decode_images(records.values(), pool)
+        ):
+            if isinstance(image, Exception):
+                errors[number] = str(image)
+                del records[number]
+            else:
+                records[number]['image'] = self.save_image(*image)
+        with transaction.atomic():
+            recipes = self.create_recipes(records.values())
+            IngredientRecipe.objects.bulk_create(
+                (
+                    IngredientRecipe(
+                        recipe_id=recipe.id,
+                        ingredient_id=ingredients[
+                            ingredient['name'], ingredient['measurement_unit']
+                        ],
+                        amount=ingredient['amount'],
+                    )
+                    for recipe, record in zip(recipes, records.values())
+                    for ingredient in record['ingredients']
+                ),
+                batch_size=self.insert_size
+            )
+            TagRecipe.objects.bulk_create(
+                (
+                    TagRecipe(recipe_id=recipe.id, tag_id=self.tags[slug])
+                    for recipe, record in zip(recipes, records.values())
+                    for slug in record['tags']
+                ),
+                batch_size=self.insert_size
+            )
+            RecipeRanking.objects.bulk_create(
+                (RecipeRanking(recipe_id=recipe.id) for recipe in recipes),
+                batch_size=self.insert_size
+            )
+            change_counters_many(recipes, 1)
+            TimelineEntry.objects.fan_out_many(recipes)
+        return {
+            'line': chunk[-1][0],
+            'created': len(recipes),
+            'errors': [
+                {'line': number, 'error': error}
+                for number, error in sorted(errors.items())
+            ],
+        }
+
+    def create_recipes(self, records):
+        """Метод пакетной вставки рецептов с датами создания из записей."""
+        recipes = [
+            Recipe(
+                author_id=record['author_id'],
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                image=record['image'],
+            )
+            for record in records
+        ]
+        if not recipes:
+            return recipes
+        Recipe.objects.bulk_create(recipes, batch_size=self.insert_size)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # Без RETURNING id берутся подряд до последнего: транзакция
+            # держит блокировку записи, других вставок между ними нет.
+            last_id = Recipe.objects.aggregate(last_id=Max('id'))['last_id']
+            for recipe_id, recipe in enumerate(
+                recipes, last_id - len(recipes) + 1
+            ):
+                recipe.id = recipe_id
+        dated = []
+        for recipe, record in zip(recipes, records):
+            if record.get('created'):
+                recipe.created = parse_datetime(record['created'])
+                dated.append(recipe)
+        Recipe.objects.bulk_update(
+            dated, ('created',), batch_size=self.insert_size
+        )
+        return recipes
+
+
+def import_uploaded_recipes(recipes_file, image_files, start=0,
+                            default_author=None):
+    """Функция загрузки рецептов из файлов формы.
+
+    Изображения сохраняются во временную папку images, как в выгрузке
+    командой. Отдаёт строки JSON Lines с прогрессом по пачкам.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        images_dir = os.path.join(root, TRANSFER_IMAGES_DIR)
+        os.makedirs(images_dir)
+        for image_file in image_files:
+            with open(os.path.join(
+                images_dir, os.path.basename(image_file.name)
+            ), 'wb') as file:
+                for part in image_file.chunks():
+                    file.write(part)
+        importer = RecipeImporter(root, default_author=default_author)
+        for progress in importer.run(
+            codecs.iterdecode(recipes_file, 'utf-8'), start
+        ):
+            yield format_record(progress)
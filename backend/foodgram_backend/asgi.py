@@ -2,6 +2,8 @@
 ASGI config for foodgram_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Server-sent events of new recipes are served here without Django's request
+cycle, everything else goes to the Django application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.events import EVENTS_PATH, recipe_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Приложение ASGI: поток событий или Django."""
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await recipe_events(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -26,12 +26,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'djoser',
     'django_filters'
 ]
 
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,8 +41,27 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
 ]
 
+QUERY_BUDGET_RAISE = env.bool('QUERY_BUDGET_RAISE', default=False)
+
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+
+METRICS_DIR = env.str('METRICS_DIR', default='')
+
+SEARCH_POPULARITY_WEIGHT = env.float('SEARCH_POPULARITY_WEIGHT', default=0)
+
+RECIPE_MATRIX_DIR = env.str('RECIPE_MATRIX_DIR', default='')
+
+INGREDIENT_SEARCH_LIMIT = env.int('INGREDIENT_SEARCH_LIMIT', default=50)
+
+INGREDIENT_INDEX_VERSION_FILE = env.str(
+    'INGREDIENT_INDEX_VERSION_FILE', default=''
+)
+
 ROOT_URLCONF = 'foodgram_backend.urls'
 
 TEMPLATES = [